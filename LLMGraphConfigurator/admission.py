@@ -0,0 +1,222 @@
+"""
+Admission control for the /run endpoint
+
+Requests wait in a bounded priority queue until one of max_concurrency workflow slots
+is free. A request fails fast with AdmissionRejected when the queue is full, when its
+deadline passes while it waits, or as soon as the expected wait (queue position times
+the mean workflow duration) already exceeds its deadline. Priority classes let short
+voice commands start before long documentation questions; within a class requests
+are served in arrival order.
+
+The queue serves both server modes: acquire() blocks a request thread (Flask) and
+acquire_async() awaits in the event loop (ASGI).
+"""
+import os
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+
+# Priority classes, served in this order
+PRIORITIES = {"high": 0, "normal": 1, "low": 2}
+
+
+class AdmissionRejected(RuntimeError):
+    """A request was not admitted; reason is "queue_full", "deadline" or "expected_wait" """
+
+    def __init__(self, reason: str, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    def __init__(self, priority: str, notify):
+        self.priority = priority
+        self.notify = notify  # Called with the queue lock held once a slot is handed over
+        self.admitted = False
+        self.cancelled = False
+        self.enqueued = time.perf_counter()
+
+
+class AdmissionQueue:
+    """Bounded priority queue in front of the workflow engine"""
+
+    def __init__(self, max_concurrency: int = 32, max_queue: int = 128, default_timeout: float = 10.0,
+                 max_samples: int = 1000):
+        """
+        Args:
+            max_concurrency: Workflows running at once
+            max_queue: Requests waiting at once; further requests are rejected immediately
+            default_timeout: Seconds a request may wait for a slot when it brings no deadline
+            max_samples: Recent wait and run times kept per priority class for the statistics
+        """
+        self.max_concurrency = max_concurrency
+        self.max_queue = max_queue
+        self.default_timeout = default_timeout
+        self._lock = threading.Lock()
+        self._heap = []
+        self._sequence = itertools.count()
+        self._waiting = 0
+        self.running = 0
+        self._run_time = None  # Moving average of the workflow duration in seconds
+        self._waits = {p: deque(maxlen=max_samples) for p in PRIORITIES}
+        self._counts = {p: {"admitted": 0, "queue_full": 0, "deadline": 0, "expected_wait": 0} for p in PRIORITIES}
+
+    def _enqueue(self, priority: str, timeout: float, notify) -> _Waiter:
+        """Admit at once or queue a waiter; raises AdmissionRejected if the request cannot start in time"""
+        if priority not in PRIORITIES:
+            raise ValueError(f"Unknown priority {priority!r}, expected one of {sorted(PRIORITIES)}")
+        waiter = _Waiter(priority, notify)
+        with self._lock:
+            if self.running < self.max_concurrency and not self._waiting:
+                self.running += 1
+                waiter.admitted = True
+                self._record_admission(waiter)
+                return waiter
+            if self._waiting >= self.max_queue:
+                self._counts[priority]["queue_full"] += 1
+                raise AdmissionRejected("queue_full", f"Request queue is full ({self.max_queue} waiting)",
+                                        retry_after=self._run_time or 1.0)
+            if self._run_time is not None:
+                ahead = sum(1 for p, _, w in self._heap if p <= PRIORITIES[priority] and not w.cancelled)
+                expected = (ahead // self.max_concurrency + 1) * self._run_time
+                if expected > timeout:
+                    self._counts[priority]["expected_wait"] += 1
+                    raise AdmissionRejected("expected_wait",
+                                            f"Expected wait {expected:.1f}s exceeds the deadline of {timeout:.1f}s",
+                                            retry_after=expected)
+            heapq.heappush(self._heap, (PRIORITIES[priority], next(self._sequence), waiter))
+            self._waiting += 1
+        return waiter
+
+    def _record_admission(self, waiter: _Waiter):
+        self._waits[waiter.priority].append(time.perf_counter() - waiter.enqueued)
+        self._counts[waiter.priority]["admitted"] += 1
+
+    def _give_up(self, waiter: _Waiter) -> bool:
+        """Withdraw a waiter whose deadline passed; False if it was admitted in the meantime"""
+        with self._lock:
+            if waiter.admitted:
+                return False
+            waiter.cancelled = True
+            self._waiting -= 1
+            self._counts[waiter.priority]["deadline"] += 1
+            return True
+
+    def _timeout(self, timeout: float = None) -> float:
+        return self.default_timeout if timeout is None else timeout
+
+    def acquire(self, priority: str = "normal", timeout: float = None) -> float:
+        """
+        Wait for a workflow slot in the calling thread
+
+        Args:
+            priority: Priority class, see PRIORITIES
+            timeout: Seconds the request may wait; defaults to default_timeout
+
+        Returns:
+            float: Seconds waited
+        """
+        timeout = self._timeout(timeout)
+        event = threading.Event()
+        waiter = self._enqueue(priority, timeout, event.set)
+        if not waiter.admitted and not event.wait(timeout) and self._give_up(waiter):
+            raise AdmissionRejected("deadline", f"No workflow slot free within {timeout:.1f}s")
+        return time.perf_counter() - waiter.enqueued
+
+    async def acquire_async(self, priority: str = "normal", timeout: float = None) -> float:
+        """Event-loop variant of acquire"""
+        timeout = self._timeout(timeout)
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def notify():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(priority, timeout, notify)
+        if waiter.admitted:
+            return 0.0
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            if self._give_up(waiter):
+                raise AdmissionRejected("deadline", f"No workflow slot free within {timeout:.1f}s")
+        except asyncio.CancelledError:  # The client went away while waiting
+            if not self._give_up(waiter):
+                self.release()
+            raise
+        return time.perf_counter() - waiter.enqueued
+
+    def release(self, run_time: float = None):
+        """
+        Free a slot and hand it to the next waiter
+
+        Args:
+            run_time: Duration of the finished workflow, used to predict waits
+        """
+        with self._lock:
+            if run_time is not None:
+                self._run_time = run_time if self._run_time is None else 0.8 * self._run_time + 0.2 * run_time
+            while self._heap:
+                _, _, waiter = heapq.heappop(self._heap)
+                if waiter.cancelled:
+                    continue
+                self._waiting -= 1
+                waiter.admitted = True
+                self._record_admission(waiter)
+                waiter.notify()
+                return
+            self.running -= 1
+
+    def stats(self) -> dict:
+        """Queue depth, running workflows and wait time statistics per priority class"""
+        with self._lock:
+            depth = {p: 0 for p in PRIORITIES}
+            for _, _, waiter in self._heap:
+                if not waiter.cancelled:
+                    depth[waiter.priority] += 1
+            priorities = {}
+            for p in PRIORITIES:
+                waits = sorted(self._waits[p])
+                priorities[p] = dict(self._counts[p], queued=depth[p])
+                if waits:
+                    priorities[p].update({
+                        "wait_mean": sum(waits) / len(waits),
+                        "wait_p50": waits[len(waits) // 2],
+                        "wait_p95": waits[min(len(waits) - 1, int(len(waits) * 0.95))],
+                        "wait_max": waits[-1]
+                    })
+            return {"running": self.running, "queued": self._waiting, "max_concurrency": self.max_concurrency,
+                    "max_queue": self.max_queue, "mean_run_time": self._run_time, "priorities": priorities}
+
+
+def request_priority(question, requested: str = None, utterance_words: int = None) -> str:
+    """
+    Priority class of a /run request
+
+    An explicit priority wins. Otherwise utterances of at most LLMTSUP_SHORT_UTTERANCE_WORDS
+    words (default 6), typically voice commands, are "high" and everything else "normal".
+
+    Args:
+        question: Request payload; for a dict only its "question" field is measured
+        requested: Priority class sent by the client
+        utterance_words: Word count of what the user said, sent by the client. The headset
+            appends its prompt injection to the question, so the question text alone
+            overstates the length of a spoken command.
+    """
+    if requested:
+        return requested
+    if utterance_words is None:
+        text = question.get("question", "") if isinstance(question, dict) else question
+        utterance_words = len(str(text).split())
+    return "high" if int(utterance_words) <= int(os.environ.get("LLMTSUP_SHORT_UTTERANCE_WORDS", "6")) else "normal"
+
+
+admission_queue = AdmissionQueue(
+    max_concurrency=int(os.environ.get("LLMTSUP_MAX_CONCURRENCY", "32")),
+    max_queue=int(os.environ.get("LLMTSUP_MAX_QUEUE", "128")),
+    default_timeout=float(os.environ.get("LLMTSUP_QUEUE_TIMEOUT", "10"))
+)
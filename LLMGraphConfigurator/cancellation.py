@@ -0,0 +1,140 @@
+"""
+Cooperative cancellation of workflow runs
+
+A CancelToken belongs to one /run request. The server cancels it when the client
+disconnects, and it expires by itself once the request's deadline passes. The workflow
+checks the token before every node, so an abandoned request schedules no further nodes
+and commits no memory. LLM clients find the token of the request they serve through
+current_token() and abort in-flight provider calls where the SDK allows it: awaited calls
+are cancelled, and blocking calls get the remaining time as their request timeout.
+"""
+import time
+import asyncio
+import threading
+import contextlib
+import contextvars
+from typing import Optional
+
+_current_token = contextvars.ContextVar("llmtsup_cancel_token", default=None)
+
+
+class WorkflowCancelled(RuntimeError):
+    """A workflow run was cancelled; reason is "disconnected", "deadline" or the reason given to cancel()"""
+
+    def __init__(self, reason: str):
+        super().__init__(f"Workflow cancelled ({reason})")
+        self.reason = reason
+
+
+class CancelToken:
+    """Cancellation state of one workflow run, shared by the request handler, the executor and the LLM clients"""
+
+    def __init__(self, timeout: float = None):
+        """
+        Args:
+            timeout: Seconds until the run is cancelled with reason "deadline"; None for no deadline
+        """
+        self.deadline = time.monotonic() + timeout if timeout is not None else None
+        self._event = threading.Event()
+        self._reason = None
+        self._callbacks = []
+        self._lock = threading.Lock()
+
+    def cancel(self, reason: str = "cancelled"):
+        """Cancel the run and call the registered callbacks; later calls are ignored"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            callback()
+
+    @property
+    def reason(self) -> Optional[str]:
+        """Why the run was cancelled, None while it may continue"""
+        if not self._event.is_set() and self.remaining() == 0:
+            self.cancel("deadline")
+        return self._reason
+
+    @property
+    def cancelled(self) -> bool:
+        return self.reason is not None
+
+    def remaining(self) -> Optional[float]:
+        """Seconds until the deadline, None without a deadline"""
+        if self.deadline is None:
+            return None
+        return max(0.0, self.deadline - time.monotonic())
+
+    def check(self):
+        """Raise WorkflowCancelled if the run was cancelled"""
+        if self.cancelled:
+            raise WorkflowCancelled(self.reason)
+
+    def sleep(self, seconds: float):
+        """time.sleep that raises WorkflowCancelled as soon as the run is cancelled"""
+        remaining = self.remaining()
+        self._event.wait(seconds if remaining is None else min(seconds, remaining))
+        self.check()
+
+    def on_cancel(self, callback):
+        """
+        Call callback once when the run is cancelled (at once if it already is)
+
+        Deadlines only fire callbacks once they are noticed, e.g. by check(); run() watches
+        them itself.
+
+        Returns:
+            callable: Removes the callback again
+        """
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove_callback(callback)
+        callback()
+        return lambda: None
+
+    def _remove_callback(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+    async def run(self, awaitable):
+        """
+        Await awaitable, cancelling it when the run is cancelled or its deadline passes
+
+        Raises:
+            WorkflowCancelled: The run was cancelled before awaitable finished
+        """
+        self.check()
+        loop = asyncio.get_running_loop()
+        task = asyncio.ensure_future(awaitable)
+        remove = self.on_cancel(lambda: loop.call_soon_threadsafe(task.cancel))
+        try:
+            return await asyncio.wait_for(task, self.remaining())
+        except asyncio.TimeoutError:
+            self.cancel("deadline")
+            raise WorkflowCancelled("deadline")
+        except asyncio.CancelledError:
+            if self._event.is_set() and task.cancelled():
+                raise WorkflowCancelled(self._reason)
+            raise
+        finally:
+            remove()
+
+
+def current_token() -> Optional[CancelToken]:
+    """Cancel token of the workflow run in the current thread or task, None outside a cancellable run"""
+    return _current_token.get()
+
+
+@contextlib.contextmanager
+def cancel_scope(token: Optional[CancelToken]):
+    """Make token the current_token() for the enclosed code; asyncio tasks and to_thread calls inherit it"""
+    reset = _current_token.set(token)
+    try:
+        yield token
+    finally:
+        _current_token.reset(reset)
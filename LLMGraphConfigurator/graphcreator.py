@@ -5,7 +5,7 @@ from collections import defaultdict
 import os
 import random  # Added for random color generation
 import tkinter as tk
-from tkinter import filedialog
+from tkinter import filedialog, messagebox
 
 # Initialize pygame
 pygame.init()
@@ -41,6 +41,28 @@ DROP_ZONE_HOVER = (200, 220, 240)  # Slightly darker blue
 SCROLLBAR_COLOR = (180, 200, 220)  # Light blue for scrollbar
 SCROLLBAR_HOVER = (150, 180, 210)  # Slightly darker for hover
 
+# Generation settings editable on query nodes: (label, key in node.generation)
+GENERATION_FIELDS = [
+    ("Max Output Tokens", "max_tokens"),
+    ("Stop Sequences (separate with |, \\n for newline)", "stop"),
+    ("Temperature", "temperature")
+]
+
+# Per-node model selection on query nodes: (label, key in node.llm); empty provider uses the server default
+LLM_FIELDS = [
+    ("Provider (google, openai, claude, local, ...)", "provider"),
+    ("Model", "model_name")
+]
+
+# History settings editable on memory nodes: (label, key in node.memory)
+MEMORY_FIELDS = [
+    ("Token Budget (empty for the full history)", "max_tokens"),
+    ("Summarize Older Entries (yes/no)", "summarize"),
+    ("Recall Top-k Similar Entries (empty for the newest)", "recall_k"),
+    ("Archive Beyond Size in KB (empty for no limit)", "max_size_kb"),
+    ("Archive Entries Older Than Hours (empty for no limit)", "max_age_hours")
+]
+
 # Configuration field descriptions
 CONFIG_FIELDS = {
     "retrieval": ["Retrieval Document"],
@@ -96,6 +118,9 @@ class Node:
         self.drag_offset_x = 0
         self.drag_offset_y = 0
         self.content = []  # List to store configuration content
+        self.generation = {}  # LLM generation settings for query nodes
+        self.llm = {}  # Provider and model override for query nodes
+        self.memory = {}  # Token budget, summarization, recall mode and archive limits for memory nodes
 
         # Configuration button for non-input/output nodes
         self.config_button = pygame.Rect(
@@ -410,13 +435,20 @@ class Graph:
         node_id_map = {}
         for i, node in enumerate(self.nodes):
             node_id_map[node] = node.id
-            graph_dict["nodes"].append({
+            node_dict = {
                 "id": node.id,
                 "type": node.type,
                 "x": node.x,
                 "y": node.y,
                 "content": node.content
-            })
+            }
+            if node.generation:
+                node_dict["generation"] = node.generation
+            if node.llm:
+                node_dict["llm"] = node.llm
+            if node.memory:
+                node_dict["memory"] = node.memory
+            graph_dict["nodes"].append(node_dict)
 
         for conn in self.connections:
             graph_dict["connections"].append({
@@ -436,6 +468,9 @@ class Graph:
         for node_data in graph_dict["nodes"]:
             node = Node(node_data["id"], node_data["type"], node_data["x"], node_data["y"])
             node.content = node_data.get("content", [])
+            node.generation = dict(node_data.get("generation") or {})
+            node.llm = dict(node_data.get("llm") or {})
+            node.memory = dict(node_data.get("memory") or {})
             self.nodes.append(node)
             node_id_map[node_data["id"]] = node
             if node.id >= self.next_node_id:
@@ -585,14 +620,115 @@ def open_tk_config(node, undo_stack, redo_stack):
 
             texts.append(text)
 
+        # Generation limits for query nodes, e.g. a few tokens for classifiers
+        generation_entries = {}
+        llm_entries = {}
+        if node.type == "query":
+            for label, key in LLM_FIELDS:
+                frame = tk.Frame(root)
+                frame.pack(pady=2, fill=tk.X, padx=5)
+                tk.Label(frame, text=label, width=45, anchor="w").pack(side=tk.LEFT, padx=5)
+                entry = tk.Entry(frame, width=20)
+                entry.insert(0, node.llm.get(key, ""))
+                entry.pack(side=tk.LEFT, padx=5)
+                llm_entries[key] = entry
+            for label, key in GENERATION_FIELDS:
+                frame = tk.Frame(root)
+                frame.pack(pady=2, fill=tk.X, padx=5)
+                tk.Label(frame, text=label, width=45, anchor="w").pack(side=tk.LEFT, padx=5)
+                entry = tk.Entry(frame, width=20)
+                value = node.generation.get(key)
+                if key == "stop" and value:
+                    value = "|".join(s.replace("\n", "\\n") for s in value)
+                if value is not None:
+                    entry.insert(0, str(value))
+                entry.pack(side=tk.LEFT, padx=5)
+                generation_entries[key] = entry
+
+        # Token budget for memory nodes, so long sessions do not grow the prompt
+        memory_entries = {}
+        if node.type == "memory":
+            for label, key in MEMORY_FIELDS:
+                frame = tk.Frame(root)
+                frame.pack(pady=2, fill=tk.X, padx=5)
+                tk.Label(frame, text=label, width=45, anchor="w").pack(side=tk.LEFT, padx=5)
+                entry = tk.Entry(frame, width=20)
+                value = node.memory.get(key)
+                if key == "summarize" and value is not None:
+                    value = "yes" if value else "no"
+                if value is not None:
+                    entry.insert(0, str(value))
+                entry.pack(side=tk.LEFT, padx=5)
+                memory_entries[key] = entry
+
+        def read_memory():
+            memory = {}
+            max_tokens = memory_entries["max_tokens"].get().strip()
+            if max_tokens:
+                memory["max_tokens"] = int(max_tokens)
+                if memory["max_tokens"] < 1:
+                    raise ValueError("Token Budget must be at least 1")
+            summarize = memory_entries["summarize"].get().strip().lower()
+            if summarize:
+                if summarize not in ("yes", "no"):
+                    raise ValueError("Summarize Older Entries must be yes or no")
+                memory["summarize"] = summarize == "yes"
+            recall_k = memory_entries["recall_k"].get().strip()
+            if recall_k:
+                memory["recall_k"] = int(recall_k)
+                if memory["recall_k"] < 1:
+                    raise ValueError("Recall Top-k must be at least 1")
+            for key in ("max_size_kb", "max_age_hours"):
+                value = memory_entries[key].get().strip()
+                if value:
+                    memory[key] = float(value)
+                    if memory[key] <= 0:
+                        raise ValueError("Archive limits must be positive")
+            return memory
+
+        def read_generation():
+            generation = {}
+            max_tokens = generation_entries["max_tokens"].get().strip()
+            if max_tokens:
+                generation["max_tokens"] = int(max_tokens)
+                if generation["max_tokens"] < 1:
+                    raise ValueError("Max Output Tokens must be at least 1")
+            stop = generation_entries["stop"].get()
+            stops = [s.replace("\\n", "\n") for s in stop.split("|") if s]
+            if stops:
+                generation["stop"] = stops
+            temperature = generation_entries["temperature"].get().strip()
+            if temperature:
+                generation["temperature"] = float(temperature)
+            return generation
+
         button_frame = tk.Frame(root)
         button_frame.pack(pady=10)
 
         def save():
+            if generation_entries:
+                try:
+                    generation = read_generation()
+                except ValueError as e:
+                    messagebox.showerror("Invalid generation setting", str(e), parent=root)
+                    return
+            if memory_entries:
+                try:
+                    memory = read_memory()
+                except ValueError as e:
+                    messagebox.showerror("Invalid memory setting", str(e), parent=root)
+                    return
             # Save state before applying changes
             undo_stack.append(graph.to_dict())
             redo_stack.clear()
             node.content = [t.get("1.0", tk.END).strip() for t in texts]
+            if generation_entries:
+                node.generation = generation
+            if llm_entries:
+                llm = {key: entry.get().strip() for key, entry in llm_entries.items() if entry.get().strip()}
+                node.llm = llm if llm.get("provider") else {}
+            if memory_entries:
+                node.memory = memory
             root.destroy()
 
         tk.Button(button_frame, text="Save", command=save).pack(side=tk.LEFT, padx=10)
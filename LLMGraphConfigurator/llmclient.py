@@ -1,7 +1,20 @@
 import os
+import time
+import math
+import asyncio
+import random
+import hashlib
+import threading
+from concurrent.futures import TimeoutError as FutureTimeoutError
 from abc import ABC, abstractmethod
-from typing import Optional
+from typing import Optional, Dict, Any, Iterator, List
 from openai import OpenAI
+from cancellation import current_token
+
+try:
+    from langchain_core.embeddings import Embeddings
+except ImportError:  # Fake embeddings stay usable without LangChain installed
+    Embeddings = object
 
 
 
@@ -95,85 +108,567 @@ def initialize_api_keys():
     return APIConfig()
 
 
+# --- Usage Accounting ---
+# Approximate list prices in USD per 1M tokens (input, output). Models missing here report a cost of 0.
+MODEL_PRICING = {
+    "gemini-2.0-flash-lite": (0.075, 0.30),
+    "gemini-2.0-flash": (0.10, 0.40),
+    "gpt-3.5-turbo": (0.50, 1.50),
+    "claude-3-5-sonnet-20241022": (3.00, 15.00),
+    "grok-3": (3.00, 15.00),
+    "qwen-turbo": (0.05, 0.20),
+}
+
+
+def estimate_tokens(text) -> int:
+    """Rough token estimate (~4 characters per token) for when a provider reports no usage"""
+    if not text:
+        return 0
+    if isinstance(text, list):
+        # Message lists: LangChain message objects, provider dicts or plain strings
+        return sum(estimate_tokens(getattr(m, "content", None) or (m.get("content") if isinstance(m, dict) else m))
+                   for m in text)
+    return max(1, len(str(text)) // 4)
+
+
+def estimate_cost(model_name: str, input_tokens: int, output_tokens: int) -> float:
+    """Estimate the USD cost of a call from MODEL_PRICING"""
+    input_price, output_price = MODEL_PRICING.get(model_name, (0.0, 0.0))
+    return (input_tokens * input_price + output_tokens * output_price) / 1_000_000
+
+
+class UsageTracker:
+    """Thread-safe collector of token usage and latency per LLM call, aggregated per node and provider"""
+
+    def __init__(self, max_records: int = 1000):
+        self.max_records = max_records
+        self.records = []
+        self._totals: Dict[str, Dict[str, Dict[str, Any]]] = {"node": {}, "provider": {}}
+        self._lock = threading.Lock()
+
+    def record(self, provider: str, model_name: str, node_id, input_tokens: int, output_tokens: int,
+               time_to_first_token: float, total_time: float, estimated: bool = False,
+               cached_tokens: int = 0, cache_eligible: bool = False) -> Dict[str, Any]:
+        """
+        Record a single LLM call
+
+        Args:
+            provider: Provider name as passed to get_llm_client
+            model_name: Model used for the call
+            node_id: Graph node that issued the call (None if not called from a graph node)
+            input_tokens: Prompt tokens
+            output_tokens: Completion tokens
+            time_to_first_token: Seconds until the first token was available
+            total_time: Seconds until the full reply was available
+            estimated: True if token counts were estimated instead of reported by the provider
+            cached_tokens: Input tokens served from a provider prompt cache (included in input_tokens)
+            cache_eligible: True if the call marked a cacheable prompt prefix
+
+        Returns:
+            dict: The stored record
+        """
+        entry = {
+            "timestamp": time.time(),
+            "provider": provider,
+            "model": model_name,
+            "node_id": None if node_id is None else str(node_id),
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "time_to_first_token": time_to_first_token,
+            "total_time": total_time,
+            "cost": estimate_cost(model_name, input_tokens, output_tokens),
+            "estimated": estimated,
+            "cached_input_tokens": cached_tokens,
+            "cache_eligible": cache_eligible,
+        }
+        with self._lock:
+            self.records.append(entry)
+            if len(self.records) > self.max_records:
+                del self.records[:len(self.records) - self.max_records]
+            self._accumulate("node", entry["node_id"] or "unattributed", entry)
+            self._accumulate("provider", provider, entry)
+        return entry
+
+    def _accumulate(self, dimension: str, key: str, entry: Dict[str, Any]):
+        totals = self._totals[dimension].setdefault(key, {
+            "calls": 0,
+            "input_tokens": 0,
+            "output_tokens": 0,
+            "cost": 0.0,
+            "total_time": 0.0,
+            "total_time_to_first_token": 0.0,
+            "max_time": 0.0,
+            "cache_lookups": 0,
+            "cache_hits": 0,
+            "cached_input_tokens": 0,
+        })
+        totals["calls"] += 1
+        totals["input_tokens"] += entry["input_tokens"]
+        totals["output_tokens"] += entry["output_tokens"]
+        totals["cost"] += entry["cost"]
+        totals["total_time"] += entry["total_time"]
+        totals["total_time_to_first_token"] += entry["time_to_first_token"]
+        totals["max_time"] = max(totals["max_time"], entry["total_time"])
+        if entry["cache_eligible"]:
+            totals["cache_lookups"] += 1
+            totals["cache_hits"] += 1 if entry["cached_input_tokens"] else 0
+        totals["cached_input_tokens"] += entry["cached_input_tokens"]
+
+    def _stats(self, dimension: str) -> Dict[str, Dict[str, Any]]:
+        with self._lock:
+            stats = {}
+            for key, totals in self._totals[dimension].items():
+                calls = totals["calls"]
+                stats[key] = {
+                    "calls": calls,
+                    "input_tokens": totals["input_tokens"],
+                    "output_tokens": totals["output_tokens"],
+                    "avg_input_tokens": totals["input_tokens"] / calls,
+                    "avg_output_tokens": totals["output_tokens"] / calls,
+                    "cost": totals["cost"],
+                    "avg_time": totals["total_time"] / calls,
+                    "avg_time_to_first_token": totals["total_time_to_first_token"] / calls,
+                    "max_time": totals["max_time"],
+                    "cached_input_tokens": totals["cached_input_tokens"],
+                    "cache_lookups": totals["cache_lookups"],
+                    "cache_hit_rate": (totals["cache_hits"] / totals["cache_lookups"]
+                                       if totals["cache_lookups"] else None),
+                }
+            return stats
+
+    def stats_by_node(self) -> Dict[str, Dict[str, Any]]:
+        """Aggregated statistics keyed by graph node id"""
+        return self._stats("node")
+
+    def stats_by_provider(self) -> Dict[str, Dict[str, Any]]:
+        """Aggregated statistics keyed by provider"""
+        return self._stats("provider")
+
+    def summary(self) -> Dict[str, Any]:
+        """Per-node and per-provider statistics plus the most recent calls"""
+        with self._lock:
+            recent = list(self.records[-20:])
+        return {"nodes": self.stats_by_node(), "providers": self.stats_by_provider(), "recent": recent}
+
+    def reset(self):
+        """Drop all recorded calls and statistics"""
+        with self._lock:
+            self.records = []
+            self._totals = {"node": {}, "provider": {}}
+
+
+# Shared tracker used by all clients unless one is assigned explicitly
+usage_tracker = UsageTracker()
+
+
+# --- Generation Settings ---
+def normalize_generation(generation: Optional[Dict[str, Any]]) -> Dict[str, Any]:
+    """
+    Validate per-call generation settings as stored on graph query nodes
+
+    Args:
+        generation: Dict with optional "max_tokens" (int), "stop" (str or list of str) and "temperature" (float)
+
+    Returns:
+        dict: Only the keys that are set, with "stop" as a list
+    """
+    settings = {}
+    if not generation:
+        return settings
+    unknown = set(generation) - {"max_tokens", "stop", "temperature"}
+    if unknown:
+        raise ValueError(f"Unsupported generation settings: {sorted(unknown)}")
+    if generation.get("max_tokens") is not None:
+        max_tokens = int(generation["max_tokens"])
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+        settings["max_tokens"] = max_tokens
+    stop = generation.get("stop")
+    if stop:
+        settings["stop"] = [stop] if isinstance(stop, str) else [str(s) for s in stop if s]
+    if generation.get("temperature") is not None:
+        settings["temperature"] = float(generation["temperature"])
+    return settings
+
+
+def _langchain_generation_kwargs(generation: Dict[str, Any]) -> Dict[str, Any]:
+    """Map generation settings to invoke kwargs of LangChain chat models that take OpenAI-style parameters"""
+    kwargs = {}
+    if "max_tokens" in generation:
+        kwargs["max_tokens"] = generation["max_tokens"]
+    if "stop" in generation:
+        kwargs["stop"] = generation["stop"]
+    if "temperature" in generation:
+        kwargs["temperature"] = generation["temperature"]
+    return kwargs
+
+
 # --- LLM Client Framework ---
 class LLMClient(ABC):
     """Abstract base class for LLM clients"""
 
+    provider = "unknown"
+    model_name = None
+    usage_tracker = usage_tracker
+
     @abstractmethod
-    def invoke(self, messages) -> str:
-        """Send messages and return the assistant reply"""
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """Send messages and return the assistant reply, recording usage for node_id"""
         pass
 
+    def stream(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> Iterator[str]:
+        """
+        Yield the assistant reply in text increments as it is generated
+
+        Clients without token streaming yield the whole reply at once.
+        """
+        yield self.invoke(messages, node_id=node_id, generation=generation, cacheable_prefix=cacheable_prefix)
+
+    async def ainvoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """
+        Async variant of invoke for the async serving mode
+
+        Clients without an async SDK run invoke in the event loop's thread pool; the others
+        override this so a waiting call does not hold a thread.
+        """
+        return await asyncio.to_thread(self.invoke, messages, node_id=node_id, generation=generation,
+                                       cacheable_prefix=cacheable_prefix)
+
+    def invoke_batch(self, batch: List, node_id=None, max_concurrency: int = 8,
+                     return_exceptions: bool = False, generation=None, cacheable_prefix: str = None) -> List:
+        """
+        Invoke the model for many independent prompts
+
+        The default sends up to max_concurrency requests at once; clients whose SDK has a batch
+        endpoint override this.
+
+        Args:
+            batch: List of prompts, each accepted by invoke
+            node_id: Graph node issuing the calls, used for usage accounting
+            max_concurrency: Maximum requests in flight
+            return_exceptions: Return failed calls as exception objects instead of raising the first one
+            generation: Generation settings applied to every call (see normalize_generation)
+            cacheable_prefix: Static leading text shared by all prompts (see invoke)
+
+        Returns:
+            list: Replies in the order of batch
+        """
+        from concurrent.futures import ThreadPoolExecutor
+
+        def call(messages):
+            try:
+                return self.invoke(messages, node_id=node_id, generation=generation,
+                                   cacheable_prefix=cacheable_prefix)
+            except Exception as e:
+                if not return_exceptions:
+                    raise
+                return e
+
+        if len(batch) <= 1 or max_concurrency <= 1:
+            return [call(m) for m in batch]
+        with ThreadPoolExecutor(max_workers=min(max_concurrency, len(batch))) as executor:
+            return list(executor.map(call, batch))
+
+    @staticmethod
+    def _call_timeout() -> Optional[float]:
+        """
+        Request timeout for a blocking provider call, from the cancel token of the running workflow
+
+        Raises WorkflowCancelled if the run was already cancelled; None if it has no deadline.
+        """
+        token = current_token()
+        if token is None:
+            return None
+        token.check()
+        return token.remaining()
+
+    def _timeout_kwargs(self, name: str = "timeout") -> Dict[str, Any]:
+        """Per-call timeout argument for the SDK (see _call_timeout), empty without a deadline"""
+        timeout = self._call_timeout()
+        return {} if timeout is None else {name: timeout}
+
+    @staticmethod
+    def _split_prefix(messages, cacheable_prefix: Optional[str]):
+        """Return the part of a string prompt after cacheable_prefix, None if the prompt does not start with it"""
+        if (cacheable_prefix and isinstance(messages, str) and messages.startswith(cacheable_prefix)
+                and len(messages) > len(cacheable_prefix)):
+            return messages[len(cacheable_prefix):]
+        return None
+
+    def _record_usage(self, node_id, start_time: float, input_tokens: Optional[int], output_tokens: Optional[int],
+                      first_token_time: Optional[float] = None, prompt=None, reply=None,
+                      cached_tokens: Optional[int] = None, cache_eligible: bool = False) -> Dict[str, Any]:
+        """
+        Record usage of a finished call
+
+        Args:
+            node_id: Graph node that issued the call
+            start_time: time.perf_counter() value taken before the request was sent
+            input_tokens: Prompt tokens reported by the provider (None if unavailable)
+            output_tokens: Completion tokens reported by the provider (None if unavailable)
+            first_token_time: time.perf_counter() value when the first token arrived (None for non-streaming calls)
+            prompt: Prompt used to estimate input tokens if the provider reported none
+            reply: Reply used to estimate output tokens if the provider reported none
+            cached_tokens: Input tokens read from the provider's prompt cache
+            cache_eligible: True if the call marked a cacheable prompt prefix
+        """
+        end_time = time.perf_counter()
+        estimated = input_tokens is None or output_tokens is None
+        if input_tokens is None:
+            input_tokens = estimate_tokens(prompt)
+        if output_tokens is None:
+            output_tokens = estimate_tokens(reply)
+        # Without streaming the first token arrives together with the whole reply
+        time_to_first_token = (first_token_time or end_time) - start_time
+        return self.usage_tracker.record(self.provider, self.model_name, node_id, input_tokens, output_tokens,
+                                         time_to_first_token, end_time - start_time, estimated,
+                                         cached_tokens or 0, cache_eligible)
+
+
+def _langchain_token_counts(response):
+    """Extract (input_tokens, output_tokens) from a LangChain AIMessage, (None, None) if missing"""
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return None, None
+    return usage.get("input_tokens"), usage.get("output_tokens")
+
+
+def _langchain_cached_tokens(response) -> int:
+    """Extract prompt-cache hits from a LangChain AIMessage"""
+    usage = getattr(response, "usage_metadata", None) or {}
+    return (usage.get("input_token_details") or {}).get("cache_read") or 0
+
 
 class GoogleLLMClient(LLMClient):
     """Google Gemini LLM Client"""
 
-    def __init__(self, model_name: str = "gemini-2.0-flash-lite"):
+    provider = "google"
+
+    def __init__(self, model_name: str = "gemini-2.0-flash-lite", context_cache_ttl: int = 3600,
+                 min_cache_tokens: int = 4096):
         from langchain.chat_models import init_chat_model
         self.model_name = model_name
         self.client = init_chat_model(model_name, model_provider="google_genai")
+        # Gemini context caching only accepts prefixes above a model-specific minimum size
+        self.context_cache_ttl = context_cache_ttl
+        self.min_cache_tokens = min_cache_tokens
+        self._context_caches: Dict[str, Any] = {}
+        self._context_cache_lock = threading.Lock()
+
+    def _context_cache(self, prefix: str) -> Optional[str]:
+        """Return the name of a Gemini context cache holding prefix, creating it on first use"""
+        if estimate_tokens(prefix) < self.min_cache_tokens:
+            return None
+        key = hashlib.sha256(prefix.encode("utf-8")).hexdigest()
+        with self._context_cache_lock:
+            cached = self._context_caches.get(key, ())
+            if cached is None:
+                return None  # Creation failed before, do not retry on every call
+            if cached and cached[1] > time.time() + 60:
+                return cached[0]
+            try:
+                from google import genai
+                from google.genai import types
+                cache = genai.Client().caches.create(
+                    model=self.model_name,
+                    config=types.CreateCachedContentConfig(contents=[prefix], ttl=f"{self.context_cache_ttl}s")
+                )
+            except Exception as e:
+                print(f"Gemini context caching unavailable for {self.model_name}: {e}")
+                self._context_caches[key] = None
+                return None
+            self._context_caches[key] = (cache.name, time.time() + self.context_cache_ttl)
+            return cache.name
+
+    def _prepare(self, messages, cacheable_prefix: Optional[str]):
+        """Convert messages to LangChain format, replacing a cached prefix by its context cache"""
+        from langchain_core.messages import HumanMessage
+        extra = {}
+        rest = self._split_prefix(messages, cacheable_prefix)
+        if rest is not None:
+            cache_name = self._context_cache(cacheable_prefix)
+            if cache_name:
+                extra["cached_content"] = cache_name
+                messages = rest
+        if isinstance(messages, str):
+            messages = [HumanMessage(content=messages)]
+        elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], str):
+            messages = [HumanMessage(content=messages[0])]
+        return messages, extra
+
+    @staticmethod
+    def _generation_kwargs(generation) -> Dict[str, Any]:
+        generation = normalize_generation(generation)
+        kwargs = {}
+        if "stop" in generation:
+            kwargs["stop"] = generation["stop"]
+        config = {}
+        if "max_tokens" in generation:
+            config["max_output_tokens"] = generation["max_tokens"]
+        if "temperature" in generation:
+            config["temperature"] = generation["temperature"]
+        if config:
+            kwargs["generation_config"] = config
+        return kwargs
+
+    def invoke_batch(self, batch: List, node_id=None, max_concurrency: int = 8,
+                     return_exceptions: bool = False, generation=None, cacheable_prefix: str = None) -> List:
+        """
+        Invoke Google Gemini for many prompts through LangChain's concurrent batch API
+
+        Args:
+            batch: List of prompts, each a string or a list of LangChain message objects
+            node_id: Graph node issuing the calls, used for usage accounting
+            max_concurrency: Maximum requests in flight
+            return_exceptions: Return failed calls as exception objects instead of raising the first one
+            generation: Generation settings applied to every call (see normalize_generation)
+            cacheable_prefix: Static leading text shared by all prompts (see invoke)
 
-    def invoke(self, messages) -> str:
+        Returns:
+            list: Replies in the order of batch
+        """
+        prepared = [self._prepare(m, cacheable_prefix) for m in batch]
+        inputs = [messages for messages, _ in prepared]
+        kwargs = dict(self._generation_kwargs(generation), **self._timeout_kwargs())
+        if prepared and all(extra for _, extra in prepared):
+            kwargs.update(prepared[0][1])
+        else:
+            inputs = [self._prepare(m, None)[0] for m in batch]
+        start_time = time.perf_counter()
+        responses = self.client.batch(inputs, config={"max_concurrency": max_concurrency},
+                                      return_exceptions=return_exceptions, **kwargs)
+        replies = []
+        for messages, response in zip(inputs, responses):
+            if isinstance(response, Exception):
+                replies.append(response)
+                continue
+            input_tokens, output_tokens = _langchain_token_counts(response)
+            # Calls of a batch overlap, so each is charged the batch's wall time
+            self._record_usage(node_id, start_time, input_tokens, output_tokens,
+                               prompt=messages, reply=response.content,
+                               cached_tokens=_langchain_cached_tokens(response),
+                               cache_eligible=bool(cacheable_prefix))
+            replies.append(response.content)
+        return replies
+
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
         """
         Invoke Google Gemini model
 
         Args:
             messages: Can be string, list of strings, or LangChain message objects
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of a string prompt the provider may cache between calls
 
         Returns:
             str: Model response content
         """
         # Convert string messages to proper format if needed
-        if isinstance(messages, str):
-            from langchain_core.messages import HumanMessage
-            messages = [HumanMessage(content=messages)]
-        elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], str):
-            from langchain_core.messages import HumanMessage
-            messages = [HumanMessage(content=messages[0])]
-
-        response = self.client.invoke(messages)
+        messages, extra = self._prepare(messages, cacheable_prefix)
+
+        start_time = time.perf_counter()
+        response = self.client.invoke(messages, **self._generation_kwargs(generation), **extra,
+                                      **self._timeout_kwargs())
+        return self._finish(node_id, start_time, messages, response, cacheable_prefix)
+
+    async def ainvoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """Async variant of invoke through LangChain's ainvoke"""
+        messages, extra = self._prepare(messages, cacheable_prefix)
+        start_time = time.perf_counter()
+        response = await self.client.ainvoke(messages, **self._generation_kwargs(generation), **extra)
+        return self._finish(node_id, start_time, messages, response, cacheable_prefix)
+
+    def _finish(self, node_id, start_time: float, messages, response, cacheable_prefix: Optional[str]) -> str:
+        input_tokens, output_tokens = _langchain_token_counts(response)
+        self._record_usage(node_id, start_time, input_tokens, output_tokens,
+                           prompt=messages, reply=response.content,
+                           cached_tokens=_langchain_cached_tokens(response),
+                           cache_eligible=bool(cacheable_prefix))
         return response.content
 
 
 class OpenAIClient(LLMClient):
     """OpenAI GPT Client"""
 
+    provider = "openai"
+
     def __init__(self, model_name: str = None, api_key: str = None):
         key = api_key or os.getenv("OPENAI_API_KEY")
         if not key:
             raise ValueError(
                 "OpenAI API key is required. Set OPENAI_API_KEY environment variable or pass api_key parameter.")
 
+        self.api_key = key
         self.client = OpenAI(api_key=key)
+        self._async_client = None  # Created on the first ainvoke
         self.model_name = model_name or "gpt-3.5-turbo"
 
-    def invoke(self, messages) -> str:
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
         """
         Invoke OpenAI model
 
         Args:
             messages: Can be string, list of strings, or OpenAI message format
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of a string prompt the provider may cache between calls
 
         Returns:
             str: Model response content
         """
+        request = self._request(messages, generation)
+        timeout = self._call_timeout()
+        client = self.client if timeout is None else self.client.with_options(timeout=timeout, max_retries=0)
+        start_time = time.perf_counter()
+        response = client.chat.completions.create(**request)
+        return self._finish(node_id, start_time, request["messages"], response, cacheable_prefix)
+
+    async def ainvoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """Async variant of invoke through the AsyncOpenAI client"""
+        if self._async_client is None:
+            from openai import AsyncOpenAI
+            self._async_client = AsyncOpenAI(api_key=self.api_key)
+        request = self._request(messages, generation)
+        start_time = time.perf_counter()
+        response = await self._async_client.chat.completions.create(**request)
+        return self._finish(node_id, start_time, request["messages"], response, cacheable_prefix)
+
+    def _request(self, messages, generation) -> Dict[str, Any]:
+        """Chat completion arguments for messages and generation settings"""
         # Convert string to proper message format
         if isinstance(messages, str):
             messages = [{"role": "user", "content": messages}]
         elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], str):
             messages = [{"role": "user", "content": messages[0]}]
 
-        response = self.client.chat.completions.create(
-            model=self.model_name,
-            messages=messages,
-            temperature=0
-        )
-        return response.choices[0].message.content
+        generation = normalize_generation(generation)
+        request = {"model": self.model_name, "messages": messages, "temperature": generation.get("temperature", 0)}
+        if "max_tokens" in generation:
+            request["max_tokens"] = generation["max_tokens"]
+        if "stop" in generation:
+            request["stop"] = generation["stop"]
+        return request
+
+    def _finish(self, node_id, start_time: float, messages, response, cacheable_prefix: Optional[str]) -> str:
+        usage = response.usage
+        content = response.choices[0].message.content
+        # OpenAI caches long prompt prefixes automatically; the static node text comes first in the prompt
+        details = getattr(usage, "prompt_tokens_details", None)
+        self._record_usage(node_id, start_time,
+                           usage.prompt_tokens if usage else None,
+                           usage.completion_tokens if usage else None,
+                           prompt=messages, reply=content,
+                           cached_tokens=getattr(details, "cached_tokens", 0),
+                           cache_eligible=bool(cacheable_prefix))
+        return content
 
 
 class ClaudeClient(LLMClient):
     """Anthropic Claude API Client"""
 
+    provider = "claude"
+
     def __init__(self, model_name: str = "claude-3-5-sonnet-20241022", api_key: str = None):
         try:
             import anthropic
@@ -187,20 +682,53 @@ class ClaudeClient(LLMClient):
             )
 
         self.client = anthropic.Anthropic(api_key=key)
+        self.async_client = anthropic.AsyncAnthropic(api_key=key)
         self.model_name = model_name
 
-    def invoke(self, messages) -> str:
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
         """
         Invoke Claude model
 
         Args:
             messages: Can be string, list of strings, or Anthropic message format
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of a string prompt the provider may cache between calls
 
         Returns:
             str: Model response content
         """
+        request = self._request(messages, generation, cacheable_prefix)
+        timeout = self._call_timeout()
+        client = self.client if timeout is None else self.client.with_options(timeout=timeout, max_retries=0)
+        try:
+            start_time = time.perf_counter()
+            response = client.messages.create(**request)
+            return self._finish(node_id, start_time, response, cacheable_prefix)
+        except Exception as e:
+            raise RuntimeError(f"Error calling Claude API: {str(e)}")
+
+    async def ainvoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """Async variant of invoke through the AsyncAnthropic client"""
+        request = self._request(messages, generation, cacheable_prefix)
+        try:
+            start_time = time.perf_counter()
+            response = await self.async_client.messages.create(**request)
+            return self._finish(node_id, start_time, response, cacheable_prefix)
+        except Exception as e:
+            raise RuntimeError(f"Error calling Claude API: {str(e)}")
+
+    def _request(self, messages, generation, cacheable_prefix: Optional[str]) -> Dict[str, Any]:
+        """messages.create arguments for messages and generation settings"""
         # Convert string to proper message format
-        if isinstance(messages, str):
+        rest = self._split_prefix(messages, cacheable_prefix)
+        if rest is not None:
+            # Mark the static node text as a cache breakpoint so later calls only pay for the inputs
+            messages = [{"role": "user", "content": [
+                {"type": "text", "text": cacheable_prefix, "cache_control": {"type": "ephemeral"}},
+                {"type": "text", "text": rest}
+            ]}]
+        elif isinstance(messages, str):
             messages = [{"role": "user", "content": messages}]
         elif isinstance(messages, list) and len(messages) > 0 and isinstance(messages[0], str):
             messages = [{"role": "user", "content": messages[0]}]
@@ -221,21 +749,30 @@ class ClaudeClient(LLMClient):
                     formatted_messages.append({"role": "user", "content": str(msg)})
             messages = formatted_messages
 
-        try:
-            response = self.client.messages.create(
-                model=self.model_name,
-                max_tokens=4096,
-                temperature=0,
-                messages=messages
-            )
-            return response.content[0].text
-        except Exception as e:
-            raise RuntimeError(f"Error calling Claude API: {str(e)}")
+        generation = normalize_generation(generation)
+        request = {"model": self.model_name, "max_tokens": generation.get("max_tokens", 4096),
+                   "temperature": generation.get("temperature", 0), "messages": messages}
+        if "stop" in generation:
+            request["stop_sequences"] = generation["stop"]
+        return request
+
+    def _finish(self, node_id, start_time: float, response, cacheable_prefix: Optional[str]) -> str:
+        content = response.content[0].text
+        usage = response.usage
+        cache_read = getattr(usage, "cache_read_input_tokens", None) or 0
+        cache_write = getattr(usage, "cache_creation_input_tokens", None) or 0
+        # Anthropic reports cached and newly cached prompt tokens separately from input_tokens
+        self._record_usage(node_id, start_time, usage.input_tokens + cache_read + cache_write,
+                           usage.output_tokens, cached_tokens=cache_read,
+                           cache_eligible=bool(cacheable_prefix))
+        return content
 
 
 class GrokClient(LLMClient):
     """xAI Grok API Client"""
 
+    provider = "grok"
+
     def __init__(self, model_name: str = "grok-3", endpoint: str = None, api_token: str = None):
         self.model_name = model_name
         self.endpoint = endpoint or os.getenv("GROK_ENDPOINT")
@@ -250,12 +787,15 @@ class GrokClient(LLMClient):
          #   api_base=self.endpoint if self.endpoint else None
         #)
 
-    def invoke(self, messages) -> str:
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
         """
         Invoke xAI Grok model
 
         Args:
             messages: Can be string, list of strings, or LangChain message objects
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of a string prompt the provider may cache between calls
 
         Returns:
             str: Model response content
@@ -267,13 +807,20 @@ class GrokClient(LLMClient):
             from langchain_core.messages import HumanMessage
             messages = [HumanMessage(content=messages[0])]
 
-        response = self.client.invoke(messages)
+        start_time = time.perf_counter()
+        response = self.client.invoke(messages, **_langchain_generation_kwargs(normalize_generation(generation)),
+                                      **self._timeout_kwargs())
+        input_tokens, output_tokens = _langchain_token_counts(response)
+        self._record_usage(node_id, start_time, input_tokens, output_tokens,
+                           prompt=messages, reply=response.content)
         return response.content
 
 
 class QwenClient(LLMClient):
     """Alibaba Qwen API Client"""
 
+    provider = "qwen"
+
     def __init__(self, model_name: str = "qwen-turbo", api_key: str = None):
         from langchain_community.chat_models.tongyi import ChatTongyi
         self.model_name = model_name
@@ -285,12 +832,15 @@ class QwenClient(LLMClient):
         os.environ["DASHSCOPE_API_KEY"] = self.api_key
         self.client = ChatTongyi(model=self.model_name)
 
-    def invoke(self, messages) -> str:
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
         """
         Invoke Alibaba Qwen model
 
         Args:
             messages: Can be string, list of strings, or LangChain message objects
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of a string prompt the provider may cache between calls
 
         Returns:
             str: Model response content
@@ -302,10 +852,419 @@ class QwenClient(LLMClient):
             from langchain_core.messages import HumanMessage
             messages = [HumanMessage(content=messages[0])]
 
-        response = self.client.invoke(messages)
+        start_time = time.perf_counter()
+        # DashScope takes its HTTP timeout as request_timeout
+        response = self.client.invoke(messages, **_langchain_generation_kwargs(normalize_generation(generation)),
+                                      **self._timeout_kwargs("request_timeout"))
+        input_tokens, output_tokens = _langchain_token_counts(response)
+        self._record_usage(node_id, start_time, input_tokens, output_tokens,
+                           prompt=messages, reply=response.content)
         return response.content
 
 
+class LocalLLMClient(LLMClient):
+    """Offline client running a Hugging Face model in-process (see localllm.LocalLLM) or in worker processes"""
+
+    provider = "local"
+    # In-process models are shared through localllm.model_registry; worker pools are shared by all
+    # clients, keyed by (model_name, device, quantization, draft_model_name)
+    _pools: Dict[tuple, Any] = {}
+    _models_lock = threading.Lock()
+
+    def __init__(self, model_name: str = "distilgpt2", device: str = "cpu", max_new_tokens: int = 128,
+                 max_batch_size: int = 8, max_wait_ms: float = 10.0, quantization: str = None,
+                 workers: int = None, draft_model_name: str = None, num_draft_tokens: int = 4):
+        """
+        Initialize the local client; the model is loaded on the first call
+
+        Args:
+            model_name: Hugging Face model id or local path
+            device: "cpu" or "cuda"
+            max_new_tokens: Default output limit when a node sets no max_tokens
+            max_batch_size: Concurrent calls generated together; 1 disables batching
+            max_wait_ms: How long a call waits for others to join its batch
+            quantization: CPU weight format: None (float32), "int8" or "bf16"
+            workers: Number of model worker processes (see localworker.WorkerPool); 0 runs the model
+                in this process. Defaults to the LLMTSUP_LOCAL_WORKERS environment variable, else 0.
+            draft_model_name: Optional draft model for speculative decoding (see LocalLLM)
+            num_draft_tokens: Tokens the draft model proposes per verification step
+        """
+        self.model_name = model_name
+        self.device = device
+        self.max_new_tokens = max_new_tokens
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.quantization = quantization
+        self.workers = int(os.environ.get("LLMTSUP_LOCAL_WORKERS", 0)) if workers is None else workers
+        self.draft_model_name = draft_model_name
+        self.num_draft_tokens = num_draft_tokens
+
+    def _model(self):
+        """Shared generation backend: a WorkerPool, a BatchScheduler, or the LocalLLM itself without batching"""
+        key = (self.model_name, self.device, self.quantization, self.draft_model_name)
+        llm_kwargs = {"quantization": self.quantization, "draft_model_name": self.draft_model_name,
+                      "num_draft_tokens": self.num_draft_tokens}
+        if self.workers > 0:
+            with self._models_lock:
+                if key not in self._pools:
+                    from localworker import WorkerPool
+                    self._pools[key] = WorkerPool(self.model_name, device=self.device, num_workers=self.workers,
+                                                  max_batch_size=self.max_batch_size, max_wait_ms=self.max_wait_ms,
+                                                  **llm_kwargs)
+                return self._pools[key]
+
+        # Looked up on every call so a model evicted by the registry is reloaded when needed again
+        from localllm import model_registry
+        if self.max_batch_size <= 1:
+            return model_registry.get(self.model_name, self.device, **llm_kwargs)
+        return model_registry.scheduler(self.model_name, self.device, self.max_batch_size, self.max_wait_ms,
+                                        **llm_kwargs)
+
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """
+        Invoke the local model
+
+        Args:
+            messages: Can be string, list of strings, or message objects
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of the prompt whose key/value state is reused between calls
+
+        Returns:
+            str: Model response content
+        """
+        from localllm import SchedulerClosedError
+        messages = self._prompt_text(messages)
+        generation = normalize_generation(generation)
+        kwargs = {"max_new_tokens": generation.get("max_tokens", self.max_new_tokens),
+                  "temperature": generation.get("temperature", 0.0),
+                  "stop": generation.get("stop"), "prefix": cacheable_prefix}
+        timeout = self._call_timeout()
+        start_time = time.perf_counter()
+        try:
+            result = self._complete(messages, kwargs, timeout)
+        except SchedulerClosedError:
+            # The model was evicted between lookup and submit; the registry loads it again
+            result = self._complete(messages, kwargs, timeout)
+        self._record_usage(node_id, start_time, result["input_tokens"], result["output_tokens"],
+                           cached_tokens=result["cached_tokens"], cache_eligible=bool(cacheable_prefix))
+        return result["text"]
+
+    def _complete(self, messages, kwargs, timeout: Optional[float]):
+        """
+        Run a completion on the shared backend, waiting at most timeout seconds for a queued one
+
+        A request that is still queued when the deadline passes is withdrawn; an in-process
+        model without batching cannot be interrupted.
+        """
+        model = self._model()
+        if timeout is None or not hasattr(model, "submit"):
+            return model.complete(messages, **kwargs)
+        future = model.submit(messages, **kwargs)
+        try:
+            return future.result(timeout=timeout)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    def stream(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> Iterator[str]:
+        """
+        Stream the local model's reply token by token (see LocalLLM.stream_text)
+
+        Streaming bypasses request batching; cacheable_prefix is not used.
+        """
+        messages = self._prompt_text(messages)
+        generation = normalize_generation(generation)
+        model = self._model()
+        llm = getattr(model, "llm", model)  # The LocalLLM behind a BatchScheduler; pools stream themselves
+        start_time = time.perf_counter()
+        first_token_time = None
+        stats = {}
+        for increment in llm.stream_text(messages,
+                                         max_new_tokens=generation.get("max_tokens", self.max_new_tokens),
+                                         temperature=generation.get("temperature", 0.0),
+                                         stop=generation.get("stop"),
+                                         stats=stats):
+            if first_token_time is None:
+                first_token_time = time.perf_counter()
+            yield increment
+        self._record_usage(node_id, start_time, stats.get("input_tokens"), stats.get("output_tokens"),
+                           first_token_time=first_token_time)
+
+    @staticmethod
+    def _prompt_text(messages) -> str:
+        if isinstance(messages, str):
+            return messages
+        return "\n".join(str(getattr(m, "content", None) or (m.get("content") if isinstance(m, dict) else m))
+                         for m in messages)
+
+
+# --- Fake Providers for Offline Benchmarks ---
+class LatencyModel:
+    """Seeded latency distribution used by the fake providers"""
+
+    def __init__(self, distribution: str = "constant", mean: float = 0.0, std: float = 0.0,
+                 low: float = 0.0, high: float = 0.0, per_token: float = 0.0, seed: int = 0):
+        """
+        Initialize the latency model
+
+        Args:
+            distribution: "constant", "uniform", "normal" or "lognormal"
+            mean: Mean latency in seconds (median for "lognormal")
+            std: Standard deviation in seconds ("normal") or log-space sigma ("lognormal")
+            low: Lower bound for "uniform"
+            high: Upper bound for "uniform"
+            per_token: Additional seconds per generated token or embedded text
+            seed: Random seed
+        """
+        if distribution not in ("constant", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unsupported latency distribution: {distribution}")
+        self.distribution = distribution
+        self.mean = mean
+        self.std = std
+        self.low = low
+        self.high = high
+        self.per_token = per_token
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def sample(self) -> float:
+        """Sample the fixed part of a call latency in seconds"""
+        with self._lock:
+            if self.distribution == "uniform":
+                value = self._rng.uniform(self.low, self.high)
+            elif self.distribution == "normal":
+                value = self._rng.gauss(self.mean, self.std)
+            elif self.distribution == "lognormal":
+                value = self.mean * math.exp(self._rng.gauss(0.0, self.std)) if self.mean > 0 else 0.0
+            else:
+                value = self.mean
+        return max(0.0, value)
+
+
+def _latency_model(latency, seed: int) -> LatencyModel:
+    if isinstance(latency, LatencyModel):
+        return latency
+    if isinstance(latency, (int, float)):
+        return LatencyModel(mean=float(latency), seed=seed)
+    return LatencyModel(seed=seed, **(latency or {}))
+
+
+class FakeLLMError(RuntimeError):
+    """Injected provider failure raised by the fake providers"""
+
+
+class FakeThrottleError(FakeLLMError):
+    """Injected rate-limit failure raised by the fake providers"""
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _FaultInjector:
+    """Shared error, throttling and rate-limit injection for the fake providers"""
+
+    def __init__(self, error_rate: float = 0.0, throttle_rate: float = 0.0, rate_limit: float = None, seed: int = 0):
+        self.error_rate = error_rate
+        self.throttle_rate = throttle_rate
+        self.rate_limit = rate_limit
+        self._rng = random.Random(seed)
+        self._scheduled: List[str] = []
+        self._calls: List[float] = []
+        self._lock = threading.Lock()
+
+    def inject(self, kind: str = "error", count: int = 1):
+        """Make the next count calls fail with an "error" or "throttle" fault"""
+        if kind not in ("error", "throttle"):
+            raise ValueError(f"Unsupported fault kind: {kind}")
+        with self._lock:
+            self._scheduled.extend([kind] * count)
+
+    def check(self, name: str):
+        with self._lock:
+            now = time.monotonic()
+            if self.rate_limit:
+                self._calls = [t for t in self._calls if now - t < 1.0]
+                if len(self._calls) >= self.rate_limit:
+                    raise FakeThrottleError(f"{name}: rate limit of {self.rate_limit} calls/s exceeded")
+                self._calls.append(now)
+            kind = self._scheduled.pop(0) if self._scheduled else None
+            roll = self._rng.random()
+        if kind == "throttle" or (kind is None and roll < self.throttle_rate):
+            raise FakeThrottleError(f"{name}: injected throttling")
+        if kind == "error" or (kind is None and roll < self.throttle_rate + self.error_rate):
+            raise FakeLLMError(f"{name}: injected error")
+
+
+class FakeLLMClient(LLMClient):
+    """Deterministic offline LLM client with simulated latency and injectable faults"""
+
+    provider = "fake"
+    VOCABULARY = ["engine", "bolt", "gearbox", "check", "the", "oil", "filter", "lift", "reset", "torque",
+                  "mount", "fan", "belt", "remove", "install", "and", "then", "carefully", "valve", "cover"]
+
+    def __init__(self, model_name: str = "fake", seed: int = 0, latency=None, responses: Dict[str, str] = None,
+                 max_output_tokens: int = 32, error_rate: float = 0.0, throttle_rate: float = 0.0,
+                 rate_limit: float = None):
+        """
+        Initialize the fake client
+
+        Args:
+            model_name: Reported model name
+            seed: Seed for outputs, latencies and faults
+            latency: LatencyModel, seconds as a number, or LatencyModel keyword arguments as a dict
+            responses: Canned replies keyed by a substring of the prompt, checked before generating
+            max_output_tokens: Upper bound on generated words
+            error_rate: Probability of raising FakeLLMError per call
+            throttle_rate: Probability of raising FakeThrottleError per call
+            rate_limit: Maximum calls per second before FakeThrottleError is raised
+        """
+        self.model_name = model_name
+        self.seed = seed
+        self.latency = _latency_model(latency, seed)
+        self.responses = responses or {}
+        self.max_output_tokens = max_output_tokens
+        self.faults = _FaultInjector(error_rate, throttle_rate, rate_limit, seed)
+        self._cached_prefixes = set()
+        self._cache_lock = threading.Lock()
+
+    def inject_fault(self, kind: str = "error", count: int = 1):
+        """Make the next count calls fail with an "error" or "throttle" fault"""
+        self.faults.inject(kind, count)
+
+    def _cache_lookup(self, messages, cacheable_prefix: Optional[str]) -> int:
+        """Simulate a provider prompt cache: a prefix is a hit from its second use on"""
+        if self._split_prefix(messages, cacheable_prefix) is None:
+            return 0
+        with self._cache_lock:
+            if cacheable_prefix in self._cached_prefixes:
+                return estimate_tokens(cacheable_prefix)
+            self._cached_prefixes.add(cacheable_prefix)
+        return 0
+
+    @staticmethod
+    def _prompt_text(messages) -> str:
+        if isinstance(messages, str):
+            return messages
+        return "".join(str(getattr(m, "content", None) or (m.get("content") if isinstance(m, dict) else m))
+                       for m in messages)
+
+    def _reply(self, prompt: str) -> str:
+        for trigger, reply in self.responses.items():
+            if trigger in prompt:
+                return reply
+        digest = hashlib.sha256(f"{self.seed}:{prompt}".encode("utf-8")).digest()
+        length = 1 + digest[0] % self.max_output_tokens
+        return " ".join(self.VOCABULARY[digest[(i % 31) + 1] % len(self.VOCABULARY)] for i in range(length))
+
+    def invoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """
+        Invoke the fake model
+
+        Args:
+            messages: Can be string, list of strings, or message objects
+            node_id: Graph node issuing the call, used for usage accounting
+            generation: Generation settings for this call (see normalize_generation)
+            cacheable_prefix: Static leading part of a string prompt the provider may cache between calls
+
+        Returns:
+            str: Deterministic reply for the prompt
+        """
+        start_time = time.perf_counter()
+        prompt, reply = self._generate(messages, generation)
+        # The simulated call is aborted like a provider request when the workflow is cancelled
+        sleep = current_token().sleep if current_token() is not None else time.sleep
+        sleep(self.latency.sample())
+        first_token_time = time.perf_counter()
+        sleep(self.latency.per_token * len(reply.split()))
+        return self._finish(node_id, start_time, first_token_time, messages, prompt, reply, cacheable_prefix)
+
+    async def ainvoke(self, messages, node_id=None, generation=None, cacheable_prefix: str = None) -> str:
+        """Async variant of invoke; the simulated latency is awaited instead of slept"""
+        start_time = time.perf_counter()
+        prompt, reply = self._generate(messages, generation)
+        await asyncio.sleep(self.latency.sample())
+        first_token_time = time.perf_counter()
+        await asyncio.sleep(self.latency.per_token * len(reply.split()))
+        return self._finish(node_id, start_time, first_token_time, messages, prompt, reply, cacheable_prefix)
+
+    def _generate(self, messages, generation):
+        """Return the prompt text and the reply after faults, stop sequences and max_tokens"""
+        generation = normalize_generation(generation)
+        prompt = self._prompt_text(messages)
+        self.faults.check(self.model_name)
+        reply = self._reply(prompt)
+        for stop in generation.get("stop", []):
+            reply = reply.split(stop)[0]
+        if "max_tokens" in generation:
+            reply = " ".join(reply.split()[:generation["max_tokens"]])
+        return prompt, reply
+
+    def _finish(self, node_id, start_time: float, first_token_time: float, messages, prompt: str, reply: str,
+                cacheable_prefix: Optional[str]) -> str:
+        self._record_usage(node_id, start_time, estimate_tokens(prompt), len(reply.split()),
+                           first_token_time=first_token_time,
+                           cached_tokens=self._cache_lookup(messages, cacheable_prefix),
+                           cache_eligible=bool(cacheable_prefix))
+        return reply
+
+
+class FakeEmbeddings(Embeddings):
+    """Deterministic hashed bag-of-words embeddings with simulated latency and injectable faults"""
+
+    def __init__(self, dimensions: int = 256, seed: int = 0, latency=None, error_rate: float = 0.0,
+                 throttle_rate: float = 0.0, rate_limit: float = None):
+        """
+        Initialize the fake embeddings
+
+        Args:
+            dimensions: Vector size
+            seed: Seed for the hashing, latencies and faults
+            latency: LatencyModel, seconds as a number, or LatencyModel keyword arguments as a dict;
+                per_token is charged per embedded text
+            error_rate: Probability of raising FakeLLMError per call
+            throttle_rate: Probability of raising FakeThrottleError per call
+            rate_limit: Maximum calls per second before FakeThrottleError is raised
+        """
+        self.dimensions = dimensions
+        self.seed = seed
+        self.latency = _latency_model(latency, seed)
+        self.faults = _FaultInjector(error_rate, throttle_rate, rate_limit, seed)
+
+    def inject_fault(self, kind: str = "error", count: int = 1):
+        """Make the next count calls fail with an "error" or "throttle" fault"""
+        self.faults.inject(kind, count)
+
+    def _embed(self, text: str) -> List[float]:
+        vector = [0.0] * self.dimensions
+        for word in text.lower().split():
+            digest = hashlib.md5(f"{self.seed}:{word}".encode("utf-8")).digest()
+            index = int.from_bytes(digest[:4], "little") % self.dimensions
+            vector[index] += 1.0 if digest[4] & 1 else -1.0
+        norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+        return [v / norm for v in vector]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        self.faults.check("fake-embeddings")
+        time.sleep(self.latency.sample() + self.latency.per_token * len(texts))
+        return [self._embed(t) for t in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        return self.embed_documents([text])[0]
+
+
+def get_embeddings(provider: str = "google", **kwargs):
+    """Create the embedding backend used for retrieval indexes"""
+    if provider == "google":
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+        return GoogleGenerativeAIEmbeddings(model=kwargs.get("model_name", "models/embedding-001"))
+    elif provider == "fake":
+        return FakeEmbeddings(**kwargs)
+    else:
+        raise ValueError(f"Unsupported embedding provider: {provider}")
+
+
 def get_llm_client(provider: str = "google", **kwargs) -> LLMClient:
     if provider == "google":
         model_name = kwargs.get("model_name", "gemini-2.0-flash")
@@ -327,6 +1286,10 @@ def get_llm_client(provider: str = "google", **kwargs) -> LLMClient:
         model_name = kwargs.get("model_name", "qwen-turbo")
         api_key = kwargs.get("api_key")
         return QwenClient(model_name=model_name, api_key=api_key)
+    elif provider == "local":
+        return LocalLLMClient(**kwargs)
+    elif provider == "fake":
+        return FakeLLMClient(**kwargs)
     else:
         raise ValueError(f"Unsupported provider: {provider}")
 
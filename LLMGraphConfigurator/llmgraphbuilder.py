@@ -5,28 +5,72 @@ import json
 import hashlib
 from typing import Dict, Any, List
 import time  # Added for timing
+import asyncio
+import sqlite3
+import threading
 from langchain_community.vectorstores import FAISS
 from langchain.text_splitter import RecursiveCharacterTextSplitter
 from langchain_core.documents import Document
-from langchain_google_genai import GoogleGenerativeAIEmbeddings
 
 # Import our custom modules
-from llmclient import get_llm_client, LLMClient, initialize_api_keys, APIConfig
+from llmclient import (get_llm_client, get_embeddings, normalize_generation, LLMClient, initialize_api_keys,
+                       APIConfig, usage_tracker)
+from memorystore import (get_memory_store, normalize_memory_settings, format_history_entry, budgeted_history,
+                         recalled_history, index_entries_async, set_retention, MemoryTransaction,
+                         SessionMemoryStore)
+from cancellation import CancelToken, WorkflowCancelled, cancel_scope
 
 # --- Initialize Configuration ---
 config = initialize_api_keys()
 
-# --- LLM and Embeddings Initialization ---
-llm_client = get_llm_client("google", model_name="gemini-2.0-flash-lite")
-embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+# --- LLM and Embeddings Selection ---
+# Set both to "fake" to run the workflow offline without API keys
+LLM_PROVIDER = os.environ.get("LLMTSUP_PROVIDER", "google")
+EMBEDDING_PROVIDER = os.environ.get("LLMTSUP_EMBEDDINGS", "google")
 script_dir = os.path.dirname(os.path.abspath(__file__))
 
+_embeddings = None
+
+
+def get_default_embeddings():
+    """Create the shared embedding backend on first use"""
+    global _embeddings
+    if _embeddings is None:
+        _embeddings = get_embeddings(EMBEDDING_PROVIDER)
+    return _embeddings
+
+
+_shared_clients: Dict[tuple, LLMClient] = {}
+_shared_clients_lock = threading.Lock()
+
+
+def shared_llm_client(provider: str, **kwargs) -> LLMClient:
+    """
+    LLM client shared by all requests with the same configuration
+
+    Clients keep provider prompt caches, connection pools and loaded models, which only
+    pay off when later requests use the same client instance.
+    """
+    key = (provider, tuple(sorted(kwargs.items())))
+    with _shared_clients_lock:
+        if key not in _shared_clients:
+            _shared_clients[key] = get_llm_client(provider, **kwargs)
+        return _shared_clients[key]
+
 # --- Graph Data Structures ---
 class Node:
-    def __init__(self, node_id: int, node_type: str, content=None):
+    def __init__(self, node_id: int, node_type: str, content=None, generation=None, llm=None, memory=None):
         self.id = node_id
         self.type = node_type
         self.content = content or []
+        # Query nodes only: max_tokens, stop and temperature passed to the LLM client
+        self.generation = generation or {}
+        # Query nodes only: get_llm_client arguments overriding the workflow's client, e.g. {"provider": "local"}
+        self.llm = llm or {}
+        # Memory nodes only: max_tokens budget of the output, whether older entries are summarized, and
+        # recall_k to output the entries most similar to the question instead of the newest ones, and
+        # max_size_kb / max_age_hours after which old entries are archived
+        self.memory = memory or {}
 
 class Connection:
     def __init__(self, from_node: Node, to_node: Node, output_type="output"):
@@ -75,8 +119,18 @@ class Graph:
         self.nodes.remove(node)
 
     def to_dict(self) -> Dict[str, Any]:
+        nodes = []
+        for n in self.nodes:
+            node_dict = {"id": n.id, "type": n.type, "content": n.content}
+            if n.generation:
+                node_dict["generation"] = n.generation
+            if n.llm:
+                node_dict["llm"] = n.llm
+            if n.memory:
+                node_dict["memory"] = n.memory
+            nodes.append(node_dict)
         return {
-            "nodes": [{"id": n.id, "type": n.type, "content": n.content} for n in self.nodes],
+            "nodes": nodes,
             "connections": [{"from": c.from_node.id, "to": c.to_node.id, "output_type": c.output_type} for c in
                             self.connections]
         }
@@ -88,6 +142,9 @@ class Graph:
         for node_data in graph_dict["nodes"]:
             node = Node(node_data["id"], node_data["type"])
             node.content = node_data.get("content", [])
+            node.generation = normalize_generation(node_data.get("generation"))
+            node.llm = dict(node_data.get("llm") or {})
+            node.memory = normalize_memory_settings(node_data.get("memory"))
             self.nodes.append(node)
             node_id_map[node_data["id"]] = node
             if node.id >= self.next_node_id:
@@ -117,13 +174,25 @@ class Graph:
         return order
 
 # --- DAG-Based RAG Workflow ---
+# Loaded FAISS indexes by index directory, shared by all workflows (one per request on the server)
+_vector_stores: Dict[str, Any] = {}
+_vector_store_lock = threading.Lock()
+
+
 class LLMWorkflow:
-    def __init__(self, graph: Graph, llm_client: LLMClient, config: APIConfig = None):
+    def __init__(self, graph: Graph, llm_client: LLMClient, config: APIConfig = None, embeddings=None,
+                 embedding_provider: str = None, memory_store=None):
         self.graph = graph
         self.llm_client = llm_client
         self.config = config or initialize_api_keys()
+        self._embeddings = embeddings
+        self.embedding_provider = embedding_provider or EMBEDDING_PROVIDER
         self.node_funcs: Dict[int, Any] = {}
+        self.async_node_funcs: Dict[int, Any] = {}  # Query nodes, used by ask_question_async
         self.exec_order: List[int] = []
+        self._query_embeddings: Dict[str, List[float]] = {}
+        # Memory registries, text files or SQLite depending on LLMTSUP_MEMORY_BACKEND
+        self.memory_store = memory_store or get_memory_store(script_dir)
 
     def get_graph(self, path: str):
         try:
@@ -135,12 +204,19 @@ class LLMWorkflow:
         except FileNotFoundError:
             print(f"No saved graph at {path}")
 
+    @property
+    def embeddings(self):
+        if self._embeddings is None:
+            if self.embedding_provider == EMBEDDING_PROVIDER:
+                self._embeddings = get_default_embeddings()
+            else:
+                self._embeddings = get_embeddings(self.embedding_provider)
+        return self._embeddings
+
     def clear_memory(self):
         memory_nodes = [node for node in self.graph.nodes if node.type == 'memory']
         for memory_node in memory_nodes:
-            file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-            with open(file_path, 'w', encoding='utf-8') as f:
-                pass  # Clear the file
+            self.memory_store.clear(memory_node.content[0])
 
     def _get_faiss_index_path(self, node: Node) -> str:
         if not node.content:
@@ -149,14 +225,25 @@ class LLMWorkflow:
         clean_name = os.path.splitext(document_source)[0]
         clean_name = re.sub(r'[^\w\-_]', '_', clean_name)
         index_name = f"faiss_{clean_name}"
+        if self.embedding_provider != "google":
+            # Vectors from different embedding backends are not interchangeable
+            index_name += f"_{self.embedding_provider}"
         return os.path.join(script_dir, index_name)
 
+    def _get_vector_store(self, node: Node):
+        """Load the node's vector store once and reuse it for later questions and workflows"""
+        index_dir = self._get_faiss_index_path(node)
+        with _vector_store_lock:
+            if index_dir not in _vector_stores:
+                _vector_stores[index_dir] = self._load_or_create_vector_store(node)
+            return _vector_stores[index_dir]
+
     def _load_or_create_vector_store(self, node: Node):
         index_dir = self._get_faiss_index_path(node)
         document_source = node.content[0]
         if os.path.exists(index_dir):
             print(f"[Node {node.id}] Loading existing FAISS index from {index_dir} for document: {document_source}")
-            return FAISS.load_local(index_dir, embeddings, allow_dangerous_deserialization=True)
+            return FAISS.load_local(index_dir, self.embeddings, allow_dangerous_deserialization=True)
         print(f"[Node {node.id}] Creating new FAISS index for document: {document_source}")
         file_path = os.path.join(script_dir, document_source)
         try:
@@ -179,22 +266,75 @@ class LLMWorkflow:
         )
         chunks = splitter.split_documents([doc])
         print(f"[Node {node.id}] Created {len(chunks)} chunks from document: {document_source}")
-        vector_store = FAISS.from_documents(chunks, embeddings)
+        vector_store = FAISS.from_documents(chunks, self.embeddings)
         vector_store.save_local(index_dir)
         print(f"[Node {node.id}] Saved FAISS index to {index_dir}")
         return vector_store
 
-    def _write_to_memory(self, file_path: str, data: Any):
-        try:
-            with open(file_path, 'r', encoding='utf-8') as f:
-                existing = f.read()
-        except FileNotFoundError:
-            existing = ""
-        numbers = re.findall(r"--- START LOG #(\d+) ---", existing)
-        next_num = max([int(n) for n in numbers] + [0]) + 1
-        entry = f"--- START LOG #{next_num} ---\n{str(data)}\n--- END LOG #{next_num} ---\n\n"
-        with open(file_path, 'a', encoding='utf-8') as f:
-            f.write(entry)
+    def _write_memory_targets(self, node: Node, state: Dict[str, Any]):
+        """Append the node's output to every memory registry it is connected to"""
+        memory_targets = [c.to_node.id for c in self.graph.connections if
+                          c.from_node == node and c.to_node.type == 'memory']
+        for memory_node_id in memory_targets:
+            registry = self.graph.get_node_by_id(memory_node_id).content[0]
+            if 'memory' in state:
+                # Committed together with the request's other writes
+                state['memory'].append(registry, state['data'][str(node.id)])
+                continue
+            try:
+                self.memory_store.log(registry).append(state['data'][str(node.id)])
+            except (PermissionError, OSError, sqlite3.Error) as e:
+                print(f"Error writing to memory registry {registry}: {e}")
+
+    def _is_activated(self, node: Node, state: Dict[str, Any]) -> bool:
+        """A node runs if all its regular inputs are active and all its conditions routed to it"""
+        flag = True
+        for i in self.graph.get_incoming_edge_nodes(node):
+            if i.type != "condition":
+                if str(i.id) in state['activation'].keys() and not state['activation'][str(i.id)]:
+                    flag = False
+                elif str(i.id) not in state['activation'].keys():
+                    flag = False
+            else:
+                if str(i.id) in state['data'].keys() and str(node.id) not in state["data"][str(i.id)]:
+                    flag = False
+                elif str(i.id) not in state['data'].keys():
+                    flag = False
+        return flag
+
+    def _client_for(self, node: Node) -> LLMClient:
+        """LLM client for a query node: its own provider if configured, else the workflow's client"""
+        if not node.llm or not node.llm.get("provider"):
+            return self.llm_client
+        kwargs = dict(node.llm)
+        return shared_llm_client(kwargs.pop("provider"), **kwargs)
+
+    def _query_prompt(self, node: Node, state: Dict[str, Any]) -> str:
+        incoming = self.graph.get_incoming_edge_nodes(node)
+        inputs = [str(state['data'][str(i.id)]) for i in incoming if i.type != "condition"]
+        print(f"[Node {node.id} - QUERY] prompt_parts={node.content + inputs}")
+        return "".join(node.content) + "".join(inputs)
+
+    def _summarize_memory(self, node: Node, summary: str, entries) -> str:
+        """Fold entries into the rolling summary of a memory node; runs on the memory summary thread"""
+        prompt = ("Update the summary of a conversation history with the new entries below. Keep names, "
+                  "facts, decisions and open questions, drop small talk, and answer with the summary only.\n\n"
+                  f"Summary so far: {summary or '(empty)'}\n\n"
+                  "New entries:\n" + "".join(format_history_entry(number, data) for number, data in entries))
+        # The summary may take up to a quarter of the node's budget
+        generation = {"max_tokens": max(16, node.memory["max_tokens"] // 4), "temperature": 0.0}
+        return self.llm_client.invoke(prompt, node_id=node.id, generation=generation)
+
+    def _store_query_output(self, node: Node, state: Dict[str, Any], out: str):
+        print(f"[Node {node.id}] LLM output='{out}'")
+        state['data'][str(node.id)] = out
+        self._write_memory_targets(node, state)
+
+    def _retrieval_query(self, node: Node, state: Dict[str, Any]) -> str:
+        incoming = self.graph.get_incoming_edge_nodes(node)
+        texts = [state['data'][str(i.id)] for i in incoming if i.type != "condition"]
+        print(f"[Node {node.id} - RETRIEVAL] inputs={texts}")
+        return "".join(texts)
 
     def build(self):
         start_node = self.graph.get_inp_node()
@@ -217,45 +357,26 @@ class LLMWorkflow:
                 print(f"[Node {node.id} - INPUT] question='{state['question']}'")
                 state["activation"][str(node.id)] = True
                 state['data'][str(node.id)] = state['question']
-                memory_targets = [c.to_node.id for c in self.graph.connections if
-                                  c.from_node == node and c.to_node.type == 'memory']
-                for memory_node_id in memory_targets:
-                    memory_node = self.graph.get_node_by_id(memory_node_id)
-                    file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-                    try:
-                        self._write_to_memory(file_path, state['data'][str(node.id)])
-                    except (PermissionError, OSError) as e:
-                        print(f"Error writing to {file_path}: {e}")
+                self._write_memory_targets(node, state)
                 return state
             return fn
 
         def retrieval_factory(node: Node):
             def fn(state: Dict[str, Any]) -> Dict[str, Any]:
-                incoming = self.graph.get_incoming_edge_nodes(node)
-                flag = True
-                for i in incoming:
-                    if i.type != "condition":
-                        if str(i.id) in state['activation'].keys() and not state['activation'][str(i.id)]:
-                            flag = False
-                        elif str(i.id) not in state['activation'].keys():
-                            flag = False
-                    else:
-                        if str(i.id) in state['data'].keys() and str(node.id) not in state["data"][str(i.id)]:
-                            flag = False
-                        elif str(i.id) not in state['data'].keys():
-                            flag = False
-                if flag:
+                if self._is_activated(node, state):
                     print(f"[Node {node.id} - RETRIEVAL] Processing with sources: {node.content}")
                     try:
-                        vector_store = self._load_or_create_vector_store(node)
+                        vector_store = self._get_vector_store(node)
                     except Exception as e:
                         print(f"[Node {node.id}] Error creating vector store: {e}")
                         state["activation"][str(node.id)] = False
                         return state
-                    texts = [state['data'][str(i.id)] for i in incoming if i.type != "condition"]
-                    print(f"[Node {node.id} - RETRIEVAL] inputs={texts}")
-                    query_text = "".join(texts)
-                    docs = vector_store.similarity_search(query_text, k=4)
+                    query_text = self._retrieval_query(node, state)
+                    query_vector = self._query_embeddings.get(query_text)
+                    if query_vector is not None:
+                        docs = vector_store.similarity_search_by_vector(query_vector, k=4)
+                    else:
+                        docs = vector_store.similarity_search(query_text, k=4)
                     retrieved_content = "\n\n".join(doc.page_content for doc in docs)
                     print(f"[Node {node.id}] Retrieved {len(docs)} documents:")
                     for i, doc in enumerate(docs):
@@ -264,15 +385,7 @@ class LLMWorkflow:
                         print(f"  Doc {i + 1} from {source}: {preview}")
                     state["data"][str(node.id)] = retrieved_content
                     state["activation"][str(node.id)] = True
-                    memory_targets = [c.to_node.id for c in self.graph.connections if
-                                      c.from_node == node and c.to_node.type == 'memory']
-                    for memory_node_id in memory_targets:
-                        memory_node = self.graph.get_node_by_id(memory_node_id)
-                        file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-                        try:
-                            self._write_to_memory(file_path, state['data'][str(node.id)])
-                        except (PermissionError, OSError) as e:
-                            print(f"Error writing to {file_path}: {e}")
+                    self._write_memory_targets(node, state)
                 else:
                     state["activation"][str(node.id)] = False
                 return state
@@ -281,19 +394,7 @@ class LLMWorkflow:
         def condition_factory(node: Node):
             def fn(state: Dict[str, Any]) -> Dict[str, Any]:
                 incoming = self.graph.get_incoming_edge_nodes(node)
-                flag = True
-                for i in incoming:
-                    if i.type != "condition":
-                        if str(i.id) in state['activation'].keys() and not state['activation'][str(i.id)]:
-                            flag = False
-                        elif str(i.id) not in state['activation'].keys():
-                            flag = False
-                    else:
-                        if str(i.id) in state['data'].keys() and str(node.id) not in state["data"][str(i.id)]:
-                            flag = False
-                        elif str(i.id) not in state['data'].keys():
-                            flag = False
-                if flag:
+                if self._is_activated(node, state):
                     state["activation"][str(node.id)] = True
                     texts = [str(state['data'][str(i.id)]) for i in incoming if i.type != "condition"]
                     if len(node.content) == 0:
@@ -308,15 +409,7 @@ class LLMWorkflow:
                         state['data'][str(node.id)] = [str(c.to_node.id) for c in self.graph.connections if
                                                        c.from_node == node and c.output_type == "false"]
                         print("False")
-                    memory_targets = [c.to_node.id for c in self.graph.connections if
-                                      c.from_node == node and c.to_node.type == 'memory']
-                    for memory_node_id in memory_targets:
-                        memory_node = self.graph.get_node_by_id(memory_node_id)
-                        file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-                        try:
-                            self._write_to_memory(file_path, state['data'][str(node.id)])
-                        except (PermissionError, OSError) as e:
-                            print(f"Error writing to {file_path}: {e}")
+                    self._write_memory_targets(node, state)
                 else:
                     state["activation"][str(node.id)] = False
                 return state
@@ -324,36 +417,27 @@ class LLMWorkflow:
 
         def query_factory(node: Node):
             def fn(state: Dict[str, Any]) -> Dict[str, Any]:
-                incoming = self.graph.get_incoming_edge_nodes(node)
-                flag = True
-                for i in incoming:
-                    if i.type != "condition":
-                        if str(i.id) in state['activation'].keys() and not state['activation'][str(i.id)]:
-                            flag = False
-                        elif str(i.id) not in state['activation'].keys():
-                            flag = False
-                    else:
-                        if str(i.id) in state['data'].keys() and str(node.id) not in state["data"][str(i.id)]:
-                            flag = False
-                        elif str(i.id) not in state['data'].keys():
-                            flag = False
-                if flag:
+                if self._is_activated(node, state):
                     state["activation"][str(node.id)] = True
-                    inputs = [str(state['data'][str(i.id)]) for i in incoming if i.type != "condition"]
-                    print(f"[Node {node.id} - QUERY] prompt_parts={node.content + inputs}")
-                    prompt = "".join(node.content) + "".join(inputs)
-                    out = self.llm_client.invoke(prompt)
-                    print(f"[Node {node.id}] LLM output='{out}'")
-                    state['data'][str(node.id)] = out
-                    memory_targets = [c.to_node.id for c in self.graph.connections if
-                                      c.from_node == node and c.to_node.type == 'memory']
-                    for memory_node_id in memory_targets:
-                        memory_node = self.graph.get_node_by_id(memory_node_id)
-                        file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-                        try:
-                            self._write_to_memory(file_path, state['data'][str(node.id)])
-                        except (PermissionError, OSError) as e:
-                            print(f"Error writing to {file_path}: {e}")
+                    prompt = self._query_prompt(node, state)
+                    client = self._client_for(node)
+                    out = client.invoke(prompt, node_id=node.id, generation=node.generation,
+                                        cacheable_prefix="".join(node.content))
+                    self._store_query_output(node, state, out)
+                else:
+                    state["activation"][str(node.id)] = False
+                return state
+            return fn
+
+        def async_query_factory(node: Node):
+            async def fn(state: Dict[str, Any]) -> Dict[str, Any]:
+                if self._is_activated(node, state):
+                    state["activation"][str(node.id)] = True
+                    prompt = self._query_prompt(node, state)
+                    client = self._client_for(node)
+                    out = await client.ainvoke(prompt, node_id=node.id, generation=node.generation,
+                                               cacheable_prefix="".join(node.content))
+                    self._store_query_output(node, state, out)
                 else:
                     state["activation"][str(node.id)] = False
                 return state
@@ -361,27 +445,40 @@ class LLMWorkflow:
 
         def memory_factory(node: Node):
             def fn(state: Dict[str, Any]) -> Dict[str, Any]:
-                file_path = os.path.join(script_dir, f"memory_{node.content[0]}.txt")
-                content = ""
-                try:
-                    with open(file_path, 'r', encoding='utf-8') as f:
-                        text = f.read()
-                    logs = re.findall(r"--- START LOG #(\d+) ---\n(.*?)\n--- END LOG #\d+ ---\n\n", text, re.DOTALL)
-                    for num, data in logs:
-                        content += f"History entry {num}: {data.strip()}\n\n"
-                except FileNotFoundError:
-                    content = ""
-                state['data'][str(node.id)] = content
+                registry = node.content[0]
+                if node.memory.get("recall_k"):
+                    question = str(state['question'])
+                    query_vector = self._query_embeddings.get(question)
+                    if query_vector is None:
+                        query_vector = self.embeddings.embed_query(question)
+                    if 'memory' in state:
+                        out = state['memory'].recalled_history(
+                            registry, self.embedding_provider, self.embeddings, query_vector,
+                            node.memory["recall_k"], node.memory.get("max_tokens"))
+                    else:
+                        out = recalled_history(
+                            self.memory_store.log(registry), self.embedding_provider, self.embeddings, query_vector,
+                            node.memory["recall_k"], node.memory.get("max_tokens"))
+                    state['data'][str(node.id)] = out
+                elif node.memory.get("max_tokens"):
+                    # Newest entries within the budget; older ones only through the rolling summary
+                    max_tokens = node.memory["max_tokens"]
+                    summarize = None
+                    if node.memory.get("summarize", True):
+                        summarize = lambda summary, entries: self._summarize_memory(node, summary, entries)
+                    if 'memory' in state:
+                        out = state['memory'].budgeted_history(registry, max_tokens, summarize)
+                    else:
+                        log = self.memory_store.log(registry)
+                        out = budgeted_history(log, log.entries(), max_tokens, summarize)
+                    state['data'][str(node.id)] = out
+                # Only entries appended since the last activation are parsed
+                elif 'memory' in state:
+                    state['data'][str(node.id)] = state['memory'].history(registry)
+                else:
+                    state['data'][str(node.id)] = self.memory_store.log(registry).history()
                 state['activation'][str(node.id)] = True
-                memory_targets = [c.to_node.id for c in self.graph.connections if
-                                  c.from_node == node and c.to_node.type == 'memory']
-                for memory_node_id in memory_targets:
-                    memory_node = self.graph.get_node_by_id(memory_node_id)
-                    file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-                    try:
-                        self._write_to_memory(file_path, state['data'][str(node.id)])
-                    except (PermissionError, OSError) as e:
-                        print(f"Error writing to {file_path}: {e}")
+                self._write_memory_targets(node, state)
                 return state
             return fn
 
@@ -394,15 +491,7 @@ class LLMWorkflow:
                 state['answer'] = "".join(parts)
                 state['data'][str(node.id)] = state['answer']
                 state["activation"][str(node.id)] = True
-                memory_targets = [c.to_node.id for c in self.graph.connections if
-                                  c.from_node == node and c.to_node.type == 'memory']
-                for memory_node_id in memory_targets:
-                    memory_node = self.graph.get_node_by_id(memory_node_id)
-                    file_path = os.path.join(script_dir, f"memory_{memory_node.content[0]}.txt")
-                    try:
-                        self._write_to_memory(file_path, state['data'][str(node.id)])
-                    except (PermissionError, OSError) as e:
-                        print(f"Error writing to {file_path}: {e}")
+                self._write_memory_targets(node, state)
                 return state
             return fn
 
@@ -413,10 +502,15 @@ class LLMWorkflow:
                 self.node_funcs[node.id] = retrieval_factory(node)
             elif node.type == 'query':
                 self.node_funcs[node.id] = query_factory(node)
+                self.async_node_funcs[node.id] = async_query_factory(node)
             elif node.type == 'condition':
                 self.node_funcs[node.id] = condition_factory(node)
             elif node.type == 'memory':
                 self.node_funcs[node.id] = memory_factory(node)
+                if node.memory.get("max_size_kb") or node.memory.get("max_age_hours"):
+                    max_size_kb, max_age_hours = node.memory.get("max_size_kb"), node.memory.get("max_age_hours")
+                    set_retention(node.content[0], int(max_size_kb * 1024) if max_size_kb else None,
+                                  max_age_hours * 3600 if max_age_hours else None)
             elif node.type == 'output':
                 self.node_funcs[node.id] = output_factory(node)
             else:
@@ -424,18 +518,217 @@ class LLMWorkflow:
 
         self.exec_order = self.graph.topological_sort()
 
-    def ask_question(self, question: str) -> str:
-        state: Dict[str, Any] = {'question': question, 'data': {}, 'activation': {}, 'answer': ''}
+    def ask_question(self, question: str, cancel: CancelToken = None) -> str:
+        """
+        Answer one question with the built graph
+
+        Args:
+            question: Question (or request payload) for the input node
+            cancel: Token of the request; once it is cancelled no further nodes run, the LLM call in
+                flight is aborted where the client supports it and the memory writes are discarded
+
+        Raises:
+            WorkflowCancelled: The run was cancelled
+        """
+        state: Dict[str, Any] = {'question': question, 'data': {}, 'activation': {}, 'answer': '',
+                                 'memory': MemoryTransaction(self.memory_store)}
         print(f"Starting workflow for question: '{question}'")
         start_time = time.time()  # Record start time
-        for nid in self.exec_order:
-            print(f"\n---> Executing node {nid} ({self.graph.get_node_by_id(nid).type})")
-            state = self.node_funcs[nid](state)
+        cancel_reason = None
+        try:
+            with cancel_scope(cancel):
+                for nid in self.exec_order:
+                    if cancel is not None:
+                        cancel.check()
+                    print(f"\n---> Executing node {nid} ({self.graph.get_node_by_id(nid).type})")
+                    state = self.node_funcs[nid](state)
+        except Exception as e:
+            cancel_reason = self._cancel_reason(cancel, e)
+            if cancel_reason is not None and not isinstance(e, WorkflowCancelled):
+                # E.g. the request timeout of a provider call cut short by the deadline
+                raise WorkflowCancelled(cancel_reason) from e
+            raise
+        finally:
+            # Memory written before a failure is kept, as with direct appends, unless the run was cancelled
+            self._finish_run(state, cancel_reason)
         end_time = time.time()  # Record end time
         total_time = end_time - start_time  # Calculate total time
         print(f"\n[Workflow Completed] Total processing time: {total_time:.2f} seconds")
         return str(state['answer'])
 
+    async def ask_question_async(self, question: str, cancel: CancelToken = None) -> str:
+        """
+        Async variant of ask_question for the async serving mode
+
+        Query nodes await LLMClient.ainvoke, so a request waiting for the provider holds no thread.
+        Retrieval and memory nodes, which embed, search and read files, and the memory commit run in
+        the event loop's thread pool; the other nodes are cheap and run inline. With a cancel token,
+        the awaited node is cancelled as soon as the token is, which aborts the provider request of
+        async clients; a node running in the thread pool finishes, but its result is dropped.
+        """
+        state: Dict[str, Any] = {'question': question, 'data': {}, 'activation': {}, 'answer': '',
+                                 'memory': MemoryTransaction(self.memory_store)}
+        print(f"Starting workflow for question: '{question}'")
+        start_time = time.time()
+        cancel_reason = None
+        try:
+            with cancel_scope(cancel):
+                for nid in self.exec_order:
+                    if cancel is not None:
+                        cancel.check()
+                    node = self.graph.get_node_by_id(nid)
+                    print(f"\n---> Executing node {nid} ({node.type})")
+                    if nid in self.async_node_funcs:
+                        step = self.async_node_funcs[nid](state)
+                    elif node.type in ('retrieval', 'memory'):
+                        step = asyncio.to_thread(self.node_funcs[nid], state)
+                    else:
+                        state = self.node_funcs[nid](state)
+                        continue
+                    state = await (cancel.run(step) if cancel is not None else step)
+        except (Exception, asyncio.CancelledError) as e:
+            cancel_reason = self._cancel_reason(cancel, e)
+            if cancel_reason is not None and not isinstance(e, (WorkflowCancelled, asyncio.CancelledError)):
+                raise WorkflowCancelled(cancel_reason) from e
+            raise
+        finally:
+            if cancel_reason is not None:
+                self._finish_run(state, cancel_reason)
+            else:
+                await asyncio.to_thread(self._finish_run, state)
+        total_time = time.time() - start_time
+        print(f"\n[Workflow Completed] Total processing time: {total_time:.2f} seconds")
+        return str(state['answer'])
+
+    def ask_questions(self, questions: List[str], output_path: str = None, batch_size: int = 32,
+                      max_concurrency: int = 8) -> List[Dict[str, Any]]:
+        """
+        Run many questions through the built graph for offline evaluation
+
+        Questions are processed in chunks of batch_size, node by node: each query node sends the prompts
+        of the whole chunk through LLMClient.invoke_batch and each retrieval node embeds all its queries
+        in one call. Memory registries are therefore written for the whole chunk before they are read,
+        unlike a sequence of ask_question calls.
+
+        Args:
+            questions: Questions to answer
+            output_path: JSONL file that receives one result per line as each chunk finishes
+            batch_size: Questions per chunk
+            max_concurrency: Maximum concurrent provider calls per query node
+
+        Returns:
+            list: Result dicts with index, question, answer, error and latency, in input order
+        """
+        results = []
+        out_file = open(output_path, 'w', encoding='utf-8') if output_path else None
+        try:
+            for offset in range(0, len(questions), batch_size):
+                chunk = questions[offset:offset + batch_size]
+                start_time = time.time()
+                # One memory transaction per chunk, committed after the chunk
+                transaction = MemoryTransaction(self.memory_store)
+                states = [{'question': q, 'data': {}, 'activation': {}, 'answer': '', 'error': None,
+                           'memory': transaction} for q in chunk]
+                for nid in self.exec_order:
+                    node = self.graph.get_node_by_id(nid)
+                    live = [st for st in states if st['error'] is None]
+                    if node.type == 'query':
+                        self._run_query_batch(node, live, max_concurrency)
+                        continue
+                    if node.type == 'retrieval':
+                        self._embed_retrieval_queries(node, live)
+                    elif node.type == 'memory' and node.memory.get("recall_k"):
+                        self._embed_queries(node, [str(st['question']) for st in live])
+                    for st in live:
+                        try:
+                            self.node_funcs[nid](st)
+                        except Exception as e:
+                            st['error'] = f"Node {nid}: {e}"
+                self._commit_memory(transaction)
+                self._index_recall_memory()
+                self._query_embeddings.clear()
+                latency = (time.time() - start_time) / len(chunk)
+                for i, st in enumerate(states):
+                    result = {"index": offset + i, "question": st['question'], "answer": str(st['answer']),
+                              "error": st['error'], "latency": latency}
+                    results.append(result)
+                    if out_file:
+                        out_file.write(json.dumps(result, ensure_ascii=False) + "\n")
+                if out_file:
+                    out_file.flush()
+                print(f"[Batch] {offset + len(chunk)}/{len(questions)} questions answered")
+        finally:
+            if out_file:
+                out_file.close()
+        return results
+
+    @staticmethod
+    def _cancel_reason(cancel: CancelToken, error: BaseException):
+        """Why the run that raised error was cancelled, None if it simply failed"""
+        if cancel is not None and cancel.cancelled:
+            return cancel.reason
+        if isinstance(error, asyncio.CancelledError):  # The request task itself was cancelled
+            return "cancelled"
+        return None
+
+    def _finish_run(self, state: Dict[str, Any], cancel_reason: str = None):
+        """Commit the memory writes of a run, or discard them if the run was cancelled"""
+        if cancel_reason is not None:
+            print(f"\n[Workflow Cancelled] ({cancel_reason}) remaining nodes skipped, memory writes discarded")
+            return
+        self._commit_memory(state['memory'])
+        self._index_recall_memory()
+
+    @staticmethod
+    def _commit_memory(transaction: MemoryTransaction):
+        try:
+            transaction.commit()
+        except (PermissionError, OSError, sqlite3.Error) as e:
+            print(f"Error writing to memory: {e}")
+
+    def _run_query_batch(self, node: Node, states: List[Dict[str, Any]], max_concurrency: int):
+        active = []
+        for st in states:
+            if self._is_activated(node, st):
+                st["activation"][str(node.id)] = True
+                active.append(st)
+            else:
+                st["activation"][str(node.id)] = False
+        if not active:
+            return
+        prompts = [self._query_prompt(node, st) for st in active]
+        client = self._client_for(node)
+        outs = client.invoke_batch(prompts, node_id=node.id, max_concurrency=max_concurrency,
+                                   return_exceptions=True, generation=node.generation,
+                                   cacheable_prefix="".join(node.content))
+        for st, out in zip(active, outs):
+            if isinstance(out, Exception):
+                st['error'] = f"Node {node.id}: {out}"
+            else:
+                self._store_query_output(node, st, out)
+
+    def _embed_retrieval_queries(self, node: Node, states: List[Dict[str, Any]]):
+        self._embed_queries(node, [self._retrieval_query(node, st) for st in states if self._is_activated(node, st)])
+
+    def _embed_queries(self, node: Node, texts: List[str]):
+        texts = [t for t in dict.fromkeys(texts) if t not in self._query_embeddings]
+        if not texts:
+            return
+        try:
+            vectors = self.embeddings.embed_documents(texts)
+        except Exception as e:
+            # Nodes fall back to embedding each query on their own
+            print(f"[Node {node.id}] Batch embedding failed: {e}")
+            return
+        self._query_embeddings.update(zip(texts, vectors))
+
+    def _index_recall_memory(self):
+        """Embed new entries of registries read in recall mode, off the request path"""
+        registries = {n.content[0] for n in self.graph.nodes if n.type == 'memory' and n.memory.get("recall_k")}
+        for registry in registries:
+            index_entries_async(self.memory_store.log(registry), self.embedding_provider,
+                                self.embeddings.embed_documents)
+
     def cleanup_faiss_indexes(self):
         pattern = r'faiss_node_\d+_[a-f0-9]{8}'
         for item in os.listdir(script_dir):
@@ -447,25 +740,78 @@ class LLMWorkflow:
                 except Exception as e:
                     print(f"Failed to delete {item}: {e}")
 
-def prompt(inp, provider="google", **llm_kwargs):
+_session_store = None
+_session_store_lock = threading.Lock()
+
+
+def get_session_store() -> SessionMemoryStore:
+    """Per-session memory cache over the configured memory backend, created on first use"""
+    global _session_store
+    with _session_store_lock:
+        if _session_store is None:
+            _session_store = SessionMemoryStore(get_memory_store(script_dir))
+        return _session_store
+
+
+def prompt(inp, provider=None, session_id=None, cancel: CancelToken = None, **llm_kwargs):
+    """
+    Answer one question with the graph in graph.json
+
+    Args:
+        inp: Question (or request payload) for the input node
+        provider: LLM provider; defaults to LLMTSUP_PROVIDER
+        session_id: Client session (e.g. one headset); memory registries are kept per session.
+            Without it the registries are shared by all clients.
+        cancel: Cancel token of the request, see LLMWorkflow.ask_question
+        **llm_kwargs: Further get_llm_client arguments
+    """
     config = initialize_api_keys()
-    llm_client = get_llm_client(provider, **llm_kwargs)
+    # Shared with earlier requests, so provider prompt caches are reused between utterances
+    llm_client = shared_llm_client(provider or LLM_PROVIDER, **llm_kwargs)
     graph = Graph()
-    workflow = LLMWorkflow(graph, llm_client, config)
+    memory_store = get_session_store().session(session_id) if session_id else None
+    workflow = LLMWorkflow(graph, llm_client, config, memory_store=memory_store)
     workflow.get_graph('graph.json')
     workflow.build()
-    ans = workflow.ask_question(inp)
+    ans = workflow.ask_question(inp, cancel)
     return ans
 
+_graph_cache: Dict[str, tuple] = {}
+
+
+def _load_graph_dict(path: str) -> Dict[str, Any]:
+    """Parsed graph file, read again only when it changed"""
+    mtime = os.path.getmtime(path)
+    cached = _graph_cache.get(path)
+    if cached is None or cached[0] != mtime:
+        with open(path, 'r', encoding='utf-8') as f:
+            cached = (mtime, json.load(f))
+        _graph_cache[path] = cached
+    return cached[1]
+
+
+async def prompt_async(inp, provider=None, session_id=None, cancel: CancelToken = None, **llm_kwargs):
+    """
+    Async variant of prompt, used by the async serving mode
+
+    LLM clients are shared by all requests, so the connection pools of async SDKs stay open
+    between utterances, and graph.json is only parsed again after it changed. Arguments are
+    the same as for prompt.
+    """
+    llm_client = shared_llm_client(provider or LLM_PROVIDER, **llm_kwargs)
+    graph = Graph()
+    memory_store = get_session_store().session(session_id) if session_id else None
+    graph.from_dict(_load_graph_dict('graph.json'))
+    workflow = LLMWorkflow(graph, llm_client, config, memory_store=memory_store)
+    workflow.build()
+    return await workflow.ask_question_async(inp, cancel)
+
+
 def delete_memory():
-    for filename in os.listdir('.'):
-        if re.fullmatch(r'memory_.*\.txt', filename):
-            print(filename)
-            try:
-                os.remove(filename)
-                print(f"Deleted: {filename}")
-            except Exception as e:
-                print(f"Failed to delete {filename}: {e}")
+    if _session_store is not None:
+        _session_store.delete_all()
+    else:
+        get_memory_store(script_dir).delete_all()
 
 def cleanup_all():
     delete_memory()
@@ -1,4 +1,9 @@
 import llmgraphbuilder
+from admission import admission_queue, request_priority, AdmissionRejected
+from cancellation import CancelToken, WorkflowCancelled
+import os
+import json
+import asyncio
 import socket
 from flask import Flask, request, jsonify
 from flask_cors import CORS
@@ -22,14 +27,220 @@ app = Flask(__name__)
 CORS(app)  # Enable if needed for cross-origin
 
 
+# Request options, given as body fields or headers; they are removed from the payload passed to the graph
+REQUEST_OPTIONS = {"session_id": "x-session-id", "priority": "x-priority", "deadline_ms": "x-deadline-ms",
+                   "utterance_words": "x-utterance-words"}
+
+
+def _request_options(data, headers):
+    """
+    Split the request options from the payload
+
+    Args:
+        data: Parsed JSON body
+        headers: Request headers with lower-case names
+
+    Returns:
+        tuple: Payload, session id, priority class and request deadline in seconds (None for none)
+    """
+    options = {name: headers.get(header) for name, header in REQUEST_OPTIONS.items()}
+    if isinstance(data, dict) and any(name in data for name in REQUEST_OPTIONS):
+        data = dict(data)
+        for name in REQUEST_OPTIONS:
+            value = data.pop(name, None)
+            if value not in (None, ""):
+                options[name] = value
+    # Without a deadline of its own a request may run for LLMTSUP_REQUEST_TIMEOUT seconds, if set
+    if options["deadline_ms"]:
+        deadline = float(options["deadline_ms"]) / 1000
+    else:
+        deadline = float(os.environ["LLMTSUP_REQUEST_TIMEOUT"]) if os.environ.get("LLMTSUP_REQUEST_TIMEOUT") else None
+    priority = request_priority(data, options["priority"], options["utterance_words"])
+    return data, options["session_id"], priority, deadline
+
+
+def _rejection(e: AdmissionRejected):
+    """Status, body and headers of a request the admission queue turned away"""
+    return 503, {"error": str(e), "reason": e.reason}, {"Retry-After": str(max(1, round(e.retry_after)))}
+
+
+def _cancelled(e: WorkflowCancelled):
+    """Status and body of a request whose workflow was cancelled"""
+    return 504, {"error": str(e), "reason": e.reason}
+
+
 @app.route("/run", methods=["POST"])
 def run():
-    data = request.json
+    # Each headset sends its own session id, so memory registries are not shared between devices
+    # WSGI does not report client disconnects, so here only the deadline cancels the workflow
+    try:
+        data, session_id, priority, deadline = _request_options(request.json, {k.lower(): v for k, v in request.headers})
+        cancel = CancelToken(deadline)
+        wait = admission_queue.acquire(priority, cancel.remaining())
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except AdmissionRejected as e:
+        status, body, headers = _rejection(e)
+        return jsonify(body), status, headers
     start_time = time.time()  # Start the clock
-    result = llmgraphbuilder.prompt(data)
+    try:
+        result = llmgraphbuilder.prompt(data, session_id=session_id, cancel=cancel)
+    except WorkflowCancelled as e:
+        status, body = _cancelled(e)
+        return jsonify(body), status
+    finally:
+        admission_queue.release(time.time() - start_time)
     end_time = time.time()  # End the clock
     latency = end_time - start_time  # Calculate latency in seconds
-    return jsonify({"result": result, "latency": latency})
+    return jsonify({"result": result, "latency": latency, "queue_wait": wait})
+
+
+@app.route("/usage", methods=["GET"])
+def usage():
+    """Token usage, cost and latency aggregated per graph node and per provider."""
+    return jsonify(llmgraphbuilder.usage_tracker.summary())
+
+
+@app.route("/queue", methods=["GET"])
+def queue_stats():
+    """Admission queue depth, rejections and wait times per priority class."""
+    return jsonify(admission_queue.stats())
+
+
+# --- Async serving mode (LLMTSUP_SERVER=asgi) ---
+# The same routes as the Flask app as a plain ASGI application. /run awaits the workflow, so
+# concurrent utterances wait on provider I/O in one event loop instead of each holding a thread.
+
+
+async def _send_json(send, status, payload, headers=None):
+    body = json.dumps(payload).encode("utf-8")
+    await send({"type": "http.response.start", "status": status, "headers": [
+        (b"content-type", b"application/json"),
+        (b"content-length", str(len(body)).encode()),
+        (b"access-control-allow-origin", b"*")
+    ] + [(k.lower().encode("latin-1"), v.encode("latin-1")) for k, v in (headers or {}).items()]})
+    await send({"type": "http.response.body", "body": body})
+
+
+async def _read_body(receive) -> bytes:
+    chunks = []
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            raise ConnectionError("Client disconnected")
+        chunks.append(message.get("body", b""))
+        if not message.get("more_body"):
+            return b"".join(chunks)
+
+
+async def _watch_disconnect(receive, cancel: CancelToken):
+    """Cancel the request's workflow when the client disconnects; runs once the body was read"""
+    while True:
+        message = await receive()
+        if message["type"] == "http.disconnect":
+            cancel.cancel("disconnected")
+            return
+
+
+async def asgi_app(scope, receive, send):
+    """ASGI application serving /run, /usage and /queue"""
+    if scope["type"] == "lifespan":
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+    if scope["type"] != "http":
+        return
+    method, path = scope["method"], scope["path"]
+    if method == "OPTIONS":
+        await send({"type": "http.response.start", "status": 204, "headers": [
+            (b"access-control-allow-origin", b"*"),
+            (b"access-control-allow-methods", b"GET, POST, OPTIONS"),
+            (b"access-control-allow-headers", b"Content-Type, X-Session-Id, X-Priority, X-Deadline-Ms, X-Utterance-Words")
+        ]})
+        await send({"type": "http.response.body", "body": b""})
+    elif path == "/run" and method == "POST":
+        try:
+            data = json.loads(await _read_body(receive) or b"null")
+        except ValueError as e:
+            await _send_json(send, 400, {"error": f"Invalid JSON: {e}"})
+            return
+        except ConnectionError:
+            return
+        headers = {key.decode("latin-1").lower(): value.decode("latin-1") for key, value in scope["headers"]}
+        try:
+            data, session_id, priority, deadline = _request_options(data, headers)
+        except ValueError as e:
+            await _send_json(send, 400, {"error": str(e)})
+            return
+        cancel = CancelToken(deadline)
+        watcher = asyncio.ensure_future(_watch_disconnect(receive, cancel))
+        try:
+            await _run_workflow(send, data, session_id, priority, cancel)
+        finally:
+            watcher.cancel()
+    elif path == "/usage" and method == "GET":
+        await _send_json(send, 200, llmgraphbuilder.usage_tracker.summary())
+    elif path == "/queue" and method == "GET":
+        await _send_json(send, 200, admission_queue.stats())
+    else:
+        await _send_json(send, 404, {"error": f"Not found: {method} {path}"})
+
+
+async def _run_workflow(send, data, session_id, priority, cancel: CancelToken):
+    """Admit a /run request, run its workflow and send the response; nothing is sent to a disconnected client"""
+    try:
+        # A client that leaves while queued gives up its place
+        wait = await cancel.run(admission_queue.acquire_async(priority, cancel.remaining()))
+    except ValueError as e:
+        await _send_json(send, 400, {"error": str(e)})
+        return
+    except AdmissionRejected as e:
+        await _send_json(send, *_rejection(e))
+        return
+    except WorkflowCancelled as e:
+        if e.reason != "disconnected":
+            await _send_json(send, *_rejection(AdmissionRejected("deadline", str(e))))
+        return
+    start_time = time.time()
+    try:
+        result = await llmgraphbuilder.prompt_async(data, session_id=session_id, cancel=cancel)
+    except WorkflowCancelled as e:
+        print(f"Workflow cancelled: {e.reason}")
+        if e.reason != "disconnected":
+            await _send_json(send, *_cancelled(e))
+        return
+    except Exception as e:
+        print(f"Error running workflow: {e}")
+        await _send_json(send, 500, {"error": str(e)})
+        return
+    finally:
+        admission_queue.release(time.time() - start_time)
+    await _send_json(send, 200, {"result": result, "latency": time.time() - start_time, "queue_wait": wait})
+
+
+def serve_asgi(host="0.0.0.0", port=5000):
+    """
+    Serve asgi_app with uvicorn
+
+    LLMTSUP_SERVER_WORKERS sets the number of worker processes (default 1) and LLMTSUP_KEEP_ALIVE
+    the seconds an idle connection is kept open (default 5). Each worker admits requests through
+    its own admission queue (see admission.py).
+    """
+    try:
+        import uvicorn
+    except ImportError:
+        raise ImportError("uvicorn is required for LLMTSUP_SERVER=asgi. Install with: pip install uvicorn")
+    workers = int(os.environ.get("LLMTSUP_SERVER_WORKERS", "1"))
+    if workers > 1:
+        print("Note: each server worker keeps its own session memory cache; "
+              "use LLMTSUP_MEMORY_BACKEND=sqlite and route a headset to one worker")
+    # Several workers need an import string, so that each process imports the app itself
+    uvicorn.run(asgi_app if workers == 1 else "llmserverhost:asgi_app", host=host, port=port, workers=workers,
+                timeout_keep_alive=int(os.environ.get("LLMTSUP_KEEP_ALIVE", "5")), log_level="warning")
 
 
 def udp_discovery_listener():
@@ -56,4 +267,7 @@ if __name__ == "__main__":
     threading.Thread(target=udp_discovery_listener, daemon=True).start()
     local_ip = get_local_ip()
     print(f"Server running at: http://{local_ip}:5000/run")
-    app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
+    if os.environ.get("LLMTSUP_SERVER", "flask") == "asgi":
+        serve_asgi(host="0.0.0.0", port=5000)
+    else:
+        app.run(host="0.0.0.0", port=5000)
\ No newline at end of file
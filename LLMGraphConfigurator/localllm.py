@@ -1,10 +1,22 @@
 import torch
-from transformers import AutoTokenizer, AutoModelForCausalLM, pipeline
+from transformers import (AutoTokenizer, AutoModelForCausalLM, DynamicCache, StoppingCriteria,
+                          StoppingCriteriaList, TextIteratorStreamer, pipeline)
 import gc
+import os
+import copy
 import psutil
-import GPUtil
 import ctypes
 import sys
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from concurrent.futures import Future
+
+try:
+    import GPUtil
+except ImportError:  # Only needed to report GPU memory
+    GPUtil = None
 
 '''def is_admin():
     try:
@@ -26,7 +38,7 @@ else:
 
 def check_gpu_memory():
     """Check available GPU memory"""
-    if torch.cuda.is_available():
+    if torch.cuda.is_available() and GPUtil is not None:
         gpu = GPUtil.getGPUs()[0]
         print(f"GPU: {gpu.name}")
         print(f"GPU Memory: {gpu.memoryUsed}MB / {gpu.memoryTotal}MB ({gpu.memoryUtil * 100:.1f}% used)")
@@ -42,11 +54,155 @@ def clear_memory():
         torch.cuda.empty_cache()
 
 
+def model_nbytes(model):
+    """Memory held by a model's weights and buffers, including packed int8 weights"""
+    def nbytes(value):
+        if isinstance(value, torch.Tensor):
+            return value.numel() * value.element_size()
+        if isinstance(value, (tuple, list)):
+            return sum(nbytes(v) for v in value)
+        return 0
+
+    return sum(nbytes(value) for value in model.state_dict().values())
+
+
+def cache_nbytes(past_key_values):
+    """Memory held by the key/value tensors of a transformers cache object or legacy tuple"""
+    tensors = []
+    if hasattr(past_key_values, "layers"):  # transformers >= 4.54
+        for layer in past_key_values.layers:
+            tensors += [getattr(layer, "keys", None), getattr(layer, "values", None)]
+    elif hasattr(past_key_values, "key_cache"):
+        tensors = list(past_key_values.key_cache) + list(past_key_values.value_cache)
+    else:
+        for layer in past_key_values:
+            tensors += list(layer)
+    return sum(t.numel() * t.element_size() for t in tensors if isinstance(t, torch.Tensor))
+
+
+def crop_cache(past_key_values, length):
+    """Shorten a DynamicCache to its first length positions (no-op if it is not longer)"""
+    # A negative argument removes that many positions in every transformers version with crop()
+    excess = past_key_values.get_seq_length() - length
+    if excess > 0:
+        past_key_values.crop(-excess)
+
+
+QUANTIZATION_MODES = (None, "int8", "bf16")
+
+
+def conv1d_to_linear(model):
+    """
+    Replace GPT-2 style Conv1D layers with equivalent nn.Linear layers
+
+    Conv1D stores its weight transposed and is not picked up by dynamic quantization,
+    which only handles nn.Linear.
+    """
+    from transformers.pytorch_utils import Conv1D
+
+    for parent in list(model.modules()):
+        for name, child in list(parent.named_children()):
+            if isinstance(child, Conv1D):
+                linear = torch.nn.Linear(child.weight.shape[0], child.weight.shape[1])
+                linear.weight.data = child.weight.data.t().contiguous()
+                linear.bias.data = child.bias.data
+                setattr(parent, name, linear)
+    return model
+
+
+def quantize_model(model, quantization):
+    """
+    Apply a CPU quantization mode to a loaded float32 model
+
+    Args:
+        model: Causal LM loaded on the CPU
+        quantization: "int8" for dynamic int8 on linear layers, "bf16" for bfloat16 weights
+
+    Returns:
+        The quantized model
+    """
+    if quantization == "bf16":
+        return model.to(torch.bfloat16)
+    # Dynamic int8: weights are stored as int8, activations are quantized per call.
+    # The output projection stays float32 since it is usually tied to the input embeddings.
+    model = conv1d_to_linear(model)
+    linear_layers = {name for name, module in model.named_modules()
+                     if isinstance(module, torch.nn.Linear) and name != "lm_head"}
+    return torch.ao.quantization.quantize_dynamic(model, linear_layers, dtype=torch.qint8)
+
+
+class PrefixCache:
+    """LRU store of key/value states for token prefixes, bounded by their memory size"""
+
+    def __init__(self, max_bytes=256 * 1024 ** 2):
+        self.max_bytes = max_bytes
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+
+    def lookup(self, token_ids):
+        """Return (length, past_key_values) of the longest stored prefix of token_ids, (0, None) if none"""
+        best = None
+        for key in self._entries:
+            if len(key) <= len(token_ids) and (best is None or len(key) > len(best)) \
+                    and tuple(token_ids[:len(key)]) == key:
+                best = key
+        if best is None:
+            self.misses += 1
+            return 0, None
+        self.hits += 1
+        self._entries.move_to_end(best)
+        return len(best), self._entries[best][0]
+
+    def store(self, token_ids, past_key_values):
+        """Keep the state for token_ids, evicting least recently used prefixes beyond max_bytes"""
+        key = tuple(token_ids)
+        size = cache_nbytes(past_key_values)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self.size_bytes -= self._entries.pop(key)[1]
+        self._entries[key] = (past_key_values, size)
+        self.size_bytes += size
+        while self.size_bytes > self.max_bytes:
+            _, (_, evicted_size) = self._entries.popitem(last=False)
+            self.size_bytes -= evicted_size
+
+    def clear(self):
+        self._entries.clear()
+        self.size_bytes = 0
+
+
+class EventStoppingCriteria(StoppingCriteria):
+    """Stops generate() once an event is set and counts the tokens generated so far"""
+
+    def __init__(self, event, prompt_length):
+        self.event = event
+        self.prompt_length = prompt_length
+        self.generated_tokens = 0
+
+    def __call__(self, input_ids, scores, **kwargs):
+        self.generated_tokens = input_ids.shape[-1] - self.prompt_length
+        return torch.full((input_ids.shape[0],), self.event.is_set(), dtype=torch.bool, device=input_ids.device)
+
+
 class LocalLLM:
-    def __init__(self, model_name="distilgpt2"):
+    def __init__(self, model_name="distilgpt2", device=None, prefix_cache_bytes=256 * 1024 ** 2,
+                 quantization=None, draft_model_name=None, num_draft_tokens=4):
         """
         Initialize the local LLM
 
+        Args:
+            model_name: Hugging Face model id or local path
+            device: "cuda" or "cpu"; None picks CUDA when it works and falls back to CPU
+            prefix_cache_bytes: Memory budget for reusable key/value states of prompt prefixes
+            quantization: CPU only; None keeps float32, "int8" applies dynamic int8 quantization
+                to linear layers, "bf16" loads bfloat16 weights (see localllm_benchmark.py)
+            draft_model_name: Optional smaller model with the same tokenizer (e.g. "distilgpt2" for "gpt2")
+                used for speculative decoding of single greedy completions
+            num_draft_tokens: Tokens the draft model proposes per verification step
+
         Recommended models for RTX 3060 (12GB VRAM):
         - "distilgpt2" (Very lightweight, good for testing)
         - "gpt2" (Original GPT-2)
@@ -55,10 +211,23 @@ class LocalLLM:
         - "EleutherAI/gpt-neo-1.3B" (1.3B parameters)
         - "EleutherAI/gpt-neo-2.7B" (2.7B parameters, may be tight on memory)
         """
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Unsupported quantization: {quantization}")
         self.model_name = model_name
+        self.draft_model_name = draft_model_name
+        self.num_draft_tokens = num_draft_tokens
+        self.draft_model = None
+        # Cumulative speculative decoding counters, see speculative_stats()
+        self._draft_proposed = 0
+        self._draft_accepted = 0
+        # Serializes generation so concurrent callers do not share the model mid-generate
+        self._lock = threading.Lock()
+        self.prefix_cache = PrefixCache(prefix_cache_bytes)
 
         # Check CUDA availability with better error handling
-        if torch.cuda.is_available():
+        if device == "cpu":
+            self.device = "cpu"
+        elif torch.cuda.is_available():
             try:
                 # Test CUDA functionality
                 torch.cuda.init()
@@ -73,6 +242,10 @@ class LocalLLM:
             self.device = "cpu"
 
         print(f"Using device: {self.device}")
+        if quantization and self.device == "cuda":
+            print(f"Quantization '{quantization}' only applies on CPU, using float16 on the GPU")
+            quantization = None
+        self.quantization = quantization
 
         # Check memory before loading (only if GPU available)
         if self.device == "cuda":
@@ -87,6 +260,8 @@ class LocalLLM:
             # Add padding token if it doesn't exist
             if self.tokenizer.pad_token is None:
                 self.tokenizer.pad_token = self.tokenizer.eos_token
+            # Decoder-only models continue from the right end, so batched prompts are padded on the left
+            self.tokenizer.padding_side = "left"
 
             # Load model with memory optimization
             if self.device == "cuda":
@@ -100,9 +275,16 @@ class LocalLLM:
                 # CPU version - don't use float16 or device_map
                 self.model = AutoModelForCausalLM.from_pretrained(
                     model_name,
+                    torch_dtype=torch.bfloat16 if quantization == "bf16" else torch.float32,
                     low_cpu_mem_usage=True
                 )
                 self.model.to(self.device)
+                if quantization == "int8":
+                    self.model = quantize_model(self.model, quantization)
+                self.model.eval()
+
+            if draft_model_name:
+                self._load_draft_model(draft_model_name)
 
             print("Model loaded successfully!")
             if self.device == "cuda":
@@ -113,6 +295,93 @@ class LocalLLM:
             print("Try a smaller model or ensure you have enough GPU memory")
             raise
 
+    def _load_draft_model(self, draft_model_name):
+        """Load the draft model for speculative decoding; it must share the target's vocabulary"""
+        print(f"Loading draft model: {draft_model_name}")
+        draft_tokenizer = AutoTokenizer.from_pretrained(draft_model_name)
+        if draft_tokenizer.get_vocab() != self.tokenizer.get_vocab():
+            raise ValueError(f"Draft model {draft_model_name} does not share the tokenizer of {self.model_name}")
+        if self.device == "cuda":
+            self.draft_model = AutoModelForCausalLM.from_pretrained(draft_model_name, torch_dtype=torch.float16,
+                                                                    low_cpu_mem_usage=True).to(self.device)
+        else:
+            self.draft_model = AutoModelForCausalLM.from_pretrained(
+                draft_model_name,
+                torch_dtype=torch.bfloat16 if self.quantization == "bf16" else torch.float32,
+                low_cpu_mem_usage=True
+            )
+            if self.quantization == "int8":
+                self.draft_model = quantize_model(self.draft_model, self.quantization)
+        self.draft_model.eval()
+
+    def speculative_stats(self):
+        """Draft tokens proposed and accepted so far, with the acceptance rate"""
+        proposed, accepted = self._draft_proposed, self._draft_accepted
+        return {"proposed": proposed, "accepted": accepted,
+                "acceptance_rate": round(accepted / proposed, 4) if proposed else None}
+
+    def _speculative_generate(self, token_ids, max_new_tokens, target_cache=None):
+        """
+        Greedy speculative decoding: the draft model proposes num_draft_tokens tokens, the target
+        model checks all of them in one forward pass and keeps the longest agreeing run plus its
+        own next token. The output equals plain greedy decoding with the target model.
+
+        Args:
+            token_ids: Prompt token ids
+            max_new_tokens: Maximum number of generated tokens
+            target_cache: Optional target key/value state of a proper prefix of token_ids (e.g. from
+                the prefix cache); it is extended in place
+
+        Returns:
+            tuple: (generated token ids, draft tokens proposed, draft tokens accepted)
+        """
+        eos = self.tokenizer.eos_token_id
+        target_cache = target_cache if target_cache is not None else DynamicCache()
+        draft_cache = DynamicCache()
+        sequence = list(token_ids)
+        # Prefill the target with what its cache lacks; its last logits give the first new token.
+        # The draft cache is filled with the first proposal.
+        logits = self.model(input_ids=torch.tensor([sequence[target_cache.get_seq_length():]], device=self.device),
+                            past_key_values=target_cache, use_cache=True).logits
+        generated = [int(logits[0, -1].argmax())]
+        proposed = accepted = 0
+
+        while len(generated) < max_new_tokens and generated[-1] != eos:
+            sequence_length = len(sequence) + len(generated)  # The last token is not in either cache yet
+            # Draft: catch the cache up with the accepted tokens, then propose tokens one by one
+            drafts = []
+            draft_input = (sequence + generated)[draft_cache.get_seq_length():]
+            for _ in range(min(self.num_draft_tokens, max_new_tokens - len(generated))):
+                draft_logits = self.draft_model(input_ids=torch.tensor([draft_input], device=self.device),
+                                                past_key_values=draft_cache, use_cache=True).logits
+                drafts.append(int(draft_logits[0, -1].argmax()))
+                draft_input = drafts[-1:]
+                if drafts[-1] == eos:
+                    break
+
+            # Target: verify the last accepted token and all drafts in one forward pass
+            verify_logits = self.model(input_ids=torch.tensor([generated[-1:] + drafts], device=self.device),
+                                       past_key_values=target_cache, use_cache=True).logits
+            predictions = verify_logits[0].argmax(dim=-1).tolist()
+            n = 0
+            while n < len(drafts) and drafts[n] == predictions[n]:
+                n += 1
+            proposed += len(drafts)
+            accepted += n
+            new_tokens = drafts[:n] + [predictions[n]]
+            if eos in new_tokens:
+                # An accepted EOS draft ends the reply; the target's token after it is not part of it
+                generated += new_tokens[:new_tokens.index(eos) + 1]
+                break
+            generated += new_tokens
+
+            # Drop cache entries of rejected drafts; the target's own token is fed next round
+            crop_cache(target_cache, sequence_length + n)
+            crop_cache(draft_cache, sequence_length + n)
+
+        generated = generated[:max_new_tokens]
+        return generated, proposed, accepted
+
     def generate_text(self, prompt, max_length=100, temperature=0.7, top_p=0.9, do_sample=True):
         """Generate text from a prompt"""
         try:
@@ -131,23 +400,224 @@ class LocalLLM:
                     attention_mask=torch.ones_like(inputs)
                 )
 
-            # Decode the output
-            generated_text = self.tokenizer.decode(outputs[0], skip_special_tokens=True)
-
-            # Return only the new generated part
-            return generated_text[len(prompt):].strip()
+            # Decode only the new tokens; decoding may not reproduce the prompt text character for character
+            generated_text = self.tokenizer.decode(outputs[0][inputs.shape[-1]:], skip_special_tokens=True)
+            return generated_text.strip()
 
         except Exception as e:
             print(f"Error during generation: {e}")
             return None
 
-    def chat(self):
+    def stream_text(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, stats=None):
+        """
+        Generate a completion and yield decoded text increments as tokens are produced
+
+        Generation runs on a background thread; closing the generator early stops it.
+
+        Args:
+            prompt: Prompt text
+            max_new_tokens: Maximum number of generated tokens
+            temperature: Sampling temperature; 0 selects greedy decoding
+            top_p: Nucleus sampling threshold when sampling
+            stop: Optional list of stop sequences; generation ends at the first one
+            stats: Optional dict that receives "input_tokens" and "output_tokens" when the stream ends
+
+        Yields:
+            str: Text increments of the completion, without the prompt
+        """
+        inputs = self.tokenizer(prompt, return_tensors="pt").to(self.device)
+        prompt_length = inputs["input_ids"].shape[-1]
+        # skip_prompt drops the prompt by token offset before anything is decoded
+        streamer = TextIteratorStreamer(self.tokenizer, skip_prompt=True, skip_special_tokens=True)
+        stop_event = threading.Event()
+        criteria = EventStoppingCriteria(stop_event, prompt_length)
+        errors = []
+
+        def generate():
+            try:
+                with self._lock, torch.no_grad():
+                    self.model.generate(
+                        **inputs,
+                        max_new_tokens=max_new_tokens,
+                        pad_token_id=self.tokenizer.pad_token_id,
+                        streamer=streamer,
+                        stopping_criteria=StoppingCriteriaList([criteria]),
+                        **self._sampling_kwargs(temperature, top_p)
+                    )
+            except Exception as e:
+                errors.append(e)
+                streamer.end()  # Unblock the consumer
+
+        thread = threading.Thread(target=generate, daemon=True)
+        thread.start()
+        # Hold back text that could be the start of a stop sequence until it is decided
+        holdback = max((len(s) for s in stop or []), default=1) - 1
+        pending = ""
+        finished = False
+        try:
+            for increment in streamer:
+                pending += increment
+                cut = min((pending.find(s) for s in stop or [] if s in pending), default=-1)
+                if cut >= 0:
+                    if pending[:cut]:
+                        yield pending[:cut]
+                    pending = ""
+                    break
+                if len(pending) > holdback:
+                    yield pending[:len(pending) - holdback]
+                    pending = pending[len(pending) - holdback:]
+            else:
+                finished = True
+                if pending:
+                    yield pending
+        finally:
+            stop_event.set()
+            if not finished:
+                for _ in streamer:  # Drain until generation has stopped and ended the stream
+                    pass
+            thread.join()
+            if stats is not None:
+                stats.update({"input_tokens": prompt_length, "output_tokens": criteria.generated_tokens})
+        if errors:
+            raise errors[0]
+
+    def complete(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, prefix=None):
+        """
+        Generate a completion with token accounting, used by the "local" LLM provider
+
+        Args:
+            prompt: Prompt text
+            max_new_tokens: Maximum number of generated tokens
+            temperature: Sampling temperature; 0 selects greedy decoding
+            top_p: Nucleus sampling threshold when sampling
+            stop: Optional list of stop sequences; the text is cut at the first one
+            prefix: Leading part of prompt (e.g. node behaviour text or conversation history) whose
+                key/value state is cached and reused by later calls with the same prefix
+
+        Returns:
+            dict: "text", "input_tokens", "output_tokens" and "cached_tokens" (prompt tokens not recomputed)
+        """
+        if not prefix or not prompt.startswith(prefix) or len(prompt) == len(prefix):
+            return self.complete_batch([prompt], max_new_tokens, temperature, top_p, [stop])[0]
+
+        # Encode prefix and remainder separately so the prefix tokens are identical on every call
+        prefix_ids = self.tokenizer(prefix)["input_ids"]
+        token_ids = prefix_ids + self.tokenizer(prompt[len(prefix):], add_special_tokens=False)["input_ids"]
+        if self.draft_model is not None and temperature <= 0:
+            return self._speculative_complete(token_ids, len(prefix_ids), max_new_tokens, stop)
+        return self._complete_tokens(token_ids, len(prefix_ids), max_new_tokens, temperature, top_p, stop)
+
+    def _complete_tokens(self, token_ids, prefix_length, max_new_tokens, temperature, top_p, stop):
+        """Generate from already tokenized input, reusing the cached state of token_ids[:prefix_length]"""
+        with self._lock, torch.no_grad():
+            input_ids = torch.tensor([token_ids], device=self.device)
+            past_key_values, cached_tokens = None, 0
+            if prefix_length > 0:
+                past_key_values, cached_tokens = self._prefix_state(token_ids, prefix_length)
+                past_key_values = copy.deepcopy(past_key_values)  # generate extends the cache in place
+            outputs = self.model.generate(
+                input_ids=input_ids,
+                attention_mask=torch.ones_like(input_ids),
+                past_key_values=past_key_values,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.pad_token_id,
+                **self._sampling_kwargs(temperature, top_p)
+            )
+        result = self._completion(outputs[0][len(token_ids):], max_new_tokens, stop, len(token_ids))
+        result["cached_tokens"] = cached_tokens
+        return result
+
+    def context_length(self):
+        """Maximum number of tokens (prompt plus output) the model can attend to"""
+        config = self.model.config
+        return getattr(config, "max_position_embeddings", None) or getattr(config, "n_positions", None) or 1024
+
+    def _prefix_state(self, token_ids, prefix_length):
+        """
+        Key/value state for token_ids[:prefix_length], extended from the longest cached prefix
+
+        Returns:
+            tuple: (past_key_values, number of prefix tokens that were already cached)
+        """
+        cached_length, past_key_values = self.prefix_cache.lookup(token_ids[:prefix_length])
+        if cached_length < prefix_length:
+            past_key_values = copy.deepcopy(past_key_values) if past_key_values is not None else DynamicCache()
+            self.model(input_ids=torch.tensor([token_ids[cached_length:prefix_length]], device=self.device),
+                       past_key_values=past_key_values, use_cache=True)
+            self.prefix_cache.store(token_ids[:prefix_length], past_key_values)
+        return past_key_values, cached_length
+
+    @staticmethod
+    def _sampling_kwargs(temperature, top_p):
+        if temperature > 0:
+            return {"do_sample": True, "temperature": temperature, "top_p": top_p}
+        return {"do_sample": False}
+
+    def _completion(self, new_tokens, limit, stop, input_tokens):
+        """Decode generated token ids, cut at the end of sequence and at stop sequences"""
+        new_tokens = new_tokens[:limit].tolist()
+        if self.tokenizer.eos_token_id in new_tokens:
+            new_tokens = new_tokens[:new_tokens.index(self.tokenizer.eos_token_id)]
+        text = self.tokenizer.decode(new_tokens, skip_special_tokens=True)
+        for sequence in stop or []:
+            text = text.split(sequence)[0]
+        return {"text": text.strip(), "input_tokens": input_tokens, "output_tokens": len(new_tokens),
+                "cached_tokens": 0}
+
+    def _speculative_complete(self, token_ids, prefix_length, max_new_tokens, stop):
+        """Greedy completion through speculative decoding, reusing the cached state of token_ids[:prefix_length]"""
+        with self._lock, torch.no_grad():
+            target_cache, cached_tokens = None, 0
+            if prefix_length > 0:
+                target_cache, cached_tokens = self._prefix_state(token_ids, prefix_length)
+                target_cache = copy.deepcopy(target_cache)  # Speculation extends the cache in place
+            new_tokens, proposed, accepted = self._speculative_generate(token_ids, max_new_tokens, target_cache)
+            self._draft_proposed += proposed
+            self._draft_accepted += accepted
+        result = self._completion(torch.tensor(new_tokens), max_new_tokens, stop, len(token_ids))
+        result.update({"cached_tokens": cached_tokens, "draft_tokens": proposed, "accepted_draft_tokens": accepted})
+        return result
+
+    def complete_batch(self, prompts, max_new_tokens=128, temperature=0.0, top_p=0.9, stops=None):
+        """
+        Generate completions for several prompts in one padded forward pass per step
+
+        Args:
+            prompts: List of prompt texts
+            max_new_tokens: Maximum generated tokens, either one int or one int per prompt
+            temperature: Sampling temperature shared by the batch; 0 selects greedy decoding
+            top_p: Nucleus sampling threshold shared by the batch
+            stops: Optional list with one list of stop sequences (or None) per prompt
+
+        Returns:
+            list: One dict with "text", "input_tokens" and "output_tokens" per prompt
+        """
+        limits = max_new_tokens if isinstance(max_new_tokens, (list, tuple)) else [max_new_tokens] * len(prompts)
+        stops = stops or [None] * len(prompts)
+        if self.draft_model is not None and len(prompts) == 1 and temperature <= 0:
+            # A single greedy prompt gains more from speculation than from batching
+            return [self._speculative_complete(self.tokenizer(prompts[0])["input_ids"], 0, limits[0], stops[0])]
+        inputs = self.tokenizer(prompts, return_tensors="pt", padding=True).to(self.device)
+        padded_length = inputs["input_ids"].shape[-1]
+        with self._lock, torch.no_grad():
+            outputs = self.model.generate(
+                **inputs,
+                max_new_tokens=max(limits),
+                pad_token_id=self.tokenizer.pad_token_id,
+                **self._sampling_kwargs(temperature, top_p)
+            )
+
+        # Strip the (left-padded) prompt by token offset, then the padding after an early end of sequence
+        return [self._completion(outputs[i][padded_length:], limit, stops[i], int(inputs["attention_mask"][i].sum()))
+                for i, limit in enumerate(limits)]
+
+    def chat(self, max_new_tokens=50):
         """Interactive chat mode"""
         print("\n=== Local LLM Chat ===")
         print("Type 'quit' to exit, 'clear' to clear memory")
         print("Type 'memory' to check GPU memory usage\n")
 
-        conversation_history = ""
+        context = ChatContext(self.tokenizer, self.context_length())
 
         while True:
             user_input = input("You: ").strip()
@@ -155,59 +625,388 @@ class LocalLLM:
             if user_input.lower() == 'quit':
                 break
             elif user_input.lower() == 'clear':
+                self.prefix_cache.clear()
                 clear_memory()
-                conversation_history = ""
+                context.clear()
                 print("Memory cleared!")
                 continue
             elif user_input.lower() == 'memory':
                 check_gpu_memory()
                 continue
 
-            # Build prompt with conversation history
-            if conversation_history:
-                prompt = f"{conversation_history}\nYou: {user_input}\nBot:"
-            else:
-                prompt = f"You: {user_input}\nBot:"
+            # Only the new turn is tokenized; older turns are dropped whole to leave room for the reply
+            context.add(f"\nYou: {user_input}\nBot:" if context.turns else f"You: {user_input}\nBot:")
+            context.fit(max_new_tokens)
+            token_ids = context.token_ids()
 
-            # Generate response
-            response = self.generate_text(prompt, max_length=len(prompt.split()) + 50)
+            # Generate response, reusing the cached key/value state of the unchanged history
+            response = self._complete_tokens(token_ids, len(token_ids) - len(context.turns[-1]), max_new_tokens,
+                                             temperature=0.7, top_p=0.9, stop=None)["text"]
 
             if response:
                 print(f"Bot: {response}")
-                conversation_history = prompt + " " + response
-
-                # Trim conversation history if it gets too long
-                if len(conversation_history.split()) > 200:
-                    conversation_history = " ".join(conversation_history.split()[-150:])
+                context.add(" " + response)
             else:
                 print("Bot: Sorry, I couldn't generate a response.")
 
 
+class ChatContext:
+    """Conversation kept as a list of tokenized turns with a running token count"""
+
+    def __init__(self, tokenizer, max_tokens):
+        """
+        Args:
+            tokenizer: Tokenizer of the chat model
+            max_tokens: Context length of the model
+        """
+        self.tokenizer = tokenizer
+        self.max_tokens = max_tokens
+        self.turns = deque()
+        self.token_count = 0
+
+    def add(self, text):
+        """Tokenize one turn and append it; earlier turns are never re-encoded"""
+        token_ids = self.tokenizer(text, add_special_tokens=False)["input_ids"]
+        self.turns.append(token_ids)
+        self.token_count += len(token_ids)
+        return token_ids
+
+    def fit(self, reserve_tokens):
+        """Drop the oldest whole turns until reserve_tokens more tokens fit into the context"""
+        # A reserve as large as the context still keeps the last token as the prompt
+        budget = max(1, self.max_tokens - reserve_tokens)
+        while self.token_count > budget and len(self.turns) > 1:
+            self.token_count -= len(self.turns.popleft())
+        if self.token_count > budget:  # A single turn longer than the context keeps its end
+            self.turns[0] = self.turns[0][-budget:]
+            self.token_count = len(self.turns[0])
+
+    def token_ids(self):
+        return [token for turn in self.turns for token in turn]
+
+    def clear(self):
+        self.turns.clear()
+        self.token_count = 0
+
+
+class GenerationRequest:
+    """A prompt waiting in a BatchScheduler together with the Future of its result"""
+
+    def __init__(self, prompt, max_new_tokens, temperature, top_p, stop, prefix=None):
+        self.prompt = prompt
+        self.prefix = prefix
+        self.max_new_tokens = max_new_tokens
+        self.temperature = temperature
+        self.top_p = top_p
+        self.stop = stop
+        self.future = Future()
+
+
+class SchedulerClosedError(RuntimeError):
+    """A request was submitted to a BatchScheduler that was closed, e.g. because its model was evicted"""
+
+
+class BatchScheduler:
+    """Collects concurrent generation requests for a LocalLLM and runs them as padded batches"""
+
+    def __init__(self, llm, max_batch_size=8, max_wait_ms=10.0):
+        """
+        Start the scheduler thread
+
+        Args:
+            llm: LocalLLM instance that serves the batches
+            max_batch_size: Maximum prompts generated together
+            max_wait_ms: How long the first request of a batch waits for others to join
+        """
+        self.llm = llm
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self._queue = queue.Queue()
+        self._closed = False
+        self._close_lock = threading.Lock()  # Keeps requests from being queued behind the stop sentinel
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+
+    def submit(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, prefix=None):
+        """Queue a prompt; returns a Future resolving to the LocalLLM.complete result"""
+        request = GenerationRequest(prompt, max_new_tokens, temperature, top_p, stop, prefix)
+        with self._close_lock:
+            if self._closed:
+                raise SchedulerClosedError(f"BatchScheduler of {self.llm.model_name} is closed")
+            self._queue.put(request)
+        return request.future
+
+    def complete(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, prefix=None):
+        """Blocking variant of submit with the same signature as LocalLLM.complete"""
+        return self.submit(prompt, max_new_tokens, temperature, top_p, stop, prefix).result()
+
+    def close(self):
+        """Stop the scheduler thread after the queued requests are served; later submits raise SchedulerClosedError"""
+        with self._close_lock:
+            if self._closed:
+                return
+            self._closed = True
+            self._queue.put(None)
+        self._thread.join()
+
+    def _collect(self):
+        first = self._queue.get()
+        if first is None:
+            return None
+        batch = [first]
+        deadline = time.monotonic() + self.max_wait_ms / 1000
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                item = self._queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                self._queue.put(None)  # Serve this batch, stop on the next round
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            if batch is None:
+                self._fail_queued()
+                return
+            # Requests withdrawn by their caller (e.g. past their deadline) are not generated
+            batch = [request for request in batch if request.future.set_running_or_notify_cancel()]
+            # Sampling settings apply to the whole generate call, so batch only compatible requests.
+            # Concurrent requests are batched on their full prompts; a request alone in its group
+            # goes through complete(), which reuses its cached prefix and speculates when it can.
+            groups = {}
+            for request in batch:
+                groups.setdefault((request.temperature, request.top_p), []).append(request)
+            for (temperature, top_p), group in groups.items():
+                if len(group) == 1:
+                    request = group[0]
+                    try:
+                        request.future.set_result(self.llm.complete(request.prompt, request.max_new_tokens,
+                                                                    temperature, top_p, request.stop, request.prefix))
+                    except Exception as e:
+                        request.future.set_exception(e)
+                    continue
+                try:
+                    results = self.llm.complete_batch([r.prompt for r in group], [r.max_new_tokens for r in group],
+                                                      temperature, top_p, [r.stop for r in group])
+                except Exception as e:
+                    for request in group:
+                        request.future.set_exception(e)
+                    continue
+                for request, result in zip(group, results):
+                    request.future.set_result(result)
+
+    def _fail_queued(self):
+        """Fail requests left behind the stop sentinel so their callers do not wait forever"""
+        while True:
+            try:
+                request = self._queue.get_nowait()
+            except queue.Empty:
+                return
+            if request is not None and request.future.set_running_or_notify_cancel():
+                request.future.set_exception(SchedulerClosedError(f"BatchScheduler of {self.llm.model_name} is closed"))
+
+
+# Models used by main() and the benchmark suite, all GPT-2 tokenizer family
+MODELS = [
+    "distilgpt2",  # Very lightweight
+    "gpt2",  # Small
+    "microsoft/DialoGPT-medium",  # Good for chat
+    "EleutherAI/gpt-neo-1.3B",  # Larger, more capable
+    "microsoft/DialoGPT-large",  # Large chat model
+    "microsoft/phi-2"
+]
+
+
+class ModelRegistry:
+    """
+    Loads LocalLLM instances on first use and shares one instance per configuration
+
+    Each model's resident size is tracked; when the total exceeds the memory budget the least
+    recently used models are evicted. Load and eviction timings are kept in events().
+    """
+
+    def __init__(self, memory_budget_mb=None, max_events=100):
+        """
+        Args:
+            memory_budget_mb: Total size of resident models in MB; None reads LLMTSUP_MODEL_MEMORY_MB
+                and is unlimited if that is not set
+            max_events: Number of load/evict events kept for reporting
+        """
+        if memory_budget_mb is None and os.environ.get("LLMTSUP_MODEL_MEMORY_MB"):
+            memory_budget_mb = float(os.environ["LLMTSUP_MODEL_MEMORY_MB"])
+        self.memory_budget_mb = memory_budget_mb
+        self._lock = threading.Lock()
+        self._load_locks = {}  # Serializes loading of the same model without blocking other models
+        self._entries = OrderedDict()  # key -> entry dict, least recently used first
+        self._events = deque(maxlen=max_events)
+
+    @staticmethod
+    def _key(model_name, device, llm_kwargs):
+        return (model_name, device, tuple(sorted(llm_kwargs.items())))
+
+    def get(self, model_name="distilgpt2", device="cpu", **llm_kwargs):
+        """Return the shared LocalLLM for this configuration, loading it on first use"""
+        key = self._key(model_name, device, llm_kwargs)
+        while True:
+            entry = self._entry(model_name, device, llm_kwargs)
+            with self._lock:
+                # An entry evicted by another caller in the meantime has been cleared; load it again
+                if self._entries.get(key) is entry:
+                    return entry["llm"]
+
+    def scheduler(self, model_name="distilgpt2", device="cpu", max_batch_size=8, max_wait_ms=10.0, **llm_kwargs):
+        """
+        Return the shared BatchScheduler of a model
+
+        It is closed when the model is evicted; callers that get SchedulerClosedError from it
+        should ask the registry again.
+        """
+        key = self._key(model_name, device, llm_kwargs)
+        while True:
+            entry = self._entry(model_name, device, llm_kwargs)
+            with self._lock:
+                if self._entries.get(key) is not entry:  # Evicted in the meantime, see get()
+                    continue
+                if entry["scheduler"] is None:
+                    entry["scheduler"] = BatchScheduler(entry["llm"], max_batch_size, max_wait_ms)
+                return entry["scheduler"]
+
+    def _entry(self, model_name, device, llm_kwargs):
+        key = self._key(model_name, device, llm_kwargs)
+        with self._lock:
+            if key in self._entries:
+                return self._touch(key)
+            load_lock = self._load_locks.setdefault(key, threading.Lock())
+
+        with load_lock:
+            with self._lock:
+                if key in self._entries:  # Loaded by a concurrent caller
+                    return self._touch(key)
+            start = time.perf_counter()
+            llm = LocalLLM(model_name, device=device, **llm_kwargs)
+            load_time = time.perf_counter() - start
+            size = model_nbytes(llm.model) + (model_nbytes(llm.draft_model) if llm.draft_model is not None else 0)
+            entry = {"llm": llm, "scheduler": None, "size_bytes": size, "load_time": load_time,
+                     "uses": 0, "last_used": time.time()}
+            self._record("load", model_name, load_time, size)
+            print(f"Loaded model {model_name} in {load_time:.2f}s ({size / 1024 ** 2:.1f} MB)")
+            with self._lock:
+                self._entries[key] = entry
+                self._touch(key)
+                evicted = self._over_budget(keep=key)
+            for evicted_key, evicted_entry in evicted:
+                self._evict(evicted_key, evicted_entry)
+            return entry
+
+    def _touch(self, key):
+        entry = self._entries[key]
+        self._entries.move_to_end(key)
+        entry["uses"] += 1
+        entry["last_used"] = time.time()
+        return entry
+
+    def _over_budget(self, keep):
+        """Remove least recently used entries until the budget holds; returns them for eviction"""
+        evicted = []
+        if self.memory_budget_mb is None:
+            return evicted
+        budget = self.memory_budget_mb * 1024 ** 2
+        for key in list(self._entries):
+            if self.resident_bytes() <= budget:
+                break
+            if key != keep:
+                evicted.append((key, self._entries.pop(key)))
+        if self.resident_bytes() > budget:
+            print(f"Model {keep[0]} alone exceeds the memory budget of {self.memory_budget_mb} MB")
+        return evicted
+
+    def _evict(self, key, entry):
+        start = time.perf_counter()
+        size = entry["size_bytes"]
+        if entry["scheduler"] is not None:
+            entry["scheduler"].close()  # Serves the queued requests first
+        entry.clear()  # Callers still holding the model keep it alive until they finish
+        clear_memory()
+        try:
+            ctypes.CDLL("libc.so.6").malloc_trim(0)  # Return freed heap pages to the OS on Linux
+        except (OSError, AttributeError):
+            pass
+        evict_time = time.perf_counter() - start
+        self._record("evict", key[0], evict_time, size)
+        print(f"Evicted model {key[0]} in {evict_time:.2f}s ({size / 1024 ** 2:.1f} MB)")
+
+    def evict(self, model_name, device="cpu", **llm_kwargs):
+        """Unload a model explicitly; returns False if it was not loaded"""
+        key = self._key(model_name, device, llm_kwargs)
+        with self._lock:
+            entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        self._evict(key, entry)
+        return True
+
+    def _record(self, event, model_name, seconds, size):
+        self._events.append({"event": event, "model": model_name, "seconds": round(seconds, 4),
+                             "size_mb": round(size / 1024 ** 2, 1),
+                             "time": time.time()})
+
+    def resident_bytes(self):
+        return sum(entry["size_bytes"] for entry in self._entries.values())
+
+    def events(self):
+        """Recent load and evict events with their durations"""
+        return list(self._events)
+
+    def stats(self):
+        """Budget, resident models (least recently used first) and load/evict timing summary"""
+        with self._lock:
+            models = [{"model": key[0], "device": key[1], "options": dict(key[2]),
+                       "size_mb": round(entry["size_bytes"] / 1024 ** 2, 1),
+                       "load_time_s": round(entry["load_time"], 3), "uses": entry["uses"],
+                       "idle_s": round(time.time() - entry["last_used"], 1)}
+                      for key, entry in self._entries.items()]
+            resident = self.resident_bytes()
+        events = self.events()
+        loads = [e["seconds"] for e in events if e["event"] == "load"]
+        evictions = [e["seconds"] for e in events if e["event"] == "evict"]
+        return {
+            "memory_budget_mb": self.memory_budget_mb,
+            "resident_mb": round(resident / 1024 ** 2, 1),
+            "models": models,
+            "loads": len(loads),
+            "avg_load_s": round(sum(loads) / len(loads), 4) if loads else None,
+            "evictions": len(evictions),
+            "avg_evict_s": round(sum(evictions) / len(evictions), 4) if evictions else None,
+        }
+
+
+# Shared registry used by the "local" LLM provider
+model_registry = ModelRegistry()
+
+
 def main():
     """Main function to run the LLM"""
 
-    # Check if CUDA is available
-    if not torch.cuda.is_available():
-        print("CUDA is not available. Make sure you have:")
-        print("1. NVIDIA drivers installed")
-        print("2. PyTorch with CUDA support installed")
-        return
-
     print("Available models for RTX 3060:")
-    models = [
-        "distilgpt2",  # Very lightweight
-        "gpt2",  # Small
-        "microsoft/DialoGPT-medium",  # Good for chat
-        "EleutherAI/gpt-neo-1.3B",  # Larger, more capable
-        "microsoft/DialoGPT-large",  # Large chat model
-        "microsoft/phi-2"
-    ]
+    models = MODELS
 
     for i, model in enumerate(models, 1):
         print(f"{i}. {model}")
 
     # Let user choose model
     selected_model=models[5]
+    # Check if CUDA is available
+    if not torch.cuda.is_available():
+        print("CUDA is not available, running the smallest model on the CPU")
+        print("For CPU measurements across models run: python localllm_benchmark.py --suite")
+        selected_model = models[0]
     try:
         # Initialize the LLM
         llm = LocalLLM(selected_model)
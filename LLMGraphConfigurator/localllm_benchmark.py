@@ -0,0 +1,455 @@
+"""
+Benchmark CPU quantization modes of LocalLLM against the float32 baseline
+
+Each mode is loaded in a fresh process so resident memory is measured per model.
+Reported per mode: load time, generation tokens/sec, resident memory and output
+drift against float32 (greedy output agreement and next-token KL divergence).
+
+With --draft-model, speculative decoding is benchmarked instead: tokens/sec of the
+target model with and without the draft model, and the draft acceptance rate.
+
+With --suite, a fixed prompt set runs across models x quantization x thread count
+(one fresh process each) x batch size x max new tokens, recording load time, time to
+first token, tokens/sec and peak RSS. --compare checks a run against a baseline run
+and exits with status 1 on regressions.
+
+Usage:
+    python localllm_benchmark.py --model microsoft/phi-2 --output quantization.json
+    python localllm_benchmark.py --model gpt2 --draft-model distilgpt2
+    python localllm_benchmark.py --suite --models distilgpt2 gpt2 --batch-sizes 1 4 --threads 2 4 --output run.json
+    python localllm_benchmark.py --compare baseline.json run.json --threshold 0.1
+"""
+import argparse
+import json
+import multiprocessing
+import platform
+import statistics
+import sys
+import threading
+import time
+from datetime import datetime
+from concurrent.futures import ProcessPoolExecutor
+
+DEFAULT_PROMPTS = [
+    "The maintenance procedure for the hydraulic pump starts with",
+    "Question: Which tool is needed to remove the front panel?\nAnswer:",
+    "Safety instructions: before opening the housing,",
+    "Summary of the inspection report:",
+]
+
+
+def rss_mb():
+    """Resident memory of this process in MB"""
+    import psutil
+    return psutil.Process().memory_info().rss / 1024 ** 2
+
+
+def run_mode(model_name, quantization, prompts, max_new_tokens, threads=None):
+    """
+    Load one quantization mode and measure it; runs inside a worker process
+
+    Returns:
+        dict: Measurements plus generated token ids and next-token log-probabilities for drift
+    """
+    import torch
+    from localllm import LocalLLM
+
+    if threads:
+        torch.set_num_threads(threads)
+    rss_before = rss_mb()
+    start = time.perf_counter()
+    llm = LocalLLM(model_name, device="cpu", quantization=quantization)
+    load_time = time.perf_counter() - start
+    rss_model = rss_mb() - rss_before
+
+    # Next-token distribution of each prompt, used to measure drift independently of decoding
+    log_probs = []
+    with torch.no_grad():
+        for prompt in prompts:
+            inputs = llm.tokenizer(prompt, return_tensors="pt")
+            logits = llm.model(**inputs).logits[0, -1].float()
+            log_probs.append(torch.log_softmax(logits, dim=-1).tolist())
+
+    llm.complete(prompts[0], max_new_tokens=4)  # Warm-up
+    outputs = []
+    generated = 0
+    start = time.perf_counter()
+    for prompt in prompts:
+        inputs = llm.tokenizer(prompt, return_tensors="pt")
+        with torch.no_grad():
+            tokens = llm.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                        pad_token_id=llm.tokenizer.pad_token_id)
+        new_tokens = tokens[0][inputs["input_ids"].shape[-1]:].tolist()
+        outputs.append(new_tokens)
+        generated += len(new_tokens)
+    elapsed = time.perf_counter() - start
+
+    return {
+        "model": model_name,
+        "quantization": quantization or "fp32",
+        "load_time_s": round(load_time, 3),
+        "tokens_per_sec": round(generated / elapsed, 2),
+        "rss_model_mb": round(rss_model, 1),
+        "rss_peak_mb": round(rss_mb(), 1),
+        "outputs": outputs,
+        "log_probs": log_probs,
+    }
+
+
+def drift(baseline, result):
+    """
+    Output drift of a quantized run against the float32 baseline
+
+    Returns:
+        dict: exact_match (share of prompts with identical greedy output), token_agreement
+            (share of generated positions matching up to the first divergence), top1_agreement and
+            mean_kl of the next-token distributions
+    """
+    import math
+
+    exact = 0
+    agreeing = 0
+    total = 0
+    for base_tokens, tokens in zip(baseline["outputs"], result["outputs"]):
+        exact += base_tokens == tokens
+        prefix = 0
+        for a, b in zip(base_tokens, tokens):
+            if a != b:
+                break
+            prefix += 1
+        agreeing += prefix
+        total += max(len(base_tokens), 1)
+
+    top1 = 0
+    kl_total = 0.0
+    for base_lp, lp in zip(baseline["log_probs"], result["log_probs"]):
+        top1 += base_lp.index(max(base_lp)) == lp.index(max(lp))
+        kl_total += sum(math.exp(p) * (p - q) for p, q in zip(base_lp, lp))
+
+    count = len(baseline["outputs"])
+    return {
+        "exact_match": round(exact / count, 3),
+        "token_agreement": round(agreeing / total, 3),
+        "top1_agreement": round(top1 / count, 3),
+        "mean_kl": round(kl_total / count, 5),
+    }
+
+
+def benchmark(model_name, modes=(None, "int8", "bf16"), prompts=None, max_new_tokens=32, threads=None):
+    """
+    Benchmark the given quantization modes; the float32 baseline is always included
+
+    Returns:
+        list: One result dict per mode, without raw outputs
+    """
+    prompts = prompts or DEFAULT_PROMPTS
+    modes = [None] + [m for m in modes if m is not None]
+    results = []
+    context = multiprocessing.get_context("spawn")
+    for mode in modes:
+        with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+            results.append(pool.submit(run_mode, model_name, mode, prompts, max_new_tokens, threads).result())
+
+    baseline = results[0]
+    for result in results:
+        result["drift"] = drift(baseline, result)
+    return [{k: v for k, v in r.items() if k not in ("outputs", "log_probs")} for r in results]
+
+
+def benchmark_speculative(model_name, draft_model_name, prompts=None, max_new_tokens=32, num_draft_tokens=4,
+                          quantization=None, threads=None):
+    """
+    Compare greedy generation of the target model with and without speculative decoding
+
+    Returns:
+        dict: tokens/sec of both runs, speedup, acceptance rate and whether the outputs match
+    """
+    import torch
+    from localllm import LocalLLM
+
+    if threads:
+        torch.set_num_threads(threads)
+    prompts = prompts or DEFAULT_PROMPTS
+    llm = LocalLLM(model_name, device="cpu", quantization=quantization, draft_model_name=draft_model_name,
+                   num_draft_tokens=num_draft_tokens)
+
+    def run():
+        llm.complete(prompts[0], max_new_tokens=4)  # Warm-up
+        outputs = []
+        start = time.perf_counter()
+        for prompt in prompts:
+            outputs.append(llm.complete(prompt, max_new_tokens=max_new_tokens))
+        elapsed = time.perf_counter() - start
+        return outputs, sum(o["output_tokens"] for o in outputs) / elapsed
+
+    draft_model = llm.draft_model
+    llm.draft_model = None
+    baseline, baseline_rate = run()
+    llm.draft_model = draft_model
+    speculative, speculative_rate = run()
+    stats = llm.speculative_stats()
+
+    return {
+        "model": model_name,
+        "draft_model": draft_model_name,
+        "num_draft_tokens": num_draft_tokens,
+        "tokens_per_sec": round(baseline_rate, 2),
+        "speculative_tokens_per_sec": round(speculative_rate, 2),
+        "speedup": round(speculative_rate / baseline_rate, 3),
+        "acceptance_rate": stats["acceptance_rate"],
+        "outputs_match": all(a["text"] == b["text"] for a, b in zip(baseline, speculative)),
+    }
+
+
+class PeakRSS:
+    """Samples resident memory on a background thread and keeps the peak, used as a context manager"""
+
+    def __init__(self, interval=0.01):
+        self.interval = interval
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+
+    def _sample(self):
+        while not self._stop.is_set():
+            self.peak_mb = max(self.peak_mb, rss_mb())
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self.peak_mb = rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, rss_mb())
+
+
+class FirstTokenTimer:
+    """Minimal generate() streamer that records when the first new tokens arrive, for any batch size"""
+
+    def __init__(self):
+        self.calls = 0
+        self.first_token_time = None
+
+    def put(self, value):
+        self.calls += 1
+        if self.calls == 2 and self.first_token_time is None:  # The first call carries the prompt
+            self.first_token_time = time.perf_counter()
+
+    def end(self):
+        pass
+
+
+def run_suite_config(model_name, quantization, threads, batch_sizes, max_new_tokens_list, prompts, repeats):
+    """
+    Benchmark one model configuration in this (fresh) process across batch sizes and output lengths
+
+    Returns:
+        list: One result dict per (batch size, max new tokens) case
+    """
+    import torch
+    from localllm import LocalLLM
+
+    if threads:
+        torch.set_num_threads(threads)
+    with PeakRSS() as load_rss:
+        start = time.perf_counter()
+        llm = LocalLLM(model_name, device="cpu", quantization=quantization)
+        load_time = time.perf_counter() - start
+
+    results = []
+    for batch_size in batch_sizes:
+        batch = [prompts[i % len(prompts)] for i in range(batch_size)]
+        inputs = llm.tokenizer(batch, return_tensors="pt", padding=True)
+        prompt_length = inputs["input_ids"].shape[-1]
+        for max_new_tokens in max_new_tokens_list:
+            with torch.no_grad():
+                llm.model.generate(**inputs, max_new_tokens=2, do_sample=False,
+                                   pad_token_id=llm.tokenizer.pad_token_id)  # Warm-up
+            ttfts, rates = [], []
+            with PeakRSS() as peak:
+                for _ in range(repeats):
+                    timer = FirstTokenTimer()
+                    start = time.perf_counter()
+                    with torch.no_grad():
+                        outputs = llm.model.generate(**inputs, max_new_tokens=max_new_tokens, do_sample=False,
+                                                     pad_token_id=llm.tokenizer.pad_token_id, streamer=timer)
+                    elapsed = time.perf_counter() - start
+                    generated = 0
+                    for row in outputs[:, prompt_length:].tolist():
+                        eos = llm.tokenizer.eos_token_id
+                        generated += row.index(eos) if eos in row else len(row)
+                    ttfts.append((timer.first_token_time or time.perf_counter()) - start)
+                    rates.append(generated / elapsed)
+            results.append({
+                "model": model_name,
+                "quantization": quantization or "fp32",
+                "threads": threads or torch.get_num_threads(),
+                "batch_size": batch_size,
+                "max_new_tokens": max_new_tokens,
+                "load_time_s": round(load_time, 3),
+                "ttft_s": round(statistics.median(ttfts), 4),
+                "tokens_per_sec": round(statistics.median(rates), 2),
+                "peak_rss_mb": round(max(load_rss.peak_mb, peak.peak_mb), 1),
+            })
+    return results
+
+
+def run_suite(models, quantizations=(None,), threads_list=(None,), batch_sizes=(1,), max_new_tokens_list=(32,),
+              prompts=None, repeats=3):
+    """
+    Run the benchmark matrix; each model/quantization/threads configuration loads in a fresh process
+
+    Returns:
+        dict: "created", "machine" and "results" (one entry per case, see run_suite_config)
+    """
+    import torch
+
+    prompts = prompts or DEFAULT_PROMPTS
+    context = multiprocessing.get_context("spawn")
+    results = []
+    for model_name in models:
+        for quantization in quantizations:
+            for threads in threads_list:
+                print(f"Benchmarking {model_name} ({quantization or 'fp32'}, threads={threads or 'default'})")
+                with ProcessPoolExecutor(max_workers=1, mp_context=context) as pool:
+                    try:
+                        results += pool.submit(run_suite_config, model_name, quantization, threads, list(batch_sizes),
+                                               list(max_new_tokens_list), prompts, repeats).result()
+                    except Exception as e:
+                        print(f"Skipping {model_name}: {e}")
+    return {
+        "created": datetime.now().isoformat(timespec="seconds"),
+        "machine": {"platform": platform.platform(), "processor": platform.processor(),
+                    "cpu_count": multiprocessing.cpu_count(), "python": platform.python_version(),
+                    "torch": torch.__version__},
+        "results": results,
+    }
+
+
+# Metric name -> True if higher is better
+SUITE_METRICS = {"tokens_per_sec": True, "ttft_s": False, "load_time_s": False, "peak_rss_mb": False}
+SUITE_KEY = ("model", "quantization", "threads", "batch_size", "max_new_tokens")
+
+
+def compare_runs(baseline, current, threshold=0.1):
+    """
+    Compare two suite runs case by case
+
+    Args:
+        baseline: Earlier run_suite result
+        current: New run_suite result
+        threshold: Relative change in the worse direction that counts as a regression
+
+    Returns:
+        list: One dict per case present in both runs with per-metric changes and "regressions"
+    """
+    baseline_cases = {tuple(r[k] for k in SUITE_KEY): r for r in baseline["results"]}
+    comparisons = []
+    for result in current["results"]:
+        key = tuple(result[k] for k in SUITE_KEY)
+        if key not in baseline_cases:
+            continue
+        before = baseline_cases[key]
+        changes = {}
+        regressions = []
+        for metric, higher_is_better in SUITE_METRICS.items():
+            if not before.get(metric):
+                continue
+            change = (result[metric] - before[metric]) / before[metric]
+            changes[metric] = round(change, 4)
+            if (-change if higher_is_better else change) > threshold:
+                regressions.append(metric)
+        comparisons.append({**dict(zip(SUITE_KEY, key)), "changes": changes, "regressions": regressions})
+    return comparisons
+
+
+def print_suite(run):
+    print(f"{'model':<28} {'quant':<5} {'thr':>3} {'batch':>5} {'new':>4} {'load s':>7} {'ttft s':>7} "
+          f"{'tok/s':>8} {'peak MB':>8}")
+    for r in run["results"]:
+        print(f"{r['model'][-28:]:<28} {r['quantization']:<5} {r['threads']:>3} {r['batch_size']:>5} "
+              f"{r['max_new_tokens']:>4} {r['load_time_s']:>7} {r['ttft_s']:>7} {r['tokens_per_sec']:>8} "
+              f"{r['peak_rss_mb']:>8}")
+
+
+def print_comparison(comparisons):
+    for c in comparisons:
+        changes = ", ".join(f"{metric} {change:+.1%}" for metric, change in c["changes"].items())
+        status = "REGRESSION " + ", ".join(c["regressions"]) if c["regressions"] else "ok"
+        print(f"{c['model']} {c['quantization']} threads={c['threads']} batch={c['batch_size']} "
+              f"new={c['max_new_tokens']}: {changes} -> {status}")
+
+
+def print_table(results):
+    print(f"{'mode':<6} {'load s':>8} {'tok/s':>8} {'model MB':>9} {'peak MB':>8} {'exact':>6} {'top1':>6} {'KL':>9}")
+    for r in results:
+        d = r["drift"]
+        print(f"{r['quantization']:<6} {r['load_time_s']:>8} {r['tokens_per_sec']:>8} {r['rss_model_mb']:>9} "
+              f"{r['rss_peak_mb']:>8} {d['exact_match']:>6} {d['top1_agreement']:>6} {d['mean_kl']:>9}")
+
+
+def main():
+    from localllm import MODELS
+
+    parser = argparse.ArgumentParser(description="Benchmark LocalLLM on the CPU")
+    parser.add_argument("--model", default="distilgpt2", help="Hugging Face model id or local path")
+    parser.add_argument("--modes", nargs="+", default=["int8", "bf16"], choices=["int8", "bf16"],
+                        help="Quantization modes compared against float32")
+    parser.add_argument("--max-new-tokens", type=int, nargs="+", default=[32],
+                        help="Output lengths; all are used with --suite, otherwise the first")
+    parser.add_argument("--threads", type=int, nargs="+", default=[None],
+                        help="torch CPU threads; all are used with --suite, otherwise the first")
+    parser.add_argument("--prompts", help="Text file with one prompt per line")
+    parser.add_argument("--draft-model", help="Benchmark speculative decoding with this draft model instead")
+    parser.add_argument("--num-draft-tokens", type=int, default=4)
+    parser.add_argument("--suite", action="store_true", help="Run the models x settings benchmark matrix")
+    parser.add_argument("--models", nargs="+", default=MODELS, help="Models for --suite")
+    parser.add_argument("--quantizations", nargs="+", default=["none"], choices=["none", "int8", "bf16"],
+                        help="Quantization modes for --suite")
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1], help="Batch sizes for --suite")
+    parser.add_argument("--repeats", type=int, default=3, help="Timed generations per --suite case")
+    parser.add_argument("--compare", nargs=2, metavar=("BASELINE", "CURRENT"),
+                        help="Compare two --suite JSON runs and report regressions")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Relative change counted as a regression")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    args = parser.parse_args()
+
+    if args.compare:
+        runs = []
+        for path in args.compare:
+            with open(path, encoding="utf-8") as f:
+                runs.append(json.load(f))
+        comparisons = compare_runs(runs[0], runs[1], args.threshold)
+        print_comparison(comparisons)
+        regressions = sum(bool(c["regressions"]) for c in comparisons)
+        print(f"{len(comparisons)} cases compared, {regressions} with regressions")
+        sys.exit(1 if regressions else 0)
+
+    prompts = None
+    if args.prompts:
+        with open(args.prompts, encoding="utf-8") as f:
+            prompts = [line.strip() for line in f if line.strip()]
+
+    if args.suite:
+        results = run_suite(args.models, [None if q == "none" else q for q in args.quantizations], args.threads,
+                            args.batch_sizes, args.max_new_tokens, prompts, args.repeats)
+        print_suite(results)
+    elif args.draft_model:
+        results = benchmark_speculative(args.model, args.draft_model, prompts, args.max_new_tokens[0],
+                                        args.num_draft_tokens, threads=args.threads[0])
+        for key, value in results.items():
+            print(f"{key}: {value}")
+    else:
+        results = benchmark(args.model, args.modes, prompts, args.max_new_tokens[0], args.threads[0])
+        print_table(results)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
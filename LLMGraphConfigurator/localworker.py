@@ -0,0 +1,359 @@
+"""
+Out-of-process model serving for LocalLLM
+
+Each worker process owns a loaded LocalLLM and serves generation jobs from its own
+queue, so tokenization, generation and decoding do not compete with the server's
+request threads for the GIL, and a crashing model does not take the server down.
+Prompts and replies above a size threshold travel through shared memory instead of
+being pickled through the queue. Dead workers are restarted automatically, with
+exponential backoff and up to max_restarts times in a row; their in-flight jobs fail
+with WorkerCrashedError. A stream whose consumer stops iterating
+is cancelled in its worker, so generation does not run on to max_new_tokens.
+"""
+import os
+import time
+import queue
+import atexit
+import itertools
+import threading
+import multiprocessing
+from concurrent.futures import Future
+from multiprocessing import shared_memory
+
+# Payloads larger than this (in bytes) are passed through shared memory
+SHM_THRESHOLD = 64 * 1024
+# Longest wait in seconds before a crashed worker is started again
+MAX_RESTART_BACKOFF = 30.0
+
+
+class WorkerCrashedError(RuntimeError):
+    """A worker process died while serving a job"""
+
+
+def _pack(text, threshold):
+    """Queue representation of a text: inline, or the name and size of a shared memory block"""
+    data = text.encode("utf-8")
+    if len(data) <= threshold:
+        return ("inline", text)
+    block = shared_memory.SharedMemory(create=True, size=len(data))
+    block.buf[:len(data)] = data
+    name = block.name
+    block.close()
+    return ("shm", name, len(data))
+
+
+def _unpack(payload, unlink=False):
+    """Read a packed text; unlink frees the shared memory block once the reader owns it"""
+    if payload[0] == "inline":
+        return payload[1]
+    _, name, size = payload
+    block = shared_memory.SharedMemory(name=name)
+    text = bytes(block.buf[:size]).decode("utf-8")
+    block.close()
+    if unlink:
+        block.unlink()
+    return text
+
+
+def _release(payload):
+    """Free the shared memory block of a packed text that was not consumed"""
+    if payload[0] == "shm":
+        try:
+            block = shared_memory.SharedMemory(name=payload[1])
+            block.close()
+            block.unlink()
+        except FileNotFoundError:
+            pass
+
+
+def _worker_main(index, model_name, device, llm_kwargs, threads, max_batch_size, max_wait_ms,
+                 shm_threshold, jobs, results):
+    """Worker process: load the model, then serve jobs until a None job arrives"""
+    import torch
+    from localllm import LocalLLM, BatchScheduler
+
+    if threads:
+        torch.set_num_threads(threads)
+    llm = LocalLLM(model_name, device=device, **llm_kwargs)
+    scheduler = BatchScheduler(llm, max_batch_size, max_wait_ms) if max_batch_size > 1 else None
+    results.put(("ready", index, os.getpid()))
+
+    def finish(job_id, future):
+        try:
+            result = future.result()
+            result["text"] = _pack(result["text"], shm_threshold)
+            results.put(("done", job_id, result))
+        except Exception as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+
+    cancels = {}  # job id -> Event set when the consumer of a stream went away
+
+    def stream(job_id, prompt, kwargs, cancelled):
+        try:
+            stats = {}
+            increments = llm.stream_text(prompt, stats=stats, **kwargs)
+            for increment in increments:
+                if cancelled.is_set():
+                    increments.close()  # Stops the generation thread
+                    return
+                results.put(("chunk", job_id, increment))
+            results.put(("done", job_id, stats))
+        except Exception as e:
+            results.put(("error", job_id, f"{type(e).__name__}: {e}"))
+        finally:
+            cancels.pop(job_id, None)
+
+    while True:
+        job = jobs.get()
+        if job is None:
+            break
+        job_id, kind, payload, kwargs = job
+        if kind == "cancel":
+            if job_id in cancels:
+                cancels[job_id].set()
+            continue
+        prompt = _unpack(payload)
+        if kind == "stream":
+            cancels[job_id] = threading.Event()
+            threading.Thread(target=stream, args=(job_id, prompt, kwargs, cancels[job_id]), daemon=True).start()
+            continue
+        if scheduler is not None:
+            future = scheduler.submit(prompt, **kwargs)
+        else:
+            future = Future()
+            try:
+                future.set_result(llm.complete(prompt, **kwargs))
+            except Exception as e:
+                future.set_exception(e)
+        future.add_done_callback(lambda f, job_id=job_id: finish(job_id, f))
+    if scheduler is not None:
+        scheduler.close()
+
+
+class WorkerPool:
+    """Pool of model worker processes with the generation interface of LocalLLM"""
+
+    def __init__(self, model_name="distilgpt2", device="cpu", num_workers=1, quantization=None,
+                 threads_per_worker=None, max_batch_size=8, max_wait_ms=10.0, shm_threshold=SHM_THRESHOLD,
+                 monitor_interval=0.5, max_restarts=5, **llm_kwargs):
+        """
+        Start the worker processes; each loads its own copy of the model
+
+        Args:
+            model_name: Hugging Face model id or local path
+            device: "cpu" or "cuda"
+            num_workers: Number of worker processes
+            quantization: CPU weight format passed to LocalLLM
+            threads_per_worker: torch threads per worker; defaults to the CPU cores split across workers
+            max_batch_size: Concurrent jobs a worker generates together; 1 disables batching
+            max_wait_ms: How long a job waits for others to join its batch
+            shm_threshold: Prompts and replies larger than this many bytes use shared memory
+            monitor_interval: Seconds between liveness checks of the workers, and the first restart delay
+            max_restarts: Restarts of a worker that crashes again before it is ready; after that the
+                worker is given up and its jobs fail with WorkerCrashedError
+            **llm_kwargs: Further LocalLLM arguments, e.g. draft_model_name
+        """
+        self.model_name = model_name
+        self.device = device
+        self.llm_kwargs = dict(llm_kwargs, quantization=quantization)
+        self.threads_per_worker = threads_per_worker or max(1, (os.cpu_count() or 1) // num_workers)
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.shm_threshold = shm_threshold
+        self.monitor_interval = monitor_interval
+        self.max_restarts = max_restarts
+        self.restarts = 0
+
+        # Spawn keeps CUDA and the server's threads out of the workers
+        self._context = multiprocessing.get_context("spawn")
+        self._results = self._context.Queue()
+        self._lock = threading.Lock()
+        self._job_ids = itertools.count()
+        self._pending = {}  # job id -> (worker index, Future or stream queue, packed prompt)
+        self._workers = [None] * num_workers
+        self._queues = [None] * num_workers
+        self._failures = [0] * num_workers  # Crashes since the worker was last ready
+        self._restart_at = {}  # worker index -> time.monotonic() of its next start
+        self._retired = set()  # Workers given up after max_restarts
+        self._closed = False
+        for index in range(num_workers):
+            self._queues[index] = self._context.Queue()
+            self._workers[index] = self._start_worker(index)
+
+        self._collector = threading.Thread(target=self._collect_results, daemon=True)
+        self._collector.start()
+        self._monitor = threading.Thread(target=self._monitor_workers, daemon=True)
+        self._monitor.start()
+        atexit.register(self.close)
+
+    def _start_worker(self, index):
+        """Start a worker process on the current job queue of index; called without holding the lock"""
+        process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.model_name, self.device, self.llm_kwargs, self.threads_per_worker,
+                  self.max_batch_size, self.max_wait_ms, self.shm_threshold, self._queues[index], self._results),
+            daemon=True
+        )
+        process.start()
+        return process
+
+    def _dispatch(self, kind, prompt, kwargs, target):
+        """Send a job to the worker with the fewest jobs in flight"""
+        payload = _pack(prompt, self.shm_threshold)
+        with self._lock:
+            if self._closed:
+                _release(payload)
+                raise RuntimeError("WorkerPool is closed")
+            if len(self._retired) == len(self._workers):
+                _release(payload)
+                raise WorkerCrashedError(f"All model workers for {self.model_name} failed")
+            # Workers waiting for a restart take jobs too; they are served once the worker is up
+            load = [float("inf") if i in self._retired else 0 for i in range(len(self._workers))]
+            for worker_index, _, _ in self._pending.values():
+                load[worker_index] += 1
+            index = load.index(min(load))
+            job_id = next(self._job_ids)
+            self._pending[job_id] = (index, target, payload)
+            self._queues[index].put((job_id, kind, payload, kwargs))
+        return job_id
+
+    def _cancel(self, job_id):
+        """Drop a job the caller no longer waits for and tell its worker to stop it"""
+        with self._lock:
+            entry = self._pending.pop(job_id, None)
+            if entry is None:
+                return
+            index, _, payload = entry
+            _release(payload)
+            if not self._closed:
+                self._queues[index].put((job_id, "cancel", None, None))
+
+    def submit(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, prefix=None):
+        """Queue a prompt; returns a Future resolving to the LocalLLM.complete result"""
+        future = Future()
+        # Dispatched jobs cannot be withdrawn from a worker; a caller past its deadline stops waiting instead
+        future.set_running_or_notify_cancel()
+        self._dispatch("complete", prompt, {"max_new_tokens": max_new_tokens, "temperature": temperature,
+                                            "top_p": top_p, "stop": stop, "prefix": prefix}, future)
+        return future
+
+    def complete(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, prefix=None):
+        """Blocking variant of submit with the same signature as LocalLLM.complete"""
+        return self.submit(prompt, max_new_tokens, temperature, top_p, stop, prefix).result()
+
+    def stream_text(self, prompt, max_new_tokens=128, temperature=0.0, top_p=0.9, stop=None, stats=None):
+        """Yield text increments from a worker, see LocalLLM.stream_text"""
+        increments = queue.Queue()
+        job_id = self._dispatch("stream", prompt, {"max_new_tokens": max_new_tokens, "temperature": temperature,
+                                                   "top_p": top_p, "stop": stop}, increments)
+        finished = False
+        try:
+            while True:
+                kind, value = increments.get()
+                if kind == "chunk":
+                    yield value
+                    continue
+                finished = True
+                if kind == "error":
+                    raise value
+                if stats is not None:
+                    stats.update(value)
+                return
+        finally:
+            if not finished:  # The consumer stopped iterating
+                self._cancel(job_id)
+
+    def _collect_results(self):
+        while True:
+            try:
+                message = self._results.get()
+            except (EOFError, OSError):
+                return
+            if message is None:
+                return
+            kind, job_id, value = message
+            if kind == "ready":
+                print(f"Model worker {job_id} ready (pid {value})")
+                with self._lock:
+                    self._failures[job_id] = 0
+                continue
+            with self._lock:
+                entry = self._pending.get(job_id) if kind == "chunk" else self._pending.pop(job_id, None)
+            if entry is None:  # Job already failed because its worker died, or was cancelled
+                if kind == "done" and isinstance(value, dict) and "text" in value:
+                    _release(value["text"])  # A late reply still owns its shared memory block
+                continue
+            _, target, payload = entry
+            if kind != "chunk":
+                _release(payload)
+            if isinstance(target, Future):
+                if kind == "done":
+                    value["text"] = _unpack(value["text"], unlink=True)
+                    target.set_result(value)
+                else:
+                    target.set_exception(RuntimeError(value))
+            else:
+                target.put((kind, RuntimeError(value) if kind == "error" else value))
+
+    def _fail_jobs(self, index, error):
+        """Fail the jobs of a worker; called with the lock held"""
+        for job_id in [j for j, (i, _, _) in self._pending.items() if i == index]:
+            _, target, payload = self._pending.pop(job_id)
+            _release(payload)
+            if isinstance(target, Future):
+                target.set_exception(error)
+            else:
+                target.put(("error", error))
+
+    def _monitor_workers(self):
+        while True:
+            time.sleep(self.monitor_interval)
+            due = []
+            with self._lock:
+                if self._closed:
+                    return
+                now = time.monotonic()
+                for index, process in enumerate(self._workers):
+                    if index in self._retired or process.is_alive():
+                        continue
+                    if index not in self._restart_at:
+                        error = WorkerCrashedError(f"Model worker {index} exited with code {process.exitcode}")
+                        self._fail_jobs(index, error)
+                        self._failures[index] += 1
+                        if self._failures[index] > self.max_restarts:
+                            print(f"Model worker {index} exited with code {process.exitcode}, "
+                                  f"giving up after {self.max_restarts} restarts")
+                            self._retired.add(index)
+                            continue
+                        delay = min(self.monitor_interval * 2 ** (self._failures[index] - 1), MAX_RESTART_BACKOFF)
+                        print(f"Model worker {index} exited with code {process.exitcode}, restarting in {delay:.1f}s")
+                        self._restart_at[index] = now + delay
+                        # Jobs left in the old queue were failed; jobs sent from now on wait for the new worker
+                        self._queues[index] = self._context.Queue()
+                    if now >= self._restart_at[index]:
+                        del self._restart_at[index]
+                        due.append(index)
+            # Spawning takes a while, so dispatching goes on meanwhile
+            for index in due:
+                process = self._start_worker(index)
+                with self._lock:
+                    self._workers[index] = process
+                    self.restarts += 1
+                    closed = self._closed
+                if closed:  # close() ran while the process was starting
+                    process.terminate()
+
+    def close(self):
+        """Stop the workers after their queued jobs are served"""
+        with self._lock:
+            if self._closed:
+                return
+            self._closed = True
+        for jobs in self._queues:
+            jobs.put(None)
+        for process in self._workers:
+            process.join(timeout=10)
+            if process.is_alive():
+                process.terminate()
+        self._results.put(None)
+        self._collector.join(timeout=5)
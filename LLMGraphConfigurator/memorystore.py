@@ -0,0 +1,1295 @@
+"""
+Storage for memory registries (the memory_<name>.txt files of memory nodes)
+
+The text format of the log files is unchanged:
+
+    --- START LOG #<n> ---
+    <data>
+    --- END LOG #<n> ---
+
+Next to each log file a binary index (<file>.idx) holds one fixed-size record per
+entry: log number, byte offset and byte length. Appending only needs the last index
+record, so the cost of a write no longer grows with the history. Log files without
+an index, or with entries appended by other tools, are indexed on first use, which
+migrates files written in the old format.
+
+Each log object keeps the entries it has parsed together with the formatted history
+text, so a read only parses the entries appended since the previous read.
+
+With LLMTSUP_MEMORY_BACKEND=sqlite the registries live in one SQLite database
+(memory.sqlite3, WAL mode) instead, one table per registry. Either store is used
+through a MemoryTransaction that collects a request's writes and commits them
+together.
+
+SessionMemoryStore scopes registries per client session (e.g. per headset). It
+serves them from memory, persists new entries to the backing store in the
+background and evicts idle sessions.
+
+Memory nodes with a token budget output only the newest entries that fit, preceded
+by a rolling summary of the older ones. The summary is extended on a background
+thread, so reads never wait for the LLM; until it catches up, the previous summary
+is used.
+
+Memory nodes in recall mode output the entries most similar to the question instead.
+Entry embeddings are appended to a MemoryVectorIndex per registry as entries are
+written, so the index grows incrementally and is never rebuilt.
+
+Registries can be capped by size and age (set_retention, or LLMTSUP_MEMORY_MAX_KB and
+LLMTSUP_MEMORY_MAX_AGE_HOURS for all registries). A background thread moves the
+oldest entries beyond the caps into gzip-compressed archive segments next to the
+log (<log>.<first>-<last>.gz, in the text format), so reads only see the live
+segment. Log numbers continue after a compaction.
+"""
+import os
+import re
+import sys
+import gzip
+import time
+import atexit
+import struct
+import sqlite3
+import weakref
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+
+# Index record: log number, byte offset and byte length of the entry
+INDEX_RECORD = struct.Struct("<QQQ")
+# Append time of each entry, parallel to the index records
+TIME_RECORD = struct.Struct("<d")
+LOG_PATTERN = re.compile(rb"--- START LOG #(\d+) ---\r?\n(.*?)\r?\n--- END LOG #\d+ ---\r?\n\r?\n", re.DOTALL)
+
+
+def format_log_entry(number: int, data) -> str:
+    """How one entry is stored in a log file or archive segment"""
+    return f"--- START LOG #{number} ---\n{str(data)}\n--- END LOG #{number} ---\n\n"
+
+
+def format_history_entry(number: int, data: str) -> str:
+    """How one entry appears in the history text a memory node outputs"""
+    return f"History entry {number}: {data.strip()}\n\n"
+
+
+def normalize_memory_settings(memory) -> dict:
+    """
+    Validate the settings stored on graph memory nodes
+
+    Args:
+        memory: Dict with optional "max_tokens" (int, token budget of the node's output),
+            "summarize" (bool, fold entries outside the budget into a rolling summary; default True)
+            "recall_k" (int, output the k entries most similar to the question instead), "max_size_kb" and
+            "max_age_hours" (retention caps of the registry's live segment, see set_retention)
+
+    Returns:
+        dict: Only the keys that are set
+    """
+    settings = {}
+    if not memory:
+        return settings
+    unknown = set(memory) - {"max_tokens", "summarize", "recall_k", "max_size_kb", "max_age_hours"}
+    if unknown:
+        raise ValueError(f"Unsupported memory settings: {sorted(unknown)}")
+    if memory.get("max_tokens") is not None:
+        max_tokens = int(memory["max_tokens"])
+        if max_tokens < 1:
+            raise ValueError("max_tokens must be at least 1")
+        settings["max_tokens"] = max_tokens
+    if memory.get("summarize") is not None:
+        settings["summarize"] = bool(memory["summarize"])
+    if memory.get("recall_k") is not None:
+        recall_k = int(memory["recall_k"])
+        if recall_k < 1:
+            raise ValueError("recall_k must be at least 1")
+        settings["recall_k"] = recall_k
+    for key in ("max_size_kb", "max_age_hours"):
+        if memory.get(key) is not None:
+            value = float(memory[key])
+            if value <= 0:
+                raise ValueError(f"{key} must be positive")
+            settings[key] = value
+    return settings
+
+
+_retention = {}
+_retention_lock = threading.Lock()
+
+
+def set_retention(registry: str, max_bytes: int = None, max_age: float = None):
+    """
+    Cap the live segment of a registry; older entries are archived by the background compaction
+
+    Args:
+        registry: Registry name; the caps also apply to its per-session registries
+        max_bytes: Size cap of the live entries, None for LLMTSUP_MEMORY_MAX_KB
+        max_age: Age cap of the live entries in seconds, None for LLMTSUP_MEMORY_MAX_AGE_HOURS
+    """
+    with _retention_lock:
+        _retention[registry] = (max_bytes, max_age)
+
+
+def retention_for(registry: str):
+    """Size and age caps of a registry as (max_bytes, max_age), None where uncapped"""
+    with _retention_lock:
+        # Session registries are stored as <registry>.<session id>
+        caps = _retention.get(registry) or _retention.get(registry.rsplit(".", 1)[0])
+    max_bytes, max_age = caps or (None, None)
+    if max_bytes is None and os.environ.get("LLMTSUP_MEMORY_MAX_KB"):
+        max_bytes = int(float(os.environ["LLMTSUP_MEMORY_MAX_KB"]) * 1024)
+    if max_age is None and os.environ.get("LLMTSUP_MEMORY_MAX_AGE_HOURS"):
+        max_age = float(os.environ["LLMTSUP_MEMORY_MAX_AGE_HOURS"]) * 3600
+    return max_bytes, max_age
+
+
+def _compaction_cut(sizes, times, max_bytes, max_age, now) -> int:
+    """
+    Number of oldest entries to archive so the live segment meets the caps
+
+    Over the size cap, the live segment is cut to half the cap, so that compaction does not
+    run again after the next few appends. The newest entry always stays live, which keeps
+    the log numbering going in the text format.
+    """
+    cut, last = 0, len(sizes) - 1
+    if max_age is not None:
+        while cut < last and now - times[cut] > max_age:
+            cut += 1
+    if max_bytes is not None:
+        live = sum(sizes[cut:])
+        if live > max_bytes:
+            while cut < last and live > max_bytes // 2:
+                live -= sizes[cut]
+                cut += 1
+    return cut
+
+
+class TextMemoryLog:
+    """Append-only memory log in the text format with a sidecar offset index"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.index_path = path + ".idx"
+        self.times_path = path + ".times"
+        self.compactions = 0
+        self.file_prefix = path  # Vector indexes and archived segments are named <file_prefix>.*
+        self._lock = threading.Lock()
+        self._reset_view()
+
+    def _reset_view(self):
+        """Forget the parsed entries, e.g. after the log was cleared or rewritten"""
+        self._entries = []
+        self._history = ""
+        self._records_read = 0
+
+    def _last_record(self):
+        """Last index record as (number, offset, length), None for an empty or missing index"""
+        try:
+            with open(self.index_path, "rb") as f:
+                f.seek(0, os.SEEK_END)
+                if f.tell() < INDEX_RECORD.size:
+                    return None
+                f.seek(-INDEX_RECORD.size, os.SEEK_END)
+                return INDEX_RECORD.unpack(f.read(INDEX_RECORD.size))
+        except FileNotFoundError:
+            return None
+
+    def _sync_index(self):
+        """
+        Bring the index in line with the log file and return its last record
+
+        Only entries after the last indexed byte are scanned; a missing index or a shortened
+        log file (e.g. cleared by hand) is rebuilt from the start. Without a log file there is
+        nothing to index, and sidecars left behind by a removed log are deleted.
+        """
+        if not os.path.exists(self.path):
+            for path in (self.index_path, self.times_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            self._reset_view()
+            return None
+        size = os.path.getsize(self.path)
+        last = self._last_record() if os.path.exists(self.index_path) else None
+        indexed_end = last[1] + last[2] if last else 0
+        if not os.path.exists(self.index_path) or size < indexed_end:
+            open(self.index_path, "wb").close()
+            open(self.times_path, "wb").close()
+            last, indexed_end = None, 0
+            self._reset_view()
+        if size > indexed_end:
+            with open(self.path, "rb") as f:
+                f.seek(indexed_end)
+                tail = f.read()
+            with open(self.index_path, "ab") as index:
+                for match in LOG_PATTERN.finditer(tail):
+                    last = (int(match.group(1)), indexed_end + match.start(), match.end() - match.start())
+                    index.write(INDEX_RECORD.pack(*last))
+        return last
+
+    def append(self, data) -> int:
+        """Append one entry and return its log number"""
+        return self.append_many([data])[-1]
+
+    def append_many(self, items) -> list:
+        """Append several entries with one write to the log and one to the index; returns their numbers"""
+        with self._lock:
+            last = self._sync_index()
+            number = last[0] if last else 0
+            entries, records = [], []
+            with open(self.path, "ab") as f:
+                f.seek(0, os.SEEK_END)
+                offset = f.tell()
+                for data in items:
+                    number += 1
+                    entry = format_log_entry(number, data).encode("utf-8")
+                    records.append(INDEX_RECORD.pack(number, offset, len(entry)))
+                    entries.append(entry)
+                    offset += len(entry)
+                f.write(b"".join(entries))
+            with open(self.index_path, "ab") as index:
+                index.write(b"".join(records))
+                count = index.tell() // INDEX_RECORD.size
+            self._pad_times(count)
+            return [INDEX_RECORD.unpack(r)[0] for r in records]
+
+    def _pad_times(self, count: int):
+        """Give the first count entries an append time; entries indexed without one get the current time"""
+        size = os.path.getsize(self.times_path) if os.path.exists(self.times_path) else 0
+        missing = count - size // TIME_RECORD.size
+        if missing > 0:
+            with open(self.times_path, "ab") as f:
+                f.write(TIME_RECORD.pack(time.time()) * missing)
+
+    def _read_records(self, start: int = 0):
+        """Index records and append times from record start on"""
+        with open(self.index_path, "rb") as index:
+            index.seek(start * INDEX_RECORD.size)
+            records = list(INDEX_RECORD.iter_unpack(index.read()))
+        self._pad_times(start + len(records))
+        with open(self.times_path, "rb") as f:
+            f.seek(start * TIME_RECORD.size)
+            times = [t for (t,) in TIME_RECORD.iter_unpack(f.read(len(records) * TIME_RECORD.size))]
+        return records, times
+
+    def compact(self, max_bytes: int = None, max_age: float = None) -> int:
+        """
+        Move the oldest entries beyond the caps into a compressed archive segment
+
+        The lock is only held to plan the cut and to swap in the new files. Compressing the
+        archive and copying the kept entries happen without it, and entries appended in the
+        meantime are carried over at the swap.
+
+        Args:
+            max_bytes: Size cap of the live segment
+            max_age: Age cap of the live entries in seconds
+
+        Returns:
+            int: Number of archived entries
+        """
+        with self._lock:
+            if self._sync_index() is None:
+                return 0
+            records, times = self._read_records()
+        cut = _compaction_cut([length for _, _, length in records], times, max_bytes, max_age, time.time())
+        if cut == 0:
+            return 0
+        start, end = records[cut][1], records[-1][1] + records[-1][2]
+        archive_path = f"{self.file_prefix}.{records[0][0]}-{records[cut - 1][0]}.gz"
+        with open(self.path, "rb") as src, gzip.open(archive_path + ".tmp", "wb") as archive:
+            remaining = start
+            while remaining > 0:
+                chunk = src.read(min(remaining, 1 << 20))
+                if not chunk:
+                    break
+                archive.write(chunk)
+                remaining -= len(chunk)
+            kept = src.read(end - start)
+        with open(self.path + ".tmp", "wb") as f:
+            f.write(kept)
+
+        with self._lock:
+            self._sync_index()
+            new_records, new_times = self._read_records(cut)
+            if not new_records or new_records[0] != records[cut]:  # Cleared or rewritten meanwhile
+                for path in (archive_path + ".tmp", self.path + ".tmp"):
+                    os.remove(path)
+                return 0
+            with open(self.path, "rb") as src, open(self.path + ".tmp", "ab") as f:
+                src.seek(end)
+                f.write(src.read())
+            with open(self.index_path + ".tmp", "wb") as f:
+                f.write(b"".join(INDEX_RECORD.pack(n, offset - start, length) for n, offset, length in new_records))
+            with open(self.times_path + ".tmp", "wb") as f:
+                f.write(b"".join(TIME_RECORD.pack(t) for t in new_times))
+            # The archive is in place before any entry leaves the live segment
+            os.replace(archive_path + ".tmp", archive_path)
+            for path in (self.path, self.index_path, self.times_path):
+                os.replace(path + ".tmp", path)
+            self._reset_view()
+            self.compactions += 1
+        _drop_archived_vectors(self.file_prefix, records[cut][0])
+        return cut
+
+    def last_number(self) -> int:
+        """Number of the newest entry, 0 if the log is empty"""
+        with self._lock:
+            last = self._sync_index()
+            return last[0] if last else 0
+
+    def _read_new(self):
+        """Parse the entries indexed since the last read into the cached view"""
+        if not os.path.exists(self.path):
+            self._reset_view()
+            return
+        self._sync_index()
+        with open(self.index_path, "rb") as index:
+            index.seek(self._records_read * INDEX_RECORD.size)
+            records = list(INDEX_RECORD.iter_unpack(index.read()))
+        if not records:
+            return
+        start = records[0][1]
+        with open(self.path, "rb") as f:
+            f.seek(start)
+            content = f.read(records[-1][1] + records[-1][2] - start)
+        parts = []
+        for number, offset, length in records:
+            match = LOG_PATTERN.match(content, offset - start, offset - start + length)
+            if match:
+                data = match.group(2).decode("utf-8")
+                self._entries.append((number, data))
+                parts.append(format_history_entry(number, data))
+        self._records_read += len(records)
+        self._history += "".join(parts)
+
+    def entries(self):
+        """All entries as (log number, data) in the order they were written"""
+        with self._lock:
+            self._read_new()
+            return list(self._entries)
+
+    def history(self) -> str:
+        """All entries formatted with format_history_entry, as output by memory nodes"""
+        with self._lock:
+            self._read_new()
+            return self._history
+
+    def clear(self):
+        """Remove all entries, keeping empty files"""
+        with self._lock:
+            open(self.path, "w", encoding="utf-8").close()
+            open(self.index_path, "wb").close()
+            open(self.times_path, "wb").close()
+            remove_derived_files(self.file_prefix)
+            self._reset_view()
+
+    def delete(self):
+        """Remove the log and its sidecar files"""
+        with self._lock:
+            for path in (self.path, self.index_path, self.times_path):
+                if os.path.exists(path):
+                    os.remove(path)
+            remove_derived_files(self.file_prefix)
+            self._reset_view()
+
+
+_logs = {}
+_logs_lock = threading.Lock()
+
+
+def memory_log(path: str) -> TextMemoryLog:
+    """Shared log object for a memory file, so all workflows use the same lock"""
+    path = os.path.abspath(path)
+    with _logs_lock:
+        if path not in _logs:
+            _logs[path] = TextMemoryLog(path)
+        return _logs[path]
+
+
+class TextMemoryStore:
+    """Memory registries as memory_<name>.txt files in a directory"""
+
+    def __init__(self, directory: str):
+        self.directory = directory
+
+    def log(self, registry: str) -> TextMemoryLog:
+        return memory_log(os.path.join(self.directory, f"memory_{registry}.txt"))
+
+    def append_batch(self, batch):
+        """Append {registry: [data, ...]}; each registry is written with a single append"""
+        for registry, items in batch.items():
+            self.log(registry).append_many(items)
+
+    def clear(self, registry: str):
+        self.log(registry).clear()
+
+    def registries(self) -> list:
+        return [filename[len("memory_"):-len(".txt")] for filename in os.listdir(self.directory)
+                if re.fullmatch(r"memory_.*\.txt", filename)]
+
+    def compact(self, registry: str, max_bytes: int = None, max_age: float = None) -> int:
+        return self.log(registry).compact(max_bytes, max_age)
+
+    def delete_all(self):
+        """Delete all memory files and their indexes in the directory, including indexes whose log is gone"""
+        filenames = {re.sub(r"\.(idx|times)$", "", filename) for filename in os.listdir(self.directory)
+                     if re.fullmatch(r"memory_.*\.txt(\.idx|\.times)?", filename)}
+        for filename in sorted(filenames):
+            print(filename)
+            try:
+                memory_log(os.path.join(self.directory, filename)).delete()
+                print(f"Deleted: {filename}")
+            except Exception as e:
+                print(f"Failed to delete {filename}: {e}")
+
+
+class SQLiteMemoryLog:
+    """One registry table of a SQLiteMemoryStore, with the same interface as TextMemoryLog"""
+
+    def __init__(self, store, registry: str):
+        self.store = store
+        self.registry = registry
+        self.table = '"memory_' + registry.replace('"', '""') + '"'
+        self.file_prefix = os.path.join(os.path.dirname(os.path.abspath(store.db_path)), f"memory_{registry}")
+        self._lock = threading.Lock()
+        self._generation = None
+        self.compactions = 0
+        self._reset_view()
+
+    def _reset_view(self):
+        self._entries = []
+        self._history = ""
+        self._last_read = 0
+
+    def append(self, data) -> int:
+        """Append one entry in its own transaction and return its log number"""
+        return self.store.append_batch({self.registry: [data]})[self.registry][-1]
+
+    def append_many(self, items) -> list:
+        return self.store.append_batch({self.registry: list(items)})[self.registry]
+
+    def last_number(self) -> int:
+        connection = self.store.connection()
+        if not self.store.has_table(connection, self.registry):
+            return 0
+        return connection.execute(f"SELECT COALESCE(MAX(number), 0) FROM {self.table}").fetchone()[0]
+
+    def _read_new(self):
+        """Fetch entries after the last one read, using the primary key range"""
+        connection = self.store.connection()
+        generation = self.store.generation(connection, self.registry)
+        if generation != self._generation:  # Cleared since the last read
+            self._generation = generation
+            self._reset_view()
+        if not self.store.has_table(connection, self.registry):
+            return
+        rows = connection.execute(f"SELECT number, data FROM {self.table} WHERE number > ? ORDER BY number",
+                                  (self._last_read,)).fetchall()
+        if rows:
+            self._entries.extend(rows)
+            self._history += "".join(format_history_entry(number, data) for number, data in rows)
+            self._last_read = rows[-1][0]
+
+    def entries(self):
+        with self._lock:
+            self._read_new()
+            return list(self._entries)
+
+    def history(self) -> str:
+        with self._lock:
+            self._read_new()
+            return self._history
+
+    def clear(self):
+        self.store.clear(self.registry)
+
+    def delete(self):
+        self.store.clear(self.registry)
+
+
+class SQLiteMemoryStore:
+    """
+    Memory registries in one SQLite database in WAL mode, one table per registry
+
+    Appends run in transactions, so concurrent requests never share a log number.
+    Reads select by primary key range. Clearing a registry drops its table instead
+    of rewriting files.
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()  # One connection per thread
+        self._logs = {}
+        self._logs_lock = threading.Lock()
+        connection = self.connection()
+        connection.execute("CREATE TABLE IF NOT EXISTS registry_meta "
+                           "(registry TEXT PRIMARY KEY, generation INTEGER NOT NULL DEFAULT 0)")
+
+    def connection(self) -> sqlite3.Connection:
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            # Autocommit mode; transactions are opened explicitly
+            connection = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def log(self, registry: str) -> SQLiteMemoryLog:
+        with self._logs_lock:
+            if registry not in self._logs:
+                self._logs[registry] = SQLiteMemoryLog(self, registry)
+            return self._logs[registry]
+
+    @staticmethod
+    def has_table(connection, registry: str) -> bool:
+        return connection.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?",
+                                  ("memory_" + registry,)).fetchone() is not None
+
+    @staticmethod
+    def generation(connection, registry: str) -> int:
+        row = connection.execute("SELECT generation FROM registry_meta WHERE registry = ?", (registry,)).fetchone()
+        return row[0] if row else 0
+
+    def append_batch(self, batch):
+        """
+        Append {registry: [data, ...]} in a single transaction
+
+        Returns:
+            dict: The log numbers assigned per registry
+        """
+        connection = self.connection()
+        numbers = {}
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            for registry, items in batch.items():
+                table = self.log(registry).table
+                connection.execute(f"CREATE TABLE IF NOT EXISTS {table} "
+                                   "(number INTEGER PRIMARY KEY AUTOINCREMENT, data TEXT NOT NULL, created REAL)")
+                numbers[registry] = [connection.execute(f"INSERT INTO {table} (data, created) VALUES (?, ?)",
+                                                        (str(data), time.time())).lastrowid for data in items]
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        return numbers
+
+    def clear(self, registry: str):
+        """Drop the registry's table; readers notice through the generation counter"""
+        connection = self.connection()
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(f"DROP TABLE IF EXISTS {self.log(registry).table}")
+            connection.execute("INSERT INTO registry_meta (registry, generation) VALUES (?, 1) "
+                               "ON CONFLICT(registry) DO UPDATE SET generation = generation + 1", (registry,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        remove_derived_files(self.log(registry).file_prefix)
+
+    def registries(self) -> list:
+        tables = self.connection().execute("SELECT name FROM sqlite_master WHERE type = 'table' "
+                                           "AND name LIKE 'memory\\_%' ESCAPE '\\'").fetchall()
+        return [table[len("memory_"):] for (table,) in tables]
+
+    def compact(self, registry: str, max_bytes: int = None, max_age: float = None) -> int:
+        """
+        Move the oldest rows beyond the caps into a compressed archive segment
+
+        The archive is written from a read snapshot (WAL readers do not block writers); only
+        the final DELETE takes the write lock. Readers reload through the generation counter.
+
+        Returns:
+            int: Number of archived entries
+        """
+        connection = self.connection()
+        if not self.has_table(connection, registry):
+            return 0
+        log = self.log(registry)
+        rows = connection.execute(f"SELECT number, length(CAST(data AS BLOB)), created FROM {log.table} "
+                                  "ORDER BY number").fetchall()
+        now = time.time()
+        cut = _compaction_cut([size for _, size, _ in rows], [created or now for _, _, created in rows],
+                              max_bytes, max_age, now)
+        if cut == 0:
+            return 0
+        last_archived = rows[cut - 1][0]
+        archive_path = f"{log.file_prefix}.{rows[0][0]}-{last_archived}.gz"
+        with gzip.open(archive_path + ".tmp", "wt", encoding="utf-8") as archive:
+            for number, data in connection.execute(f"SELECT number, data FROM {log.table} WHERE number <= ? "
+                                                   "ORDER BY number", (last_archived,)):
+                archive.write(format_log_entry(number, data))
+        os.replace(archive_path + ".tmp", archive_path)
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            connection.execute(f"DELETE FROM {log.table} WHERE number <= ?", (last_archived,))
+            connection.execute("INSERT INTO registry_meta (registry, generation) VALUES (?, 1) "
+                               "ON CONFLICT(registry) DO UPDATE SET generation = generation + 1", (registry,))
+            connection.execute("COMMIT")
+        except Exception:
+            connection.execute("ROLLBACK")
+            raise
+        log.compactions += 1
+        _drop_archived_vectors(log.file_prefix, rows[cut][0])
+        return cut
+
+    def delete_all(self):
+        """Drop every registry table"""
+        for registry in self.registries():
+            self.clear(registry)
+            print(f"Deleted: memory_{registry}")
+
+
+def _estimate_tokens(text: str) -> int:
+    return max(1, len(text) // 4)
+
+
+class RollingSummary:
+    """Summary of the entries of a log that fell out of a memory node's token budget"""
+
+    def __init__(self):
+        self.text = ""
+        self.through = 0  # Number of the newest entry folded into the summary
+        self.updating = False
+        self.lock = threading.Lock()
+
+
+# Summaries per log object and token budget; they are rebuilt after a restart
+_summaries = weakref.WeakKeyDictionary()
+_summaries_lock = threading.Lock()
+# A single thread, so summaries are extended in order and never compete with requests for the LLM
+_summary_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-summary")
+
+
+def rolling_summary(log, max_tokens: int) -> RollingSummary:
+    with _summaries_lock:
+        return _summaries.setdefault(log, {}).setdefault(max_tokens, RollingSummary())
+
+
+def _extend_summary(summary: RollingSummary, entries, summarize, max_tokens: int):
+    """Fold entries into the summary in chunks of about max_tokens, so each call stays bounded"""
+    try:
+        chunk, size = [], 0
+        for i, (number, data) in enumerate(entries):
+            chunk.append((number, data))
+            size += _estimate_tokens(data)
+            if size >= max_tokens or i == len(entries) - 1:
+                text = summarize(summary.text, chunk)
+                with summary.lock:
+                    summary.text = (text or "").strip()
+                    summary.through = chunk[-1][0]
+                chunk, size = [], 0
+    except Exception as e:
+        print(f"Error summarizing memory: {e}")
+    finally:
+        with summary.lock:
+            summary.updating = False
+
+
+def budgeted_history(log, entries, max_tokens: int, summarize=None, count_tokens=None) -> str:
+    """
+    History text of a memory node with a token budget
+
+    The newest entries are kept while they fit. With a summarize callable the older entries
+    are represented by a rolling summary, which is extended in the background; the request
+    never waits for it and uses the summary as far as it got.
+
+    Args:
+        log: Log the entries come from; summaries are kept per log and budget
+        entries: (number, data) pairs in the order they were written
+        max_tokens: Token budget of the returned text
+        summarize: Called as summarize(previous_summary, new_entries) on the summary thread,
+            returns the new summary text; None drops older entries
+        count_tokens: Token counter for a text, defaults to ~4 characters per token
+
+    Returns:
+        str: The summary, if any, followed by the newest entries
+    """
+    count_tokens = count_tokens or _estimate_tokens
+    summary = None
+    header = ""
+    if summarize is not None:
+        summary = rolling_summary(log, max_tokens)
+        with summary.lock:
+            if not entries or summary.through > entries[-1][0]:  # The log was cleared
+                summary.text, summary.through = "", 0
+            if summary.text:
+                header = f"Summary of earlier history: {summary.text}\n\n"
+    used = count_tokens(header) if header else 0
+
+    recent = []
+    for number, data in reversed(entries):
+        text = format_history_entry(number, data)
+        tokens = count_tokens(text)
+        if used + tokens > max_tokens:
+            break
+        recent.append(text)
+        used += tokens
+    older = entries[:len(entries) - len(recent)]
+    if not older:
+        return "".join(reversed(recent))
+
+    if summary is not None:
+        with summary.lock:
+            new = [entry for entry in older if entry[0] > summary.through]
+            start = bool(new) and not summary.updating
+            if start:
+                summary.updating = True
+        if start:
+            _summary_executor.submit(_extend_summary, summary, new, summarize, max_tokens)
+    return header + "".join(reversed(recent))
+
+
+# Index file: a header with the embedding dimension, then (log number, float32 vector) records
+VECTOR_HEADER = struct.Struct("<I")
+
+
+class MemoryVectorIndex:
+    """
+    Normalized entry embeddings of one memory log for recall by cosine similarity
+
+    New entries are appended to the index file and to an in-memory matrix that grows by
+    doubling, so adding entries never rebuilds the index. A search is one matrix-vector
+    product, which is fast for the thousands of entries a registry holds.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.dim = None
+        self._numbers = np.zeros(0, dtype=np.int64)
+        self._vectors = np.zeros((0, 0), dtype=np.float32)
+        self._count = 0
+        self._file_size = 0
+        self._loaded = False
+
+    def _record_dtype(self):
+        return np.dtype([("number", "<u8"), ("vector", "<f4", (self.dim,))])
+
+    def _load(self):
+        """Read the index file on first use, and again if it was removed or truncated since"""
+        size = os.path.getsize(self.path) if os.path.exists(self.path) else 0
+        if self._loaded and size >= self._file_size:
+            return
+        self._reset()
+        self._loaded = True
+        if size < VECTOR_HEADER.size:
+            return
+        with open(self.path, "rb") as f:
+            self.dim = VECTOR_HEADER.unpack(f.read(VECTOR_HEADER.size))[0]
+            records = np.frombuffer(f.read(), dtype=self._record_dtype())
+        self._append_rows(records["number"].astype(np.int64), records["vector"])
+        self._file_size = size
+
+    def _append_rows(self, numbers, vectors):
+        needed = self._count + len(numbers)
+        if needed > len(self._numbers):
+            capacity = max(needed, 2 * len(self._numbers), 64)
+            grown_numbers = np.zeros(capacity, dtype=np.int64)
+            grown_vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+            if self._count:
+                grown_numbers[:self._count] = self._numbers[:self._count]
+                grown_vectors[:self._count] = self._vectors[:self._count]
+            self._numbers, self._vectors = grown_numbers, grown_vectors
+        self._numbers[self._count:needed] = numbers
+        self._vectors[self._count:needed] = vectors
+        self._count = needed
+
+    def last_number(self) -> int:
+        with self._lock:
+            self._load()
+            return int(self._numbers[self._count - 1]) if self._count else 0
+
+    def update(self, entries, embed_documents):
+        """
+        Embed the entries newer than the last indexed one and append them
+
+        Args:
+            entries: (number, data) pairs of the log in the order they were written
+            embed_documents: Embedding function for a list of texts, e.g. Embeddings.embed_documents
+        """
+        with self._lock:
+            self._load()
+            last = int(self._numbers[self._count - 1]) if self._count else 0
+            if entries and entries[-1][0] < last:  # The log was cleared while its index survived
+                if os.path.exists(self.path):
+                    os.remove(self.path)
+                self._reset()
+                self._loaded = True
+                last = 0
+            new = [(number, data) for number, data in entries if number > last]
+            if not new:
+                return
+            vectors = np.asarray(embed_documents([data for _, data in new]), dtype=np.float32)
+            vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+            if self.dim is None:
+                self.dim = vectors.shape[1]
+            elif vectors.shape[1] != self.dim:
+                raise ValueError(f"Embedding dimension {vectors.shape[1]} does not match index {self.path} ({self.dim})")
+            records = np.zeros(len(new), dtype=self._record_dtype())
+            records["number"] = [number for number, _ in new]
+            records["vector"] = vectors
+            with open(self.path, "ab") as f:
+                if f.tell() == 0:
+                    f.write(VECTOR_HEADER.pack(self.dim))
+                f.write(records.tobytes())
+                self._file_size = f.tell()
+            self._append_rows(records["number"].astype(np.int64), vectors)
+
+    def drop_before(self, number: int):
+        """Remove the vectors of entries older than number, e.g. after they were archived"""
+        with self._lock:
+            self._load()
+            keep = self._numbers[:self._count] >= number
+            if keep.all():
+                return
+            numbers, vectors = self._numbers[:self._count][keep], self._vectors[:self._count][keep]
+            records = np.zeros(len(numbers), dtype=self._record_dtype())
+            records["number"] = numbers
+            records["vector"] = vectors
+            with open(self.path + ".tmp", "wb") as f:
+                f.write(VECTOR_HEADER.pack(self.dim))
+                f.write(records.tobytes())
+            os.replace(self.path + ".tmp", self.path)
+            dim = self.dim
+            self._reset()
+            self.dim, self._loaded = dim, True
+            if len(numbers):
+                self._append_rows(numbers, vectors)
+            self._file_size = os.path.getsize(self.path)
+
+    def search(self, vector, k: int):
+        """Return up to k (log number, similarity) pairs, most similar first"""
+        with self._lock:
+            self._load()
+            if not self._count:
+                return []
+            query = np.asarray(vector, dtype=np.float32)
+            query /= max(float(np.linalg.norm(query)), 1e-12)
+            scores = self._vectors[:self._count] @ query
+            k = min(k, self._count)
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            return [(int(self._numbers[i]), float(scores[i])) for i in top]
+
+
+_vector_indexes = {}
+_vector_indexes_lock = threading.Lock()
+# Entries are embedded off the request path, one registry at a time
+_index_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="memory-index")
+
+
+def _shared_vector_index(path: str) -> MemoryVectorIndex:
+    path = os.path.abspath(path)
+    with _vector_indexes_lock:
+        if path not in _vector_indexes:
+            _vector_indexes[path] = MemoryVectorIndex(path)
+        return _vector_indexes[path]
+
+
+def vector_index(log, provider: str) -> MemoryVectorIndex:
+    """Shared vector index of a log; vectors of different embedding providers are kept apart"""
+    return _shared_vector_index(f"{log.file_prefix}.{provider}.vec")
+
+
+def _derived_files(prefix: str, pattern: str) -> list:
+    """Files named <prefix>.<pattern>; the pattern keeps e.g. session registries <name>.<session> apart"""
+    directory, name = os.path.split(os.path.abspath(prefix))
+    regex = re.compile(re.escape(name) + r"\." + pattern)
+    return [os.path.join(directory, f) for f in os.listdir(directory) if regex.fullmatch(f)]
+
+
+def remove_derived_files(prefix: str):
+    """Remove the vector indexes and archived segments of a log"""
+    for path in _derived_files(prefix, r"(\w+\.vec|\d+-\d+\.gz)"):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+
+def _drop_archived_vectors(prefix: str, first_live: int):
+    for path in _derived_files(prefix, r"\w+\.vec"):
+        _shared_vector_index(path).drop_before(first_live)
+
+
+def index_entries_async(log, provider: str, embed_documents):
+    """Embed the log's new entries into its vector index in the background"""
+    def run():
+        try:
+            vector_index(log, provider).update(log.entries(), embed_documents)
+        except Exception as e:
+            print(f"Error indexing memory: {e}")
+    return _index_executor.submit(run)
+
+
+def recalled_history(log, provider: str, embeddings, query_vector, k: int, max_tokens: int = None,
+                     count_tokens=None, pending=None) -> str:
+    """
+    History text of a memory node in recall mode: the k entries most similar to a query
+
+    Entries the background indexer has not reached yet are embedded first, so the result
+    always covers the whole log. Pending entries are embedded for this call only and
+    ranked together with the indexed ones.
+
+    Args:
+        log: Log to recall from
+        provider: Embedding provider name, selects the vector index
+        embeddings: Embedding backend with embed_documents
+        query_vector: Embedding of the current question
+        k: Maximum number of entries
+        max_tokens: Optional token budget; the most similar entries that fit are kept
+        count_tokens: Token counter for a text, defaults to ~4 characters per token
+        pending: (number, data) pairs not written to the log yet, e.g. of a MemoryTransaction
+
+    Returns:
+        str: The recalled entries in the order they were written
+    """
+    count_tokens = count_tokens or _estimate_tokens
+    entries = log.entries()
+    index = vector_index(log, provider)
+    index.update(entries, embeddings.embed_documents)
+    data = dict(entries)
+    ranked = index.search(query_vector, k)
+    if pending:
+        data.update(pending)
+        vectors = np.asarray(embeddings.embed_documents([text for _, text in pending]), dtype=np.float32)
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        query = np.asarray(query_vector, dtype=np.float32)
+        scores = vectors @ (query / max(float(np.linalg.norm(query)), 1e-12))
+        ranked += [(number, float(score)) for (number, _), score in zip(pending, scores)]
+        ranked = sorted(ranked, key=lambda pair: -pair[1])[:k]
+    selected, used = [], 0
+    for number, _ in ranked:
+        if number not in data:
+            continue
+        text = format_history_entry(number, data[number])
+        if max_tokens is not None:
+            tokens = count_tokens(text)
+            if used + tokens > max_tokens:
+                continue
+            used += tokens
+        selected.append((number, text))
+    return "".join(text for _, text in sorted(selected))
+
+
+class MemoryTransaction:
+    """
+    Collects the memory writes of one request (or one ask_questions chunk) and commits them together
+
+    Reads through the transaction see its own pending entries after the stored ones. Their
+    numbers are provisional until commit, when concurrent requests may have appended first.
+    """
+
+    def __init__(self, store):
+        self.store = store
+        self._pending = {}
+        self._lock = threading.Lock()
+
+    def append(self, registry: str, data):
+        with self._lock:
+            self._pending.setdefault(registry, []).append(data)
+
+    def history(self, registry: str) -> str:
+        log = self.store.log(registry)
+        text = log.history()
+        with self._lock:
+            pending = list(self._pending.get(registry, []))
+        if not pending:
+            return text
+        last = log.last_number()
+        return text + "".join(format_history_entry(last + i, str(data)) for i, data in enumerate(pending, 1))
+
+    def budgeted_history(self, registry: str, max_tokens: int, summarize=None, count_tokens=None) -> str:
+        """budgeted_history over the stored and pending entries of a registry"""
+        log = self.store.log(registry)
+        entries = log.entries()
+        with self._lock:
+            pending = list(self._pending.get(registry, []))
+        last = entries[-1][0] if entries else 0
+        entries += [(last + i, str(data)) for i, data in enumerate(pending, 1)]
+        return budgeted_history(log, entries, max_tokens, summarize, count_tokens)
+
+    def recalled_history(self, registry: str, provider: str, embeddings, query_vector, k: int,
+                         max_tokens: int = None, count_tokens=None) -> str:
+        """recalled_history over the stored and pending entries of a registry"""
+        log = self.store.log(registry)
+        with self._lock:
+            pending = list(self._pending.get(registry, []))
+        last = log.last_number()
+        pending = [(last + i, str(data)) for i, data in enumerate(pending, 1)]
+        return recalled_history(log, provider, embeddings, query_vector, k, max_tokens, count_tokens, pending)
+
+    def commit(self):
+        with self._lock:
+            pending, self._pending = self._pending, {}
+        if pending:
+            self.store.append_batch(pending)
+
+
+class SessionMemoryLog:
+    """A registry of one session held in memory; new entries wait in pending until persisted"""
+
+    def __init__(self, backing_log):
+        self.backing_log = backing_log
+        self.file_prefix = backing_log.file_prefix
+        self._lock = threading.Lock()
+        self._entries = None  # Loaded from the backing store on first use
+        self._compactions = 0
+        self._history = ""
+        self.pending = []
+
+    def _load(self):
+        # After the backing log was compacted, reload its live segment once nothing is pending
+        if self._entries is not None and not self.pending and self._compactions != self.backing_log.compactions:
+            self._entries = None
+        if self._entries is None:
+            self._compactions = self.backing_log.compactions
+            self._entries = self.backing_log.entries()
+            self._history = "".join(format_history_entry(number, data) for number, data in self._entries)
+
+    def append_many(self, items) -> list:
+        with self._lock:
+            self._load()
+            numbers = []
+            for data in items:
+                number = (self._entries[-1][0] if self._entries else 0) + 1
+                self._entries.append((number, str(data)))
+                self._history += format_history_entry(number, str(data))
+                self.pending.append(str(data))
+                numbers.append(number)
+            return numbers
+
+    def append(self, data) -> int:
+        return self.append_many([data])[-1]
+
+    def last_number(self) -> int:
+        with self._lock:
+            self._load()
+            return self._entries[-1][0] if self._entries else 0
+
+    def entries(self):
+        with self._lock:
+            self._load()
+            return list(self._entries)
+
+    def history(self) -> str:
+        with self._lock:
+            self._load()
+            return self._history
+
+    def take_pending(self):
+        with self._lock:
+            pending, self.pending = self.pending, []
+            return pending
+
+    def clear(self):
+        with self._lock:
+            self.backing_log.clear()
+            self._entries, self._history, self.pending = [], "", []
+
+
+class MemorySession:
+    """
+    Store view of one session, used by LLMWorkflow like any other memory store
+
+    A session evicted from the SessionMemoryStore while a request still holds it is
+    detached: the store no longer flushes it, so its writes go straight to the backing store.
+    """
+
+    def __init__(self, store, session_id: str):
+        self.store = store
+        self.session_id = session_id
+        self.logs = {}
+        self.last_used = time.monotonic()
+        self.detached = False
+        self._lock = threading.Lock()
+
+    def log(self, registry: str) -> SessionMemoryLog:
+        self.last_used = time.monotonic()
+        with self._lock:
+            if registry not in self.logs:
+                backing_log = self.store.backing.log(self.store.scoped_name(registry, self.session_id))
+                self.logs[registry] = SessionMemoryLog(backing_log)
+            return self.logs[registry]
+
+    def append_batch(self, batch):
+        numbers = {registry: self.log(registry).append_many(items) for registry, items in batch.items()}
+        if self.detached:
+            self.flush()
+        return numbers
+
+    def clear(self, registry: str):
+        self.log(registry).clear()
+
+    def delete_all(self):
+        for log in list(self.logs.values()):
+            log.clear()
+
+    def flush(self):
+        """Write pending entries of all registries to the backing store in one batch"""
+        batch = {}
+        with self._lock:
+            logs = list(self.logs.items())
+        for registry, log in logs:
+            pending = log.take_pending()
+            if pending:
+                batch[self.store.scoped_name(registry, self.session_id)] = pending
+        if batch:
+            self.store.backing.append_batch(batch)
+
+
+class SessionMemoryStore:
+    """
+    Bounded in-process cache of per-session memory registries over a backing store
+
+    Session registries are stored in the backing store as "<registry>.<session id>".
+    A background thread persists new entries every flush_interval seconds. It evicts
+    sessions idle for longer than idle_timeout, and the least recently used ones
+    beyond max_sessions, after persisting them; requests still holding an evicted
+    session write through to the backing store. Entries not yet persisted are lost
+    if the process dies.
+    """
+
+    def __init__(self, backing, max_sessions: int = 64, idle_timeout: float = 1800.0, flush_interval: float = 2.0):
+        self.backing = backing
+        self.max_sessions = max_sessions
+        self.idle_timeout = idle_timeout
+        self.flush_interval = flush_interval
+        self._sessions = OrderedDict()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+        self._thread.start()
+        atexit.register(self.close)
+
+    @staticmethod
+    def scoped_name(registry: str, session_id: str) -> str:
+        return f"{registry}.{session_id}"
+
+    @staticmethod
+    def clean_session_id(session_id) -> str:
+        """Session ids end up in file and table names, so only word characters and dashes are kept"""
+        return re.sub(r"[^\w\-]", "_", str(session_id))[:64]
+
+    def session(self, session_id) -> MemorySession:
+        session_id = self.clean_session_id(session_id)
+        evicted = []
+        with self._lock:
+            if session_id not in self._sessions:
+                self._sessions[session_id] = MemorySession(self, session_id)
+            self._sessions.move_to_end(session_id)
+            session = self._sessions[session_id]
+            session.last_used = time.monotonic()
+            while len(self._sessions) > self.max_sessions:
+                evicted.append(self._sessions.popitem(last=False)[1])
+                evicted[-1].detached = True
+        for old in evicted:
+            self._persist(old)
+        return session
+
+    def _persist(self, session: MemorySession):
+        try:
+            session.flush()
+        except (OSError, sqlite3.Error) as e:
+            print(f"Error persisting memory of session {session.session_id}: {e}")
+
+    def flush(self):
+        """Persist pending entries of all sessions and evict idle ones"""
+        now = time.monotonic()
+        with self._lock:
+            sessions = list(self._sessions.values())
+            idle = [s for s in sessions if now - s.last_used > self.idle_timeout]
+            for session in idle:
+                del self._sessions[session.session_id]
+                session.detached = True
+        for session in sessions:
+            self._persist(session)
+        for session in idle:
+            print(f"Evicted idle memory session {session.session_id}")
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+    def delete_all(self):
+        with self._lock:
+            self._sessions.clear()
+        self.backing.delete_all()
+
+    def close(self):
+        self._stop.set()
+        self.flush()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+_compactor = None
+
+
+def compact_stores():
+    """Archive entries beyond the retention caps in every registry of the stores in use"""
+    with _stores_lock:
+        stores = list(_stores.values())
+    for store in stores:
+        for registry in store.registries():
+            max_bytes, max_age = retention_for(registry)
+            if max_bytes is None and max_age is None:
+                continue
+            try:
+                archived = store.compact(registry, max_bytes, max_age)
+                if archived:
+                    print(f"Archived {archived} entries of memory registry {registry}")
+            except (OSError, sqlite3.Error) as e:
+                print(f"Error compacting memory registry {registry}: {e}")
+
+
+def _run_compactor(interval: float):
+    while True:
+        time.sleep(interval)
+        compact_stores()
+
+
+def get_memory_store(directory: str, backend: str = None):
+    """
+    Shared memory store for a directory
+
+    Args:
+        directory: Where memory files or the memory database live
+        backend: "text" or "sqlite"; defaults to LLMTSUP_MEMORY_BACKEND, else "text"
+    """
+    backend = backend or os.environ.get("LLMTSUP_MEMORY_BACKEND", "text")
+    key = (backend, os.path.abspath(directory))
+    with _stores_lock:
+        if key not in _stores:
+            if backend == "text":
+                _stores[key] = TextMemoryStore(directory)
+            elif backend == "sqlite":
+                _stores[key] = SQLiteMemoryStore(os.path.join(directory, "memory.sqlite3"))
+            else:
+                raise ValueError(f"Unsupported memory backend: {backend}")
+        global _compactor
+        if _compactor is None:
+            interval = float(os.environ.get("LLMTSUP_MEMORY_COMPACT_INTERVAL", "300"))
+            _compactor = threading.Thread(target=_run_compactor, args=(interval,), daemon=True)
+            _compactor.start()
+        return _stores[key]
+
+
+def migrate_memory_files(directory: str) -> int:
+    """Index every memory_*.txt file in directory; returns the number of files migrated"""
+    migrated = 0
+    for filename in os.listdir(directory):
+        if re.fullmatch(r"memory_.*\.txt", filename):
+            log = memory_log(os.path.join(directory, filename))
+            with log._lock:
+                last = log._sync_index()
+            print(f"Indexed {filename}: {last[0] if last else 0} as last log number")
+            migrated += 1
+    return migrated
+
+
+if __name__ == "__main__":
+    # python memorystore.py [directory]: build indexes for existing memory files
+    migrate_memory_files(sys.argv[1] if len(sys.argv) > 1 else os.path.dirname(os.path.abspath(__file__)))
@@ -0,0 +1,46 @@
+import os
+import sys
+
+import pytest
+
+# The configurator modules import each other as top-level modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+# No API keys or downloaded embedding models in tests
+os.environ.setdefault("LLMTSUP_PROVIDER", "fake")
+os.environ.setdefault("LLMTSUP_EMBEDDINGS", "fake")
+
+
+@pytest.fixture(scope="session")
+def tiny_models(tmp_path_factory):
+    """
+    Paths of a tiny random GPT-2 target model and a smaller draft model with the same tokenizer
+
+    The models are built from a config, so no download is needed; their output is nonsense
+    but deterministic, which is all the equivalence tests compare.
+    """
+    torch = pytest.importorskip("torch")
+    pytest.importorskip("transformers")
+    from tokenizers import Tokenizer, models, pre_tokenizers, decoders
+    from transformers import PreTrainedTokenizerFast, GPT2Config, GPT2LMHeadModel
+
+    # Byte-level vocabulary without merges: every byte is one token
+    vocab = {char: i for i, char in enumerate(sorted(pre_tokenizers.ByteLevel.alphabet()))}
+    vocab["<|endoftext|>"] = len(vocab)
+    backend = Tokenizer(models.BPE(vocab=vocab, merges=[]))
+    backend.pre_tokenizer = pre_tokenizers.ByteLevel(add_prefix_space=False)
+    backend.decoder = decoders.ByteLevel()
+    tokenizer = PreTrainedTokenizerFast(tokenizer_object=backend, bos_token="<|endoftext|>",
+                                        eos_token="<|endoftext|>", unk_token="<|endoftext|>")
+
+    directory = tmp_path_factory.mktemp("models")
+    paths = {}
+    for name, layers, seed in [("target", 4, 0), ("draft", 1, 1)]:
+        torch.manual_seed(seed)
+        # A wide weight init keeps the greedy output from collapsing into one repeated token
+        config = GPT2Config(vocab_size=len(tokenizer), n_positions=512, n_embd=64, n_layer=layers, n_head=4,
+                            initializer_range=0.5, eos_token_id=tokenizer.eos_token_id,
+                            bos_token_id=tokenizer.eos_token_id)
+        paths[name] = str(directory / name)
+        GPT2LMHeadModel(config).save_pretrained(paths[name])
+        tokenizer.save_pretrained(paths[name])
+    return paths
@@ -0,0 +1,72 @@
+import pytest
+
+PREFIX = "You are the engine assistant. Answer briefly. "
+QUESTIONS = ["Where is the oil filter?", "Lift the engine", "How tight is the bolt", "Reset everything now please"]
+
+
+@pytest.fixture(scope="module")
+def llm(tiny_models):
+    from localllm import LocalLLM
+    return LocalLLM(tiny_models["target"], device="cpu")
+
+
+@pytest.fixture(scope="module")
+def greedy(llm):
+    """Uncached, unbatched greedy completions of PREFIX + each question"""
+    return [llm.complete_batch([PREFIX + q], max_new_tokens=12)[0]["text"] for q in QUESTIONS]
+
+
+def test_batched_output_matches_unbatched(llm, greedy):
+    from localllm import BatchScheduler
+    batch_sizes = []
+    complete_batch = llm.complete_batch
+
+    def counting_complete_batch(prompts, *args, **kwargs):
+        batch_sizes.append(len(prompts))
+        return complete_batch(prompts, *args, **kwargs)
+
+    llm.complete_batch = counting_complete_batch
+    scheduler = BatchScheduler(llm, max_batch_size=8, max_wait_ms=200)
+    try:
+        futures = [scheduler.submit(PREFIX + q, max_new_tokens=12) for q in QUESTIONS]
+        texts = [future.result(timeout=60)["text"] for future in futures]
+    finally:
+        scheduler.close()
+        del llm.complete_batch
+    assert texts == greedy
+    assert max(batch_sizes) > 1
+
+
+def test_prefixed_requests_are_batched(llm, greedy):
+    from localllm import BatchScheduler
+    scheduler = BatchScheduler(llm, max_batch_size=8, max_wait_ms=200)
+    try:
+        futures = [scheduler.submit(PREFIX + q, max_new_tokens=12, prefix=PREFIX) for q in QUESTIONS]
+        texts = [future.result(timeout=60)["text"] for future in futures]
+    finally:
+        scheduler.close()
+    assert texts == greedy
+
+
+def test_prefix_cache_matches_uncached(llm, greedy):
+    first = [llm.complete(PREFIX + q, max_new_tokens=12, prefix=PREFIX) for q in QUESTIONS]
+    second = [llm.complete(PREFIX + q, max_new_tokens=12, prefix=PREFIX) for q in QUESTIONS]
+    assert [r["text"] for r in first] == greedy
+    assert [r["text"] for r in second] == greedy
+    assert all(r["cached_tokens"] > 0 for r in second)
+
+
+def test_speculative_matches_greedy(tiny_models, greedy):
+    from localllm import LocalLLM
+    speculative = LocalLLM(tiny_models["target"], device="cpu", draft_model_name=tiny_models["draft"])
+    results = [speculative.complete(PREFIX + q, max_new_tokens=12, prefix=PREFIX) for q in QUESTIONS]
+    assert [r["text"] for r in results] == greedy
+    assert all(r["draft_tokens"] > 0 for r in results)
+
+
+def test_closed_scheduler_rejects_requests(llm):
+    from localllm import BatchScheduler, SchedulerClosedError
+    scheduler = BatchScheduler(llm, max_batch_size=2, max_wait_ms=1)
+    scheduler.close()
+    with pytest.raises(SchedulerClosedError):
+        scheduler.submit("Lift the engine", max_new_tokens=2)
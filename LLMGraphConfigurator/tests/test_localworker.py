@@ -0,0 +1,40 @@
+import os
+import time
+import signal
+
+import pytest
+
+
+def _wait_for(condition, timeout=120):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.1)
+    return condition()
+
+
+def test_crashed_worker_is_restarted(tiny_models):
+    from localworker import WorkerPool
+    pool = WorkerPool(tiny_models["target"], num_workers=1, monitor_interval=0.1, max_restarts=1)
+    try:
+        expected = pool.complete("Lift the engine", max_new_tokens=4)["text"]
+        # Ready workers start over with their restart count, so repeated crashes keep being restarted
+        for restarts in range(1, 3):
+            os.kill(pool._workers[0].pid, signal.SIGKILL)
+            assert _wait_for(lambda: pool.restarts == restarts)
+            assert pool.submit("Lift the engine", max_new_tokens=4).result(timeout=120)["text"] == expected
+    finally:
+        pool.close()
+
+
+def test_worker_is_given_up_after_max_restarts(tmp_path):
+    from localworker import WorkerPool, WorkerCrashedError
+    pool = WorkerPool(str(tmp_path / "missing-model"), num_workers=1, monitor_interval=0.1, max_restarts=2)
+    try:
+        with pytest.raises(WorkerCrashedError):
+            pool.submit("Lift the engine", max_new_tokens=2).result(timeout=120)
+        assert _wait_for(lambda: pool._retired)
+        assert pool.restarts == 2
+        with pytest.raises(WorkerCrashedError):
+            pool.submit("Lift the engine", max_new_tokens=2)
+    finally:
+        pool.close()
@@ -0,0 +1,43 @@
+import pytest
+
+from memorystore import TextMemoryStore, SessionMemoryStore, MemoryTransaction
+
+
+@pytest.fixture
+def backing(tmp_path):
+    return TextMemoryStore(str(tmp_path))
+
+
+@pytest.fixture
+def sessions(backing):
+    """Session store whose background flush never runs during a test"""
+    store = SessionMemoryStore(backing, max_sessions=1, flush_interval=3600)
+    yield store
+    store._stop.set()
+
+
+def test_evicted_session_is_flushed(backing, sessions):
+    sessions.session("a").append_batch({"chat": ["hello"]})
+    assert backing.log("chat.a").entries() == []
+    sessions.session("b")
+    assert backing.log("chat.a").entries() == [(1, "hello")]
+    assert sessions.session("a").log("chat").entries() == [(1, "hello")]
+
+
+def test_session_evicted_while_in_use_writes_through(backing, sessions):
+    session = sessions.session("a")
+    transaction = MemoryTransaction(session)
+    transaction.append("chat", "hello")
+    sessions.session("b")
+    assert session.detached
+    transaction.commit()
+    assert backing.log("chat.a").entries() == [(1, "hello")]
+    assert sessions.session("a").log("chat").entries() == [(1, "hello")]
+
+
+def test_idle_session_is_flushed_and_evicted(backing, sessions):
+    sessions.idle_timeout = 0
+    sessions.session("a").append_batch({"chat": ["hello"]})
+    sessions.flush()
+    assert "a" not in sessions._sessions
+    assert backing.log("chat.a").entries() == [(1, "hello")]
@@ -0,0 +1,79 @@
+import os
+import json
+import shutil
+import asyncio
+
+import pytest
+
+import llmgraphbuilder
+import llmserverhost
+from admission import AdmissionQueue
+from llmclient import FakeLLMClient
+
+
+@pytest.fixture
+def server(tmp_path, monkeypatch):
+    """Server running the shipped graph on a slow fake LLM, with memory in a temporary directory"""
+    shutil.copy(os.path.join(llmgraphbuilder.script_dir, "graph.json"), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(llmgraphbuilder, "script_dir", str(tmp_path))
+    monkeypatch.setattr(llmserverhost, "admission_queue", AdmissionQueue(max_concurrency=1, max_queue=0))
+    monkeypatch.setitem(llmgraphbuilder._shared_clients, ("fake", ()), FakeLLMClient(latency=1.0))
+    return llmserverhost
+
+
+def _asgi_run(body, headers=()):
+    """POST body to /run of the ASGI app; returns status, headers and parsed body"""
+    messages = [{"type": "http.request", "body": json.dumps(body).encode(), "more_body": False}]
+    sent = []
+
+    async def receive():
+        if messages:
+            return messages.pop(0)
+        await asyncio.sleep(3600)  # The client stays connected
+
+    async def send(message):
+        sent.append(message)
+
+    scope = {"type": "http", "path": "/run", "method": "POST", "headers": list(headers)}
+    asyncio.run(llmserverhost.asgi_app(scope, receive, send))
+    return sent[0]["status"], dict(sent[0]["headers"]), json.loads(sent[1]["body"])
+
+
+def test_flask_deadline_returns_504(server):
+    response = server.app.test_client().post("/run", json="Lift the engine", headers={"X-Deadline-Ms": "200"})
+    assert response.status_code == 504
+    assert response.get_json()["reason"] == "deadline"
+    assert server.admission_queue.stats()["running"] == 0
+
+
+def test_flask_full_queue_returns_503(server):
+    server.admission_queue.acquire()
+    try:
+        response = server.app.test_client().post("/run", json="Lift the engine")
+    finally:
+        server.admission_queue.release()
+    assert response.status_code == 503
+    assert int(response.headers["Retry-After"]) >= 1
+
+
+def test_asgi_deadline_returns_504(server):
+    status, _, body = _asgi_run("Lift the engine", [(b"x-deadline-ms", b"200")])
+    assert status == 504
+    assert body["reason"] == "deadline"
+
+
+def test_asgi_full_queue_returns_503(server):
+    server.admission_queue.acquire()
+    try:
+        status, headers, body = _asgi_run("Lift the engine")
+    finally:
+        server.admission_queue.release()
+    assert status == 503
+    assert b"retry-after" in headers
+    assert body["reason"] == "queue_full"
+
+
+def test_invalid_priority_returns_400(server):
+    response = server.app.test_client().post("/run", json="Lift the engine", headers={"X-Priority": "bogus"})
+    assert response.status_code == 400
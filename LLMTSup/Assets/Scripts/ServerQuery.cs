@@ -69,7 +69,7 @@ public class PythonCaller : MonoBehaviour
 
     public IEnumerator SendQuestion(string question)
     {
-        string jsonData = JsonUtility.ToJson(new QuestionData { question = question + promptInjection });
+        string jsonData = JsonUtility.ToJson(new QuestionData { question = question + promptInjection, session_id = SystemInfo.deviceUniqueIdentifier, utterance_words = CountWords(question) });
         byte[] postData = Encoding.UTF8.GetBytes(jsonData);
         UnityWebRequest request = new UnityWebRequest(serverUrl, "POST");
         request.uploadHandler = new UploadHandlerRaw(postData);
@@ -96,7 +96,7 @@ public class PythonCaller : MonoBehaviour
     // New async method for awaitable results
     public async Task<string> GetAnswerAsync(string question)
     {
-        string jsonData = JsonUtility.ToJson(new QuestionData { question = question + promptInjection});
+        string jsonData = JsonUtility.ToJson(new QuestionData { question = question + promptInjection, session_id = SystemInfo.deviceUniqueIdentifier, utterance_words = CountWords(question) });
         byte[] postData = Encoding.UTF8.GetBytes(jsonData);
         UnityEngine.Debug.Log(promptInjection);
         using (UnityWebRequest request = new UnityWebRequest(serverUrl, "POST"))
@@ -179,6 +179,13 @@ public class PythonCaller : MonoBehaviour
     public class QuestionData
     {
         public string question;
+        public string session_id; // Keeps this headset's memory separate on the server
+        public int utterance_words; // Length of what the user said, without promptInjection; short commands are served first
+    }
+
+    private static int CountWords(string text)
+    {
+        return text.Split((char[])null, System.StringSplitOptions.RemoveEmptyEntries).Length;
     }
 
     [System.Serializable]